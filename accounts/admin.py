@@ -10,6 +10,7 @@ from .models import User
 class CustomUserAdmin(UserAdmin):
     add_form = CustomUserCreationForm
     form = CustomUserChangeForm
+    changelist_query_budget = 8
     list_select_related = ('client',)
     list_display = (
         'username',
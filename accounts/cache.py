@@ -0,0 +1,88 @@
+"""
+The authenticated user, and its client, read from the cache.
+
+CachedAuthenticationMiddleware stands in for AuthenticationMiddleware: the
+user of the session is loaded as by django.contrib.auth.get_user(), but from
+the default cache, where it's kept, joined to its client, for
+CIS_USER_CACHE_TIMEOUT seconds. With a session backend reading from the cache
+too, see SESSION_ENGINE, a request of a logged in user runs no query before
+its view. A save or delete of the user or of its client drops the user from
+the cache. Updates through QuerySet.update() don't, so they show once the
+user expires from the cache. A cache per process wouldn't see the drops of
+the others, so without a shared cache, CIS_USER_CACHE_TIMEOUT defaults to 0.
+"""
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model, load_backend
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from cis.metrics import CACHE_REQUESTS
+from cis.models import Client
+from .models import User
+
+
+def user_cache_key(pk) -> str:
+    return f'accounts:user:{pk}'
+
+
+def get_user(request):
+    """The user of the session, from the cache if there, else from its authentication backend"""
+
+    try:
+        pk = get_user_model()._meta.pk.to_python(request.session[SESSION_KEY])
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    timeout = getattr(settings, 'CIS_USER_CACHE_TIMEOUT', 0)
+    user = cache.get(user_cache_key(pk)) if timeout else None
+    if user is not None:
+        CACHE_REQUESTS.inc(cache='user', result='hit')
+    else:
+        user = load_backend(backend_path).get_user(pk)
+        if user is None:
+            return AnonymousUser()
+        if timeout:
+            CACHE_REQUESTS.inc(cache='user', result='miss')
+            # with its client, joined by UserClientManager
+            cache.set(user_cache_key(pk), user, timeout)
+
+    # a session from before the password was changed is logged out
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+        request.session.flush()
+        return AnonymousUser()
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware, loading the user through get_user()"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+    async def __acall__(self, request):
+        # as MiddlewareMixin, without running process_request() in a thread, as it doesn't block
+        self.process_request(request)
+        return await self.get_response(request)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def uncache_user(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
+
+
+# the users of a deleted client are deleted, and uncached, with it
+@receiver(post_save, sender=Client)
+def uncache_client_users(sender, instance, **kwargs):
+    cache.delete_many([user_cache_key(pk) for pk in User.objects.filter(client=instance).values_list('pk', flat=True)])
@@ -1,5 +1,9 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from .models import User
 from cis.models import Client
@@ -27,3 +31,48 @@ class UserTest(TestCase):
             self.user.pk = None
             self.user.save()
         self.user.pk = 1
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    CIS_USER_CACHE_TIMEOUT=300,
+)
+class CachedUserTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_a = Client.objects.create(name='Client A')
+        cls.user = User.objects.create_user(username='new', email='new@example.com', client=cls.client_a)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_warm_cache_runs_no_query_for_the_session_and_user(self):
+        url = reverse('cis:ci_list', args=(0,))
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context['user'], self.user)
+        self.assertEqual(response.context['user'].client, self.client_a)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('accounts_user', tables)
+        self.assertNotIn('FROM "cis_client"', tables)
+
+    def test_saving_the_user_or_its_client_drops_it_from_the_cache(self):
+        url = reverse('cis:ci_list', args=(0,))
+        self.client.get(url)
+        self.client_a.name = 'Client A2'
+        self.client_a.save()
+        self.assertEqual(self.client.get(url).context['user'].client.name, 'Client A2')
+
+        self.user.client = None
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_password_change_logs_the_session_out(self):
+        self.assertTrue(self.client.get(reverse('homepage')).context['user'].is_authenticated)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertFalse(self.client.get(reverse('homepage')).context['user'].is_authenticated)
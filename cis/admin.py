@@ -1,16 +1,31 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.admin import AdminSite
-from django.db import DatabaseError, transaction
-from django.db.models import QuerySet
-from django.urls import reverse
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db import DatabaseError, router, transaction
+from django.db.models import Count, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import path, reverse
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseRedirect
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import ngettext
 
+from . import approval
+from .export import stream_csv, values_rows
+from .filters import AutocompleteFilter, CredentialUsernameFilter
+from .forms import PaginatedInlineFormSet
 from .models import (
     Client, Place, ISP, Circuit,
-    CI, Manufacturer, Appliance, Contract, CIPack
+    CI, Credential, Manufacturer, Appliance, Contract, CIPack, ApprovalJob
 )
+from .paginators import EstimatedCountPaginator
+from .search import search
 
 
 SITE = 'Internalize'
@@ -27,6 +42,188 @@ class ClientLinkMixin:
         return format_html('<a href="{}">{}</a>', url, obj.client.name)
 
 
+class ApprovalMixin:
+    """Run an approval, in background when it's too large, and tell the user about it"""
+
+    def run_approval(self, request, ci_pks, success_message, count, pack_pks=()):
+        """Approve the CIs, or without them, every CI of the packs"""
+
+        try:
+            if ci_pks is None:
+                job = approval.approve_packs(pack_pks, request.user)
+            else:
+                job = approval.approve(ci_pks, request.user, pack_pks)
+        except DatabaseError as e:
+            raise DatabaseError(f'An error occurred during the approval: {e}')
+
+        if job is None:
+            self.message_user(request, ngettext(*success_message, count), level=messages.SUCCESS)
+            return
+        url = reverse('admin:cis_approvaljob_change', args=(job.pk,))
+        self.message_user(
+            request,
+            format_html(
+                'The approval of {} CIs is running in background. '
+                '<a href="{}">Follow its progress.</a>', job.total, url,
+            ),
+            level=messages.INFO,
+        )
+
+
+class BulkListEditableMixin:
+    """
+    Save the rows edited on the changelist with a bulk_update per set of edited
+    columns, instead of a save() per row, which writes every column
+    (and for a CI, its Credential row, re-encrypting it).
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'POST' or '_save' not in request.POST:
+            return super().changelist_view(request, extra_context)
+
+        # filled by save_model(), keyed by the edited columns
+        request.list_editable_rows = defaultdict(list)
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            response = super().changelist_view(request, extra_context)
+            for fields, objs in request.list_editable_rows.items():
+                self.model._default_manager.bulk_update(objs, fields)
+        return response
+
+    def save_model(self, request, obj, form, change):
+        rows = getattr(request, 'list_editable_rows', None)
+        if rows is None:
+            return super().save_model(request, obj, form, change)
+        rows[tuple(form.changed_data)].append(obj)
+
+
+class ExportChangeList(ChangeList):
+    """A ChangeList skipping the count and the page of its rows when built for a CSV export"""
+
+    def get_results(self, request):
+        if not getattr(request, 'csv_export', False):
+            return super().get_results(request)
+        # only the filtered, searched and sorted queryset is exported
+        self.result_count = self.full_result_count = None
+        self.result_list = self.queryset.none()
+        self.can_show_all = self.multi_page = False
+
+
+class CSVExportMixin:
+    """
+    Export the selected rows, through an action, or the filtered changelist,
+    through a button, as a streamed CSV of export_fields.
+    The export_credential_fields are only added on demand,
+    for the users who can change the model.
+    """
+
+    change_list_template = 'admin/cis/change_list_export.html'
+    export_fields = ()
+    export_credential_fields = ()
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            path('export/', self.admin_site.admin_view(self.export_view), name='%s_%s_export' % info),
+            path('export/credentials/', self.admin_site.admin_view(self.export_view), {'credentials': True},
+                 name='%s_%s_export_credentials' % info),
+            *super().get_urls(),
+        ]
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {
+            **(extra_context or {}),
+            'export_credentials_allowed': self.has_export_credentials_permission(request),
+        }
+        return super().changelist_view(request, extra_context)
+
+    def get_changelist(self, request, **kwargs):
+        return ExportChangeList
+
+    def has_export_credentials_permission(self, request):
+        return bool(self.export_credential_fields) and self.has_change_permission(request)
+
+    def export_view(self, request, credentials=False):
+        """Export the rows of the changelist, as filtered, searched and sorted by the query string"""
+
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if credentials and not self.has_export_credentials_permission(request):
+            raise PermissionDenied
+        request.csv_export = True
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            opts = self.model._meta
+            return HttpResponseRedirect(reverse(f'admin:{opts.app_label}_{opts.model_name}_changelist') + '?e=1')
+        return self.export(changelist.queryset, credentials)
+
+    def export(self, queryset, credentials=False):
+        fields = [*self.export_fields, *(self.export_credential_fields if credentials else ())]
+        rows = self.get_export_rows(queryset, fields)
+        return stream_csv(fields, rows, f'{self.model._meta.model_name}.csv')
+
+    def get_export_rows(self, queryset, fields):
+        return values_rows(queryset, fields)
+
+    @admin.action(description='Export selected %(verbose_name_plural)s as CSV', permissions=['view'])
+    def export_csv(self, request, queryset: QuerySet):
+        return self.export(queryset)
+
+    @admin.action(description='Export selected %(verbose_name_plural)s as CSV, with credentials',
+                  permissions=['export_credentials'])
+    def export_csv_with_credentials(self, request, queryset: QuerySet):
+        return self.export(queryset, credentials=True)
+
+
+class IndexedSearchMixin:
+    """Run the changelist search through the indexed search of the model"""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search(queryset, search_term), False
+
+
+class LargeChangelistMixin:
+    """
+    With the setting CIS_ADMIN_LARGE_CHANGELISTS, estimate the number of rows
+    instead of counting them, and pick the objects of the filters listed in
+    autocomplete_list_filter through the autocomplete instead of listing them all.
+    """
+
+    autocomplete_list_filter = ()
+
+    @property
+    def large_changelists(self):
+        return getattr(settings, 'CIS_ADMIN_LARGE_CHANGELISTS', False)
+
+    @property
+    def show_full_result_count(self):
+        return not self.large_changelists
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.large_changelists:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if not self.large_changelists:
+            return list_filter
+        return [
+            (item, AutocompleteFilter) if item in self.autocomplete_list_filter else item
+            for item in list_filter
+        ]
+
+    @property
+    def media(self):
+        media = super().media
+        if self.large_changelists and self.autocomplete_list_filter:
+            field = self.model._meta.get_field(self.autocomplete_list_filter[0])
+            media += AutocompleteSelect(field, self.admin_site).media
+        return media
+
+
 class PlaceInline(admin.TabularInline):
     model = Place
     extra = 1
@@ -34,13 +231,18 @@ class PlaceInline(admin.TabularInline):
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
+    changelist_query_budget = 8
     list_display = ('name', 'view_places')
     search_fields = ('name', 'place__name')
     view_on_site = False
     inlines = (PlaceInline,)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('place_set')
+
     @admin.display(description='Places')
     def view_places(self, obj):
+        # prefetched by get_queryset()
         places = obj.place_set.all()
         places_link_list = ['<ul>']
         for place in places:
@@ -51,7 +253,24 @@ class ClientAdmin(admin.ModelAdmin):
         return mark_safe('\n'.join(places_link_list))
 
 
-class CIInline(admin.TabularInline):
+class PaginatedInlineMixin:
+    """Show the related objects page by page, per_page at a time"""
+
+    formset = PaginatedInlineFormSet
+    template = 'admin/cis/paginated_tabular.html'
+
+    @property
+    def per_page(self):
+        return getattr(settings, 'CIS_ADMIN_INLINE_PER_PAGE', PaginatedInlineFormSet.per_page)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.query_params = request.GET
+        return formset
+
+
+class CIInline(PaginatedInlineMixin, admin.TabularInline):
     model = CI
     extra = 0
     max_num = 0  # prevents the link `add another` from appearing
@@ -59,18 +278,27 @@ class CIInline(admin.TabularInline):
     readonly_fields = ('description', 'deployed', 'business_impact', 'contract', 'status', 'pack')
     show_change_link = True
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('place__client', 'contract', 'pack__responsible')
+
 
 @admin.register(Place)
-class PlaceAdmin(admin.ModelAdmin, ClientLinkMixin):
+class PlaceAdmin(LargeChangelistMixin, admin.ModelAdmin, ClientLinkMixin):
+    changelist_query_budget = 8
     list_display = ('name', 'client_link', 'description')
     list_filter = ('client',)
+    autocomplete_list_filter = ('client',)
     list_editable = ('description',)
     search_fields = ('name', 'client__name', 'description')
     inlines = (CIInline,)
 
 
 @admin.register(Appliance)
-class ApplianceAdmin(admin.ModelAdmin, ClientLinkMixin):
+class ApplianceAdmin(
+    LargeChangelistMixin, BulkListEditableMixin, CSVExportMixin, IndexedSearchMixin, admin.ModelAdmin,
+    ClientLinkMixin,
+):
+    changelist_query_budget = 10
     list_display = (
         'serial_number',
         'client_link',
@@ -79,12 +307,21 @@ class ApplianceAdmin(admin.ModelAdmin, ClientLinkMixin):
         'virtual',
     )
     list_filter = ('client', 'manufacturer', 'virtual')
+    autocomplete_list_filter = ('client', 'manufacturer')
     list_editable = ('model', 'virtual')
-    search_fields = ('serial_number', 'model', 'client', 'manufacturer')
+    search_fields = ('serial_number', 'model')
+    actions = ['export_csv']
+    export_fields = ('serial_number', 'client__name', 'manufacturer__name', 'model', 'virtual')
     #autocomplete_fields = ('client', 'manufacturer')
 
+    def get_queryset(self, request):
+        # list_select_related is ignored when the manager already joins the manufacturer
+        return super().get_queryset(request).select_related('client')
+
     @admin.display(description='Manufacturer', ordering='manufacturer__name')
     def manufacturer_link(self, obj):
+        if obj.manufacturer is None:
+            return self.get_empty_value_display()
         url = f'{reverse("admin:cis_manufacturer_change", args={obj.manufacturer.pk})}'
         return format_html('<a href="{}">{}</a>', url, obj.manufacturer.name)
 
@@ -96,19 +333,23 @@ class ApplianceInline(admin.TabularInline):
 
 @admin.register(Manufacturer)
 class ManufacturerAdmin(admin.ModelAdmin):
+    changelist_query_budget = 7
     list_display = ('name', 'view_appliances')
     search_fields = ('name',)
     inlines = (ApplianceInline,)
 
-    @admin.display(description='Appliances')
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_appliances=Count('appliance'))
+
+    @admin.display(description='Appliances', ordering='num_appliances')
     def view_appliances(self, obj):
-        count = obj.appliance_set.count()
         url = f'{reverse("admin:cis_appliance_changelist")}?manufacturer__id__exact={obj.pk}'
-        return format_html('<a href="{}">{} Appliances</a>', url, count)
+        return format_html('<a href="{}">{} Appliances</a>', url, obj.num_appliances)
 
 
 @admin.register(Contract)
 class ContractAdmin(admin.ModelAdmin):
+    changelist_query_budget = 9
     FIELDS = ('name', 'begin', 'end', 'description')
 
     date_hierarchy = 'begin'
@@ -118,8 +359,28 @@ class ContractAdmin(admin.ModelAdmin):
     inlines = (CIInline,)
 
 
+class CredentialInline(admin.StackedInline):
+    model = Credential
+    fields = (('username', 'password', 'enable_password'), 'instructions')
+    can_delete = False
+    classes = ('collapse',)
+
+
+class CIChangeList(ExportChangeList):
+    """Sort the CIs by the numeric order of their addresses, through CI.ip_key"""
+
+    def get_ordering_field(self, field_name):
+        if field_name == 'ip':
+            return 'ip_key'
+        return super().get_ordering_field(field_name)
+
+
 @admin.register(CI)
-class CIAdmin(admin.ModelAdmin, ClientLinkMixin):
+class CIAdmin(
+    LargeChangelistMixin, BulkListEditableMixin, CSVExportMixin, ApprovalMixin, IndexedSearchMixin, admin.ModelAdmin,
+    ClientLinkMixin,
+):
+    changelist_query_budget = 12
     list_display = (
         'hostname',
         'client_link',
@@ -133,8 +394,15 @@ class CIAdmin(admin.ModelAdmin, ClientLinkMixin):
         'view_appliances',
         'pack',
     )
-    list_filter = ('pack', 'status', 'client__name', 'place', 'deployed', 'contract')
-    actions = ['approve_selected_cis']
+    list_filter = ('pack', 'status', 'client', 'place', 'deployed', 'contract', CredentialUsernameFilter)
+    autocomplete_list_filter = ('pack', 'client', 'place', 'contract')
+    search_fields = ('hostname', 'ip', 'description')
+    actions = ['approve_selected_cis', 'export_csv', 'export_csv_with_credentials']
+    export_fields = (
+        'hostname', 'ip', 'description', 'client__name', 'place__name', 'deployed',
+        'business_impact', 'contract__name', 'status', 'pack__sent_at',
+    )
+    export_credential_fields = tuple(f'credential__{name}' for name in Credential.FIELDS)
     readonly_fields = ('status',)
     fieldsets = (
         ('Client', {'fields': ((), ('client', 'place',))}),
@@ -144,84 +412,119 @@ class CIAdmin(admin.ModelAdmin, ClientLinkMixin):
             ('description', 'business_impact'),
         )}),
         ('Contract', {'fields': ('contract',)}),
-        ('Credentials', {
-            'fields': (
-                (),
-                ('username', 'password', 'enable_password', 'instructions')),
-            'classes': ('collapse',),
-        }),
         ('Management', {
             'fields': ('status',),
         })
     )
     filter_horizontal = ('appliances',)
+    inlines = (CredentialInline,)
     list_editable = (
         'ip',
         'description',
         'deployed',
         'business_impact',
     )
-    list_select_related = ('contract', 'client', 'place', 'pack')
+    list_select_related = ('contract', 'client', 'place', 'pack__responsible')
+
+    def get_changelist(self, request, **kwargs):
+        return CIChangeList
+
+    def get_queryset(self, request):
+        # a subquery rather than a join, so the exports don't group the CIs
+        appliances = (
+            CI.appliances.through.objects.filter(ci=OuterRef('pk'))
+            .order_by().values('ci').annotate(count=Count('*')).values('count')
+        )
+        return super().get_queryset(request).annotate(num_appliances=Coalesce(Subquery(appliances), 0))
+
+    def get_export_rows(self, queryset, fields):
+        if not set(self.export_credential_fields) & set(fields):
+            return super().get_export_rows(queryset, fields)
+        # the credentials saved as records have their values in the record only
+        rows = super().get_export_rows(queryset, [*fields, 'credential__record'])
+        positions = [fields.index(f'credential__{name}') for name in Credential.FIELDS]
+        return (self._unpack_record(row, positions) for row in rows)
+
+    @staticmethod
+    def _unpack_record(row, positions):
+        *values, record = row
+        if record is not None:
+            for position, name in zip(positions, Credential.FIELDS):
+                values[position] = record[name]
+        return values
 
     @admin.display(description='Place', ordering='place__name')
     def place_link(self, obj):
         url = f'{reverse("admin:cis_place_change", args={obj.place.pk})}'
         return format_html('<a href="{}">{}</a>', url, obj.place.name)
 
-    @admin.display(description='Appliances')
+    @admin.display(description='Appliances', ordering='num_appliances')
     def view_appliances(self, obj):
-        count = obj.appliances.count()
         url = f'{reverse("admin:cis_appliance_changelist")}?ci__exact={obj.pk}'
-        return format_html('<a href="{}">{} Appliances</a>', url, count)
+        return format_html('<a href="{}">{} Appliances</a>', url, obj.num_appliances)
 
     @admin.action(description='Mark selected CIs as approved')
     def approve_selected_cis(self, request, queryset: QuerySet):
-        # todo Write test
-        pack_ids = set(queryset.values_list('pack', flat=True))
-        try:
-            with transaction.atomic():
-                count = queryset.update(status=2)
-                CIPack.objects.filter(pk__in=pack_ids).update(approved_by=request.user)
-            self.message_user(
-                request,
-                ngettext(
-                    'The selected CI was approved successfully.',
-                    'The selected CIs were approved successfully.',
-                    count
-                ),
-                level=messages.SUCCESS,
-            )
-        except DatabaseError as e:
-            raise DatabaseError(f'An error occurred during the approval: {e}')
+        ci_pks = list(queryset.values_list('pk', flat=True))
+        self.run_approval(request, ci_pks, (
+            'The selected CI was approved successfully.',
+            'The selected CIs were approved successfully.',
+        ), len(ci_pks))
 
 
 @admin.register(CIPack)
-class CIPackAdmin(admin.ModelAdmin):
-    FIELDS = ('sent_at', 'responsible', 'percentage_of_cis_approved', 'approved_by')
+class CIPackAdmin(CSVExportMixin, ApprovalMixin, admin.ModelAdmin):
+    changelist_query_budget = 10
+    FIELDS = ('sent_at', 'client', 'responsible', 'percentage_of_cis_approved', 'approved_by')
 
     list_display = FIELDS
-    actions = ['approve_all_cis']
-    list_filter = ('responsible', 'sent_at', 'approved_by')
+    actions = ['approve_all_cis', 'export_csv']
+    export_fields = ('id', 'sent_at', 'client__name', 'responsible__email', 'approved_by__email',
+                     'num_cis', 'num_cis_approved')
+    list_filter = ('client', 'responsible', 'sent_at', 'approved_by')
+    search_fields = ('responsible__email',)
     readonly_fields = FIELDS
     inlines = (CIInline,)
 
+    def get_queryset(self, request):
+        # list_select_related is ignored when the manager already joins the responsible
+        return super().get_queryset(request).select_related('client', 'approved_by').with_approval_counts()
+
     @admin.action(description="Approve all CIs of selected CIPacks")
     def approve_all_cis(self, request, queryset: QuerySet):
-        try:
-            with transaction.atomic():
-                for pack in queryset:
-                    pack.approve_all_cis()
-            self.message_user(
-                request,
-                ngettext(
-                    'The selected CI pack was approved successfully.',
-                    'The selected CI packs were approved successfully.',
-                    len(queryset)
-                ),
-                level=messages.SUCCESS,
-            )
-        except DatabaseError as e:
-            raise DatabaseError(f'An error occurred during the approval: {e}')
+        pack_pks = list(queryset.values_list('pk', flat=True))
+        # the pks of the CIs are read a chunk at a time
+        self.run_approval(request, None, (
+            'The selected CI pack was approved successfully.',
+            'The selected CI packs were approved successfully.',
+        ), len(pack_pks), pack_pks)
+
+
+@admin.register(ApprovalJob)
+class ApprovalJobAdmin(admin.ModelAdmin):
+    changelist_query_budget = 7
+    FIELDS = ('created_at', 'requested_by', 'status', 'progress', 'done', 'total', 'finished_at')
+
+    list_display = FIELDS
+    list_filter = ('status', 'created_at')
+    fields = (*FIELDS, 'error')
+    readonly_fields = fields
+    actions = ['resume_jobs']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Resume selected jobs')
+    def resume_jobs(self, request, queryset: QuerySet):
+        jobs = queryset.exclude(status=2)
+        for job in jobs:
+            approval.schedule(job)
+        self.message_user(
+            request,
+            ngettext('%d job was resumed.', '%d jobs were resumed.', len(jobs)) % len(jobs),
+            level=messages.SUCCESS,
+        )
+
 
 # admin.site.register(ISP)
 # admin.site.register(Circuit)
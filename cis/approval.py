@@ -0,0 +1,179 @@
+"""
+Bulk approval of CIs in bounded chunks.
+
+Each chunk is approved in its own short transaction, so a large approval
+doesn't lock the CI table for its whole length. Above a threshold, the work is
+recorded as an ApprovalJob and run by a background thread of the process.
+
+A job is claimed by the thread running it, and its updated_at is saved with
+each chunk. A job left pending or running by a process that stopped, so not
+updated for CIS_APPROVAL_STALE_AFTER seconds, is stale: the command
+resume_approval_jobs runs the stale jobs, from where they stopped.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .metrics import APPROVAL_BATCH_SIZE
+from .models import CI, CIPack, ApprovalJob
+
+
+logger = logging.getLogger(__name__)
+
+# defaults of the settings CIS_APPROVAL_CHUNK_SIZE, CIS_APPROVAL_BACKGROUND_THRESHOLD
+# and CIS_APPROVAL_STALE_AFTER, in seconds
+CHUNK_SIZE = 1000
+BACKGROUND_THRESHOLD = 10000
+STALE_AFTER = 600
+
+# one job at a time per process, so jobs don't compete for the same locks
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='approval')
+
+
+def approve(ci_pks: Sequence[int], user, pack_pks: Sequence[int] = ()) -> Optional[ApprovalJob]:
+    """
+    Approve the CIs and record the user as approver of their packs.
+
+    Return None if they were approved right away, or the ApprovalJob
+    that will approve them in background.
+    """
+
+    ci_pks = sorted(ci_pks)
+    if len(ci_pks) <= getattr(settings, 'CIS_APPROVAL_BACKGROUND_THRESHOLD', BACKGROUND_THRESHOLD):
+        approve_chunks(ci_pks, user, pack_pks)
+        return None
+
+    job = ApprovalJob.objects.create(
+        requested_by=user,
+        ci_pks=ci_pks,
+        pack_pks=list(pack_pks),
+        total=len(ci_pks),
+    )
+    schedule(job)
+    return job
+
+
+def approve_packs(pack_pks: Sequence[int], user) -> Optional[ApprovalJob]:
+    """
+    Approve every CI of the packs and record the user as their approver.
+
+    As approve(), but the pks of the CIs are read a chunk at a time.
+    """
+
+    pack_pks = list(pack_pks)
+    total = pack_cis(pack_pks).count()
+    if total <= getattr(settings, 'CIS_APPROVAL_BACKGROUND_THRESHOLD', BACKGROUND_THRESHOLD):
+        approve_pack_chunks(pack_pks, user)
+        return None
+
+    job = ApprovalJob.objects.create(requested_by=user, pack_pks=pack_pks, total=total)
+    schedule(job)
+    return job
+
+
+def approve_chunks(ci_pks: List[int], user, pack_pks: Sequence[int] = (), job: Optional[ApprovalJob] = None):
+    """Approve the sorted CIs chunk by chunk, starting after the ones the job has done"""
+
+    chunk_size = getattr(settings, 'CIS_APPROVAL_CHUNK_SIZE', CHUNK_SIZE)
+    start = job.done if job else 0
+    for offset in range(start, len(ci_pks), chunk_size):
+        approve_chunk(ci_pks[offset:offset + chunk_size], user, job)
+
+    if pack_pks:
+        CIPack.objects.filter(pk__in=pack_pks).update(approved_by=user)
+
+
+def approve_pack_chunks(pack_pks: Sequence[int], user, job: Optional[ApprovalJob] = None):
+    """Approve the CIs of the packs left to approve chunk by chunk, in the order of their pks"""
+
+    chunk_size = getattr(settings, 'CIS_APPROVAL_CHUNK_SIZE', CHUNK_SIZE)
+    last_pk = 0
+    while True:
+        chunk = list(pack_cis(pack_pks).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            break
+        approve_chunk(chunk, user, job)
+        last_pk = chunk[-1]
+
+    CIPack.objects.filter(pk__in=pack_pks).update(approved_by=user)
+
+
+def approve_chunk(ci_pks: List[int], user, job: Optional[ApprovalJob] = None):
+    with transaction.atomic():
+        cis = CI.objects.filter(pk__in=ci_pks)
+        chunk_pack_pks = set(cis.exclude(pack=None).order_by().values_list('pack', flat=True).distinct())
+        cis.update(status=2)
+        CIPack.objects.filter(pk__in=chunk_pack_pks).update(approved_by=user)
+        if job:
+            job.done += len(ci_pks)
+            job.save(update_fields=['done', 'updated_at'])
+    APPROVAL_BATCH_SIZE.observe(len(ci_pks))
+    logger.info(f'{len(ci_pks)} CIs were approved by {user}.')
+
+
+def pack_cis(pack_pks: Sequence[int]) -> QuerySet:
+    """The CIs of the packs not approved yet"""
+
+    return CI.objects.filter(pack__in=pack_pks).exclude(status=2)
+
+
+def schedule(job: ApprovalJob):
+    """Run the job in background once the current transaction, which created it, commits"""
+
+    transaction.on_commit(lambda: _executor.submit(_run_in_thread, job.pk))
+
+
+def stale_jobs() -> QuerySet:
+    """The jobs pending or running, but not updated for CIS_APPROVAL_STALE_AFTER seconds"""
+
+    stale_after = getattr(settings, 'CIS_APPROVAL_STALE_AFTER', STALE_AFTER)
+    return ApprovalJob.objects.filter(
+        status__in=(0, 1), updated_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    )
+
+
+def claim(job_pk: int) -> bool:
+    """Mark the job running, unless it's done or running elsewhere"""
+
+    stale_after = getattr(settings, 'CIS_APPROVAL_STALE_AFTER', STALE_AFTER)
+    now = timezone.now()
+    running = Q(status=1, updated_at__gte=now - timedelta(seconds=stale_after))
+    return bool(
+        ApprovalJob.objects.filter(pk=job_pk).exclude(status=2).exclude(running)
+        .update(status=1, updated_at=now)
+    )
+
+
+def run(job_pk: int):
+    if not claim(job_pk):
+        logger.info(f'The approval job {job_pk} is done or running elsewhere.')
+        return
+    job = ApprovalJob.objects.select_related('requested_by').get(pk=job_pk)
+    try:
+        if job.ci_pks:
+            approve_chunks(job.ci_pks, job.requested_by, job.pack_pks, job=job)
+        else:
+            approve_pack_chunks(job.pack_pks, job.requested_by, job=job)
+    except Exception as e:
+        job.status = 3
+        job.error = str(e)
+        logger.exception(f'{job} stopped after {job.done} CIs.')
+    else:
+        job.status = 2
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+
+def _run_in_thread(job_pk: int):
+    try:
+        run(job_pk)
+    finally:
+        # the connections of this thread aren't closed by any request cycle
+        connections.close_all()
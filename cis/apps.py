@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class CisConfig(AppConfig):
     name = 'cis'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import ensure_search_triggers
+        post_migrate.connect(ensure_search_triggers, sender=self)
+        from .middleware import install_query_watchers
+        connection_created.connect(install_query_watchers)
@@ -0,0 +1,112 @@
+"""
+Async versions of the read-heavy views, served by internalize.asgi.
+
+Django 3.2 has no async ORM, so the queries run through sync_to_async.
+Each view evaluates its page, with the related objects the template needs,
+in a single call, and then renders it. The event loop is only blocked while
+a query runs, so a process keeps serving other clients in the meantime.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.shortcuts import render, get_object_or_404
+
+from .budget import query_budget
+from .mixins import credential_username
+from .models import CI, Appliance, Manufacturer
+from .search import search
+
+PAGINATE_BY = 10
+
+
+def user_approved_required(view):
+    """The async counterpart of UserApprovedMixin"""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user, is_authenticated = await sync_to_async(_load_user)(request)
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not user.is_approved:
+            raise PermissionDenied
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@query_budget(6)
+@user_approved_required
+async def ci_list(request, status):
+    user = request.user
+    qs = CI.objects.for_user(user).filter(status=status)
+    if username := credential_username(request):
+        qs = qs.with_credential_username(username)
+    qs = qs.select_related('client').prefetch_related('appliances')
+    context = await sync_to_async(_paginate)(request, qs, 'ci_list')
+    return await sync_to_async(render)(request, 'cis/ci_list.html', context)
+
+
+@query_budget(6)
+@user_approved_required
+async def ci_detail(request, pk):
+    # the CIs of other clients are not found
+    ci = await sync_to_async(get_object_or_404)(
+        CI.objects.for_user(request.user)
+        .select_related('place', 'contract', 'credential').prefetch_related('appliances'),
+        pk=pk,
+    )
+    return await sync_to_async(render)(request, 'cis/ci_detail.html', {'ci': ci, 'object': ci})
+
+
+@query_budget(5)
+@user_approved_required
+async def appliance_list(request):
+    qs = Appliance.objects.for_user(request.user).select_related('client')
+    context = await sync_to_async(_paginate)(request, qs, 'appliance_list')
+    return await sync_to_async(render)(request, 'cis/appliance_list.html', context)
+
+
+@query_budget(5)
+@user_approved_required
+async def manufacturer_detail(request, pk):
+    manufacturer = await sync_to_async(get_object_or_404)(Manufacturer, pk=pk)
+    qs = Appliance.objects.for_user(request.user).filter(manufacturer=manufacturer)
+    num_appliances = await sync_to_async(qs.count)()
+    return await sync_to_async(render)(request, 'cis/manufacturer_detail.html', {
+        'manufacturer': manufacturer,
+        'object': manufacturer,
+        'num_appliances': num_appliances,
+    })
+
+
+def _load_user(request):
+    """Resolve the lazy request.user, which hits the session and the DB"""
+
+    user = request.user
+    return user, user.is_authenticated
+
+
+def _paginate(request, queryset, context_object_name):
+    """Build the same context as ListView does, with the page evaluated"""
+
+    search_term = request.GET.get('q', '').strip()
+    if search_term:
+        queryset = search(queryset, search_term)
+    paginator = Paginator(queryset, PAGINATE_BY)
+    page = paginator.get_page(request.GET.get('page'))
+    object_list = list(page.object_list)
+    params = request.GET.copy()
+    params.pop('page', None)
+    return {
+        context_object_name: object_list,
+        'object_list': object_list,
+        'paginator': paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'search_term': search_term,
+        'querystring': params.urlencode(),
+    }
@@ -0,0 +1,90 @@
+"""
+Query budgets of the views.
+
+A view declares the most queries a request to it may run: a view function
+through the query_budget decorator, a class-based view through its
+query_budget attribute, and a ModelAdmin, for its changelist page, through
+its changelist_query_budget attribute. The actions posted to the changelist
+run in chunks, so they aren't counted. QueryBudgetMiddleware counts the queries
+of each request to such a view, its templates included, and with a request
+over budget, does what the setting CIS_QUERY_BUDGET says: 'raise' raises
+QueryBudgetExceeded, as in the tests, 'log' logs an error, as with DEBUG,
+and '' counts nothing.
+"""
+
+import logging
+from typing import List, Optional
+
+from django.conf import settings
+
+from .middleware import HybridMiddleware, unwatch_queries, watch_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit: int):
+    """Declare the most queries a request to the view function may run"""
+
+    def decorator(view):
+        view.query_budget = limit
+        return view
+
+    return decorator
+
+
+def get_query_budget(request, view_func) -> Optional[int]:
+    """Return the query budget of a request to a resolved view, if it declares one"""
+
+    if hasattr(view_func, 'query_budget'):
+        return view_func.query_budget
+    if hasattr(view_func, 'view_class'):
+        return getattr(view_func.view_class, 'query_budget', None)
+    model_admin = getattr(view_func, 'model_admin', None)
+    if model_admin is not None and view_func.__name__ == 'changelist_view' and request.method == 'GET':
+        return getattr(model_admin, 'changelist_query_budget', None)
+    return None
+
+
+class QueryCounter:
+    """A database execute wrapper keeping the SQL of the queries run"""
+
+    def __init__(self):
+        self.queries: List[str] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMiddleware(HybridMiddleware):
+    def before(self, request):
+        action = getattr(settings, 'CIS_QUERY_BUDGET', '')
+        if not action:
+            return None
+        counter = QueryCounter()
+        return action, counter, watch_queries(counter)
+
+    def finish(self, state):
+        if state is not None:
+            unwatch_queries(state[2])
+
+    def after(self, request, response, state):
+        if state is None or request.resolver_match is None:
+            return response
+        action, counter, _ = state
+        # a TemplateResponse is rendered by now, but not a streamed one
+        budget = get_query_budget(request, request.resolver_match.func)
+        if budget is not None and len(counter.queries) > budget:
+            self.over_budget(request, action, budget, counter.queries)
+        return response
+
+    @staticmethod
+    def over_budget(request, action, budget, queries):
+        message = f'{request.method} {request.path} ran {len(queries)} queries, over its budget of {budget}'
+        if action == 'raise':
+            raise QueryBudgetExceeded('\n'.join([f'{message}:', *queries]))
+        logger.error(message, extra={'request': request, 'queries': queries})
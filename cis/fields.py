@@ -0,0 +1,84 @@
+"""
+Encrypted fields decrypted on first use rather than when loaded.
+
+EncryptedCharField decrypts its value in from_db_value(), for every row
+loaded, whether the value is ever read or not. The fields below load a
+LazyPlaintext instead, which holds the ciphertext and decrypts it the first
+time it's used, e.g. rendered, compared or sliced, keeping the plaintext.
+A value saved back untouched is written as its ciphertext.
+"""
+
+import json
+
+from django.utils.encoding import force_bytes, force_str
+from django.utils.functional import SimpleLazyObject, empty
+from fernet_fields import EncryptedCharField, EncryptedTextField
+
+
+class LazyPlaintext(SimpleLazyObject):
+    """The plaintext of a ciphertext, decrypted on first use"""
+
+    def __init__(self, field, ciphertext: bytes):
+        # set through __dict__, as LazyObject forwards attributes to the plaintext
+        self.__dict__['ciphertext'] = ciphertext
+        super().__init__(lambda: field.decrypt(ciphertext))
+
+    @property
+    def is_decrypted(self) -> bool:
+        return self._wrapped is not empty
+
+
+class Ciphertext(bytes):
+    """A value to save as is, being encrypted already"""
+
+
+class LazyDecryptionMixin:
+    """For EncryptedField subclasses"""
+
+    def decrypt(self, ciphertext: bytes):
+        return self.to_python(force_str(self.fernet.decrypt(ciphertext)))
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return value
+        return LazyPlaintext(self, bytes(value))
+
+    def pre_save(self, model_instance, add):
+        value = super().pre_save(model_instance, add)
+        # the query compilers would decrypt it by looking up its attributes
+        if isinstance(value, LazyPlaintext) and not value.is_decrypted:
+            return Ciphertext(value.ciphertext)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, Ciphertext):
+            return connection.Database.Binary(value)
+        return super().get_db_prep_save(value, connection)
+
+
+class LazyEncryptedCharField(LazyDecryptionMixin, EncryptedCharField):
+    """An EncryptedCharField that decrypts its values on first use"""
+
+
+class EncryptedRecordField(LazyDecryptionMixin, EncryptedTextField):
+    """
+    A dict of strings encrypted as a single token of its JSON.
+
+    Several values stored together cost one encryption, one HMAC check and
+    one token's overhead, instead of one each.
+    """
+
+    def decrypt(self, ciphertext: bytes) -> dict:
+        return json.loads(super().decrypt(ciphertext))
+
+    def to_python(self, value):
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        if value is None or isinstance(value, Ciphertext):
+            return super().get_db_prep_save(value, connection)
+        record = json.dumps(
+            {name: None if item is None else str(item) for name, item in value.items()},
+            separators=(',', ':'),
+        )
+        return connection.Database.Binary(self.fernet.encrypt(force_bytes(record)))
@@ -0,0 +1,95 @@
+from django import forms
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """
+    Filter by a related object picked through the admin autocomplete.
+
+    Unlike RelatedFieldListFilter, it doesn't load every related object to
+    render the sidebar, only the selected one. The related model's admin
+    needs search_fields, like for autocomplete_fields.
+    """
+
+    template = 'admin/cis/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+        widget = AutocompleteSelect(field, model_admin.admin_site, attrs={
+            'onchange': 'this.form.submit()',
+            'style': 'width: 100%',
+        })
+        form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            required=False,
+            widget=widget,
+        )
+        form = type('AutocompleteFilterForm', (forms.Form,), {self.lookup_kwarg: form_field})(
+            initial={self.lookup_kwarg: self.lookup_val},
+        )
+        self.bound_field = form[self.lookup_kwarg]
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        # the select submits an empty value when cleared
+        if not self.lookup_val:
+            return queryset
+        return super().queryset(request, queryset)
+
+    def choices(self, changelist):
+        yield {
+            'selected': bool(self.lookup_val),
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items() if name != self.lookup_kwarg
+            ],
+        }
+
+
+class CredentialUsernameFilter(admin.ListFilter):
+    """
+    Filter CIs by the username of their credential, typed in full.
+
+    The lookup is an indexed query on the blind index of the usernames, so
+    the filter is only shown with the setting CIS_BLIND_INDEX_KEY, and, like
+    the credentials themselves, to users who can change CIs.
+    """
+
+    title = 'credential username'
+    parameter_name = 'username'
+    template = 'admin/cis/input_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        # popped, or the changelist would take it for a lookup of the CIs
+        self.value = params.pop(self.parameter_name, '').strip()
+        self.enabled = bool(getattr(settings, 'CIS_BLIND_INDEX_KEY', '')) and model_admin.has_change_permission(request)
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def has_output(self):
+        return self.enabled
+
+    def queryset(self, request, queryset):
+        if not (self.enabled and self.value):
+            return queryset
+        return queryset.with_credential_username(self.value)
+
+    def choices(self, changelist):
+        yield {
+            'selected': bool(self.value),
+            'value': self.value,
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items() if name != self.parameter_name
+            ],
+        }
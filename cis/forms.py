@@ -1,6 +1,7 @@
 from django import forms
+from django.core.paginator import Paginator
 
-from .models import CI, Place, Appliance, Client
+from .models import CI, Place, Appliance, Client, Credential
 
 
 class UploadCIsForm(forms.Form):
@@ -15,10 +16,19 @@ class CIForm(forms.ModelForm):
         self.client = kwargs.pop('client')
         super().__init__(*args, **kwargs)
         self.fields['appliances'] = forms.ModelMultipleChoiceField(
-            queryset=Appliance.objects.filter(client=self.client)
+            queryset=Appliance.objects.for_client(self.client)
         )
         self.fields['place'] = forms.ModelChoiceField(
-            queryset=Place.objects.filter(client=self.client)
+            queryset=Place.objects.for_client(self.client)
+        )
+        # saved as the Credential of the CI, see _save_m2m()
+        self.fields.update(forms.fields_for_model(Credential, fields=Credential.FIELDS))
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        Credential.objects.update_or_create(
+            ci=self.instance,
+            defaults={name: self.cleaned_data[name] for name in Credential.FIELDS},
         )
 
     class Meta:
@@ -36,3 +46,39 @@ class PlaceForm(forms.ModelForm):
     class Meta:
         model = Place
         fields = ('client',)
+
+
+class PaginatedInlineFormSet(forms.BaseInlineFormSet):
+    """
+    Inline formset showing a single page of the related objects.
+
+    The page is read from the query string of the change page, which the
+    admin posts the form back to, so the same objects are bound on save.
+    """
+
+    per_page = 20
+    query_params = None
+
+    @property
+    def page_param(self):
+        return f'{self.prefix}-page'
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            queryset = super().get_queryset()
+            self.paginator = Paginator(queryset, self.per_page)
+            self.page = self.paginator.get_page(self.query_params.get(self.page_param))
+            self._queryset = self.page.object_list
+        return self._queryset
+
+    def page_links(self):
+        """Yield (page number, query string), with a None query string for the current page and ellipses"""
+
+        self.get_queryset()
+        params = self.query_params.copy()
+        for number in self.paginator.get_elided_page_range(self.page.number):
+            if number == self.page.number or number == self.paginator.ELLIPSIS:
+                yield number, None
+            else:
+                params[self.page_param] = number
+                yield number, params.urlencode()
@@ -1,11 +1,11 @@
 import logging
 
 from collections import namedtuple
-from openpyxl import load_workbook
 from django.db import IntegrityError, transaction
 from typing import Set
 
-from .models import Client, Place, CI, Appliance, Contract, Manufacturer
+from .metrics import IMPORTED_ROWS, IMPORT_DURATION
+from .models import Client, Place, CI, Appliance, Contract, Manufacturer, Credential
 from .cis_mapping import HOSTNAME, IP, DESCRIPTION, \
     DEPLOYED, BUSINESS_IMPACT, PLACE, PLACE_DESCRIPTION, CONTRACT, \
     CONTRACT_BEGIN, CONTRACT_END, CONTRACT_DESCRIPTION, CREDENTIAL_USERNAME, \
@@ -19,6 +19,9 @@ logger = logging.getLogger(__name__)
 
 class CILoader:
     def __init__(self, file, client: Client):
+        # imported on the first upload, not by every process serving the views
+        from openpyxl import load_workbook
+
         self._workbook = load_workbook(file, read_only=True, data_only=True)
         self.client = client
         self.places = {}
@@ -32,20 +35,23 @@ class CILoader:
         logger.info(f'The method save() of the class {self.__class__.__name__} was called.')
 
         Error = namedtuple('Error', ['exc', 'row'])
-        for row in cis_sheet.iter_rows(min_row=2, values_only=True):
-            try:
-                with transaction.atomic():
-                    ci = self._create_ci(row)
-                    ci.appliances.set(self._get_ci_appliances(row[HOSTNAME]))
-                self.cis.append(ci)
-                logger.info(f'{ci} was added to self.cis')
-            except IntegrityError as e:
-                self.errors.append(Error(e, row))
-                logger.error(f'{e} spreadsheet row: {row} was added to self.errors')
+        with IMPORT_DURATION.time():
+            for row in cis_sheet.iter_rows(min_row=2, values_only=True):
+                try:
+                    with transaction.atomic():
+                        ci = self._create_ci(row)
+                        ci.appliances.set(self._get_ci_appliances(row[HOSTNAME]))
+                    self.cis.append(ci)
+                    logger.info(f'{ci} was added to self.cis')
+                except (IntegrityError, ValueError) as e:
+                    self.errors.append(Error(e, row))
+                    logger.error(f'{e} spreadsheet row: {row} was added to self.errors')
+        IMPORTED_ROWS.inc(len(self.cis), result='imported')
+        IMPORTED_ROWS.inc(len(self.errors), result='failed')
         return self
 
     def _create_ci(self, row: tuple) -> CI:
-        return CI.objects.create(
+        ci = CI.objects.create(
             client=self.client,
             hostname=row[HOSTNAME],
             ip=row[IP],
@@ -54,11 +60,15 @@ class CILoader:
             business_impact=self._get_business_impact(row[BUSINESS_IMPACT]),
             place=self._get_place(row[PLACE], row[PLACE_DESCRIPTION]),
             contract=self._get_contract(row),
+        )
+        Credential.objects.create(
+            ci=ci,
             username=row[CREDENTIAL_USERNAME],
             password=row[CREDENTIAL_PASSWORD],
             enable_password=row[CREDENTIAL_ENABLE_PASSWORD],
             instructions=row[CREDENTIAL_INSTRUCTIONS],
         )
+        return ci
 
     def _get_ci_appliances(self, hostname: str) -> Set[Appliance]:
         appliances = set()
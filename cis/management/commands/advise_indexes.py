@@ -0,0 +1,206 @@
+import json
+import re
+from collections import defaultdict
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from cis.models import CI, CIPack, Manufacturer
+
+# "table"."column" compared to a value, not to another column, e.g. "cis_client"."id" or T4."id", as in joins
+EQUALITY = re.compile(r'"(\w+)"\."(\w+)" (?:= (?!"|[A-Z]\d+\.)|IN \()')
+ORDER_BY = re.compile(r'ORDER BY (.*?)(?: LIMIT| OFFSET|$)')
+JOIN = re.compile(r'JOIN "(\w+)" ON \("(\w+)"\."(\w+)" = "(\w+)"\."(\w+)"\)')
+COLUMN = re.compile(r'"(\w+)"\."(\w+)"')
+
+
+class Command(BaseCommand):
+    help = ('Replay a representative set of view requests, as a client user and a superuser, EXPLAIN the '
+            'SELECT queries they run and report the sequential scans, the sorts without an index, and the '
+            'composite indexes missing for their filters. Run it on a seeded database, see seed_scale, '
+            'before and after migrating, to compare the timings of the queries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each query, timed by their median.')
+        parser.add_argument('--json', action='store_true', help='Report as JSON.')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'EXPLAIN is read on SQLite and PostgreSQL, not on {connection.vendor}.')
+
+        queries = defaultdict(set)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for view, user, url in self._requests():
+                client = TestClient()
+                client.force_login(user)
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code} to {user}.')
+                for query in captured.captured_queries:
+                    if query['sql'].startswith('SELECT') and 'django_session' not in query['sql']:
+                        queries[query['sql']].add(view)
+
+        report = []
+        recommended = set()
+        for sql, views in queries.items():
+            issues = self._explain(sql)
+            missing = self._missing_indexes(sql)
+            recommended.update(missing)
+            report.append({
+                'views': sorted(views),
+                'sql': sql,
+                'ms': round(self._time(sql, options['repeat']), 2),
+                'issues': issues,
+                'missing_indexes': [format_index(*index) for index in missing],
+            })
+        report.sort(key=lambda query: -query['ms'])
+        # an index also serves the queries filtering by the first of its columns
+        indexes = sorted(
+            format_index(table, columns) for table, columns in recommended
+            if not any(other[0] == table and len(other[1]) > len(columns)
+                       and set(other[1][:len(columns)]) == set(columns) for other in recommended)
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps({'queries': report, 'recommended_indexes': indexes}, indent=2))
+            return
+        flagged = [query for query in report if query['issues'] or query['missing_indexes']]
+        self.stdout.write(
+            f"{len(report)} queries captured, taking {sum(query['ms'] for query in report):.1f} ms in all. "
+            f'{len(flagged)} with issues, slowest first:'
+        )
+        for query in flagged:
+            self.stdout.write(f"\n{query['ms']:.2f} ms  {', '.join(query['views'])}\n  {query['sql'][:300]}")
+            for issue in query['issues']:
+                self.stdout.write(f'  - {issue}')
+            for index in query['missing_indexes']:
+                self.stdout.write(f'  - missing index on {index}')
+        self.stdout.write('\nRecommended indexes:' if indexes else '\nNo index is missing.')
+        for index in indexes:
+            self.stdout.write(f'  {index}')
+
+    @staticmethod
+    def _requests():
+        """(view, user, url) of the requests replayed"""
+
+        user = User.objects.filter(client__isnull=False, client__ci__isnull=False).order_by('pk').first()
+        superuser = User.objects.filter(is_superuser=True).order_by('pk').first()
+        ci = CI.objects.filter(client=user.client).order_by('pk').first() if user else None
+        manufacturer = Manufacturer.objects.filter(appliance__client=user.client).first() if user else None
+        if not (user and superuser and manufacturer):
+            raise CommandError('A user of a client with CIs and appliances, and a superuser, are needed. '
+                               'Please load some data first, e.g. with seed_scale.')
+
+        requests = []
+        for person in (user, superuser):
+            for status, label in CI.STATUS_OPTIONS:
+                requests.append(('cis:ci_list', person, reverse('cis:ci_list', args=(status,))))
+                requests.append(('cis:ci_list_async', person, reverse('cis:ci_list_async', args=(status,))))
+            requests += [
+                ('cis:ci_detail', person, reverse('cis:ci_detail', args=(ci.pk,))),
+                ('cis:manufacturer_detail', person, reverse('cis:manufacturer_detail', args=(manufacturer.pk,))),
+                ('cis:appliance_list', person, reverse('cis:appliance_list')),
+                ('homepage', person, reverse('homepage')),
+            ]
+        requests += [
+            (f'admin:{name}', superuser, reverse(f'admin:{name}'))
+            for name in ('cis_ci_changelist', 'cis_cipack_changelist', 'cis_appliance_changelist')
+        ]
+        pack = CIPack.objects.order_by('pk').first()
+        if pack:
+            url = reverse('admin:cis_ci_changelist') + f'?pack__id__exact={pack.pk}'
+            requests.append(('admin:cis_ci_changelist', superuser, url))
+        return requests
+
+    @staticmethod
+    def _explain(sql):
+        """The sequential scans and the sorts without an index of the plan of a query"""
+
+        issues = []
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                for *_, detail in cursor.fetchall():
+                    if detail.startswith('SCAN') and 'INDEX' not in detail:
+                        issues.append(f'sequential scan: {detail}')
+                    elif 'TEMP B-TREE' in detail:
+                        issues.append(f'sort: {detail}')
+            else:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                plan = cursor.fetchone()[0]
+                nodes = [plan[0]['Plan']]
+                while nodes:
+                    node = nodes.pop()
+                    nodes.extend(node.get('Plans', ()))
+                    if node['Node Type'] == 'Seq Scan':
+                        issues.append(f"sequential scan: {node['Relation Name']}")
+                    elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                        issues.append(f"sort: {', '.join(node['Sort Key'])}")
+        return issues
+
+    @staticmethod
+    def _missing_indexes(sql):
+        """
+        The (table, columns) of the indexes missing for a query: by table, the
+        column it is joined on when the query aggregates it, the columns compared
+        to values, then the first column the query is ordered by, with a limit,
+        when no index of the table starts with those columns.
+        """
+
+        tables = set(connection.introspection.table_names())
+        columns = defaultdict(list)
+        if ' GROUP BY ' in sql:
+            for table, *sides in JOIN.findall(sql):
+                for side_table, column in zip(sides[::2], sides[1::2]):
+                    if side_table == table and column != 'id':
+                        columns[table].append(column)
+        for table, column in EQUALITY.findall(sql):
+            if column not in columns[table]:
+                columns[table].append(column)
+        order_by = ORDER_BY.search(sql) if ' LIMIT ' in sql else None
+        if order_by:
+            table, column = COLUMN.findall(order_by.group(1))[0]
+            columns.setdefault(table, [])
+        else:
+            table = column = None
+
+        missing = []
+        with connection.cursor() as cursor:
+            for name, filtered in columns.items():
+                # the primary key finds the rows of a lookup by pk, whatever the other filters
+                if name not in tables or 'id' in filtered:
+                    continue
+                ordered = [column] if name == table and column not in filtered else []
+                indexes = [
+                    constraint['columns'] for constraint in
+                    connection.introspection.get_constraints(cursor, name).values()
+                    if constraint['index'] or constraint['unique'] or constraint['primary_key']
+                ]
+                if not any(
+                    set(index[:len(filtered)]) == set(filtered) and index[len(filtered):][:len(ordered)] == ordered
+                    for index in indexes
+                ):
+                    missing.append((name, (*filtered, *ordered)))
+        return missing
+
+    @staticmethod
+    def _time(sql, repeat):
+        timings = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                start = perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                timings.append((perf_counter() - start) * 1000)
+        return median(timings)
+
+
+def format_index(table, columns):
+    return f'{table} ({", ".join(columns)})'
@@ -0,0 +1,69 @@
+import asyncio
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from django.urls import reverse
+
+from accounts.models import User
+from cis.management.commands.loadtest import percentiles
+from cis.models import CI, Manufacturer
+
+
+class Command(BaseCommand):
+    help = ('Compare the sync and async read views under the same concurrency, '
+            'going through the ASGI handler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='User to log in with. Defaults to the first superuser.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per view.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('At least one request per view is needed.')
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(is_superuser=True).first()
+        ci = CI.objects.first()
+        manufacturer = Manufacturer.objects.first()
+        if not (user and ci and manufacturer):
+            raise CommandError('A user, a CI and a manufacturer are needed. Please load some data first.')
+
+        views = (
+            ('CI list', reverse('cis:ci_list', args=(ci.status,)), reverse('cis:ci_list_async', args=(ci.status,))),
+            ('CI detail', reverse('cis:ci_detail', args=(ci.pk,)), reverse('cis:ci_detail_async', args=(ci.pk,))),
+            ('appliance list', reverse('cis:appliance_list'), reverse('cis:appliance_list_async')),
+            ('manufacturer', reverse('cis:manufacturer_detail', args=(manufacturer.pk,)),
+             reverse('cis:manufacturer_detail_async', args=(manufacturer.pk,))),
+        )
+        client = AsyncClient()
+        client.force_login(user)
+
+        self.stdout.write(f"{'view':<16} {'kind':<6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, sync_url, async_url in views:
+            for kind, url in (('sync', sync_url), ('async', async_url)):
+                throughput, p50, p99 = asyncio.run(
+                    self._run(client, url, options['requests'], options['concurrency'])
+                )
+                self.stdout.write(f'{name:<16} {kind:<6} {throughput:>8.1f} {p50:>8.2f} {p99:>8.2f}')
+
+    @staticmethod
+    async def _run(client, url, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def get():
+            async with semaphore:
+                start = perf_counter()
+                response = await client.get(url)
+                latencies.append((perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+
+        start = perf_counter()
+        await asyncio.gather(*(get() for _ in range(requests)))
+        elapsed = perf_counter() - start
+        cuts = percentiles(latencies)
+        return requests / elapsed, cuts['p50_ms'], cuts['p99_ms']
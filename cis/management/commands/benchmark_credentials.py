@@ -0,0 +1,117 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from cis.loader import CILoader
+from cis.models import CI, Client, Credential
+from cis.workbooks import generate_workbook
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare the credential formats, a token per value and a single record, '
+            'importing CIs through CILoader and reading their credentials. With --decryption, '
+            'compare loading CIs with their credentials decrypted on load, as EncryptedCharField does, '
+            'and on first use, on copies of an existing CI. Runs inside a transaction rolled back at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='CIs to import and read, or to load.')
+        parser.add_argument('--decryption', action='store_true', help='Compare eager and lazy decryption.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path, with --decryption.')
+
+    def handle(self, *args, **options):
+        if options['decryption']:
+            self._compare_decryption(options['count'], options['repeat'])
+        else:
+            self._compare_formats(options['count'])
+
+    def _compare_formats(self, count):
+        workbook = generate_workbook(count)
+        self.stdout.write(
+            f"{'format':<8} {'import CIs/s':>13} {'load ms':>9} {'read all ms':>12} {'read all creds/s':>17}"
+        )
+        for name, records in (('values', False), ('record', True)):
+            try:
+                with transaction.atomic(), override_settings(CIS_CREDENTIAL_RECORDS=records):
+                    self._run_format(name, workbook, count)
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def _run_format(self, name, workbook, count):
+        client = Client.objects.create(name='Benchmark client')
+        workbook.seek(0)
+        start = perf_counter()
+        CILoader(workbook, client).save()
+        imported = count / (perf_counter() - start)
+
+        credentials = Credential.objects.filter(ci__client=client)
+        start = perf_counter()
+        list(credentials)
+        load = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        for credential in credentials:
+            for field in Credential.FIELDS:
+                str(getattr(credential, field))
+        read = perf_counter() - start
+        self.stdout.write(f'{name:<8} {imported:>13.0f} {load:>9.1f} {read * 1000:>12.1f} {count / read:>17.0f}')
+
+    def _compare_decryption(self, count, repeat):
+        ci = CI.objects.filter(credential__isnull=False).select_related('credential').first()
+        if ci is None:
+            raise CommandError('A CI with a credential is needed. Please load some data first.')
+
+        try:
+            with transaction.atomic():
+                self._copy(ci, count)
+                self._run_decryption(count, repeat)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _run_decryption(self, count, repeat):
+        queryset = CI.objects.select_related('credential').order_by('pk')[:count]
+
+        def eager():
+            # what from_db_value() of EncryptedCharField did for every row
+            for ci in queryset.all():
+                for name in Credential.FIELDS:
+                    str(getattr(ci.credential, name) or '')
+
+        def lazy():
+            list(queryset.all())
+
+        self.stdout.write(f"{'path':<10} {'ms':>10}")
+        for name, function in (('eager', eager), ('lazy', lazy)):
+            timings = []
+            for _ in range(repeat):
+                start = perf_counter()
+                function()
+                timings.append((perf_counter() - start) * 1000)
+            self.stdout.write(f'{name:<10} {median(timings):>10.1f}')
+
+    @staticmethod
+    def _copy(ci, count):
+        credential = ci.credential
+        missing = count - CI.objects.filter(credential__isnull=False).count()
+        values = {f.attname: getattr(ci, f.attname) for f in CI._meta.concrete_fields if not f.primary_key}
+        CI.objects.bulk_create(
+            [CI(**{**values, 'hostname': f'BENCHMARK{n}'}) for n in range(max(missing, 0))],
+            batch_size=1000,
+        )
+        # not every backend returns the pks of bulk_create()
+        copies = CI.objects.filter(hostname__startswith='BENCHMARK', credential__isnull=True)
+        Credential.objects.bulk_create(
+            [
+                Credential(ci_id=pk, **{name: getattr(credential, name) for name in Credential.FIELDS})
+                for pk in copies.values_list('pk', flat=True)
+            ],
+            batch_size=1000,
+        )
@@ -0,0 +1,47 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from cis.models import CI, Appliance
+from cis.search import search, icontains_search
+
+
+class Command(BaseCommand):
+    help = 'Compare the indexed search with the icontains scan on the current data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', help='Terms to search. Defaults to slices of existing hostnames.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per term and path.')
+
+    def handle(self, *args, **options):
+        terms = options['terms'] or self._default_terms()
+        if not terms:
+            self.stderr.write('There is no CI to take default terms from. Please pass some terms.')
+            return
+
+        self.stdout.write(f'{CI.objects.count()} CIs, {Appliance.objects.count()} appliances')
+        self.stdout.write(f"{'model':<10} {'term':<20} {'rows':>8} {'icontains ms':>13} {'indexed ms':>11}")
+        for model in (CI, Appliance):
+            for term in terms:
+                rows, scan = self._time(icontains_search, model, term, options['repeat'])
+                _, indexed = self._time(search, model, term, options['repeat'])
+                self.stdout.write(
+                    f'{model.__name__:<10} {term:<20} {rows:>8} {scan:>13.2f} {indexed:>11.2f}'
+                )
+
+    @staticmethod
+    def _time(function, model, term, repeat):
+        timings = []
+        rows = 0
+        for _ in range(repeat):
+            start = perf_counter()
+            rows = len(function(model.objects.all(), term).values_list('pk', flat=True))
+            timings.append((perf_counter() - start) * 1000)
+        return rows, median(timings)
+
+    @staticmethod
+    def _default_terms():
+        hostnames = CI.objects.order_by('?').values_list('hostname', flat=True)[:3]
+        # a prefix and a substring of each sampled hostname
+        return [term for hostname in hostnames for term in (hostname[:4], hostname[1:5]) if term]
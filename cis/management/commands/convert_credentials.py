@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cis.models import Credential, username_index
+
+
+class Command(BaseCommand):
+    help = ('Convert the stored credentials to the format of the setting CIS_CREDENTIAL_RECORDS: '
+            'a single encrypted record per credential, or a token per value.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Credentials converted per transaction.')
+
+    def handle(self, *args, **options):
+        to_records = getattr(settings, 'CIS_CREDENTIAL_RECORDS', False)
+        pending = Credential.objects.filter(record__isnull=to_records).order_by('pk')
+        last_pk = 0
+        converted = 0
+        while True:
+            with transaction.atomic():
+                batch = list(pending.filter(pk__gt=last_pk)[:options['batch_size']])
+                if not batch:
+                    break
+                for credential in batch:
+                    values = {name: getattr(credential, name) for name in Credential.FIELDS}
+                    credential.record = values if to_records else None
+                    credential.username_index = username_index(values['username'])
+                    for name in Credential.FIELDS:
+                        setattr(credential, name, None if to_records else values[name])
+                Credential.objects.bulk_update(batch, ['record', 'username_index', *Credential.FIELDS])
+            last_pk = batch[-1].pk
+            converted += len(batch)
+            self.stdout.write(f'{converted} credentials converted...')
+
+        kind = 'records' if to_records else 'separate values'
+        self.stdout.write(self.style.SUCCESS(f'{converted} credentials were converted to {kind}.'))
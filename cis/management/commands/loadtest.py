@@ -0,0 +1,255 @@
+import json
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+from uuid import uuid4
+
+import requests
+from allauth.account.models import EmailAddress
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.shortcuts import resolve_url
+from django.test import Client as TestClient
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from cis.loader import CILoader
+from cis.models import CI, Client
+from cis.workbooks import generate_workbook
+
+FLOWS = ('login', 'ci_list', 'ci_detail', 'appliance_list', 'upload', 'send_pack')
+SEED_CIS = 200
+
+Request = namedtuple('Request', ('method', 'path', 'data', 'files', 'expected'), defaults=(None, None, 200))
+Response = namedtuple('Response', ('status', 'location'))
+
+
+class TestClientSession:
+    """Requests through the test client, in process"""
+
+    def __init__(self):
+        self.client = TestClient()
+
+    def send(self, request: Request) -> Response:
+        if request.method == 'GET':
+            response = self.client.get(request.path)
+        else:
+            files = {name: SimpleUploadedFile(*file) for name, file in (request.files or {}).items()}
+            response = self.client.post(request.path, {**request.data, **files})
+        return Response(response.status_code, response.get('Location', ''))
+
+
+class HTTPSession:
+    """Requests to a running server, with its cookies and CSRF token"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def send(self, request: Request) -> Response:
+        headers = {}
+        if request.method == 'POST':
+            if 'csrftoken' not in self.session.cookies:
+                self.session.get(self.url + reverse('account_login'))
+            headers = {'X-CSRFToken': self.session.cookies['csrftoken'], 'Referer': self.url + request.path}
+        response = self.session.request(
+            request.method, self.url + request.path,
+            data=request.data, files=request.files, headers=headers, allow_redirects=False,
+        )
+        return Response(response.status_code, response.headers.get('Location', ''))
+
+
+class Command(BaseCommand):
+    help = ('Drive the main user flows at a given concurrency, through the test client or against a '
+            'running server, and report the throughput and latency percentiles of each flow as JSON. '
+            'The upload and send_pack flows add CIs and send them, so point it at a staging database. '
+            'The user and its CIs are read from the database of the command, which must be the one of the server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8000. '
+                                          'Defaults to the test client, in process.')
+        parser.add_argument('--email', default='loadtest@example.com', help='Email of the user to log in with.')
+        parser.add_argument('--password', help='Password of the user. Not needed with --seed.')
+        parser.add_argument('--seed', action='store_true',
+                            help=f'Create the user, with a new random password, a client and {SEED_CIS} CIs '
+                                 'if they are missing.')
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=FLOWS, help='Flows to run, in order.')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per flow.')
+        parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight at once.')
+        parser.add_argument('--upload-rows', type=int, default=10, help='CIs in each uploaded spreadsheet.')
+        parser.add_argument('--pack-size', type=int, default=5, help='CIs in each pack sent.')
+        parser.add_argument('--output', help='File to write the JSON report to. Defaults to the standard output.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            options['password'] = self._seed(options['email'])
+        elif not options['password']:
+            raise CommandError('Please give the --password of the user, or --seed one.')
+        self.options = options
+        self.user = User.objects.filter(email=options['email']).first()
+        if not (self.user and self.user.client):
+            raise CommandError(f'{options["email"]} is not a user of a client. Please load some data or --seed.')
+
+        if options['url']:
+            self.session_class = lambda: HTTPSession(options['url'])
+            report = self._run_flows()
+        else:
+            self.session_class = TestClientSession
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                report = self._run_flows()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _run_flows(self) -> dict:
+        # a logged in session per request in flight, kept across the flows
+        sessions = [self._login() for _ in range(self.options['concurrency'])]
+        results = {}
+        for flow in self.options['flows']:
+            if flow == 'login':
+                results[flow] = self._run(self._login_requests(), sessions, fresh_sessions=True)
+            elif flow == 'ci_list':
+                for status, label in CI.STATUS_OPTIONS:
+                    path = reverse('cis:ci_list', args=(status,))
+                    results[f'ci_list_{label}'] = self._run(self._repeat(lambda n: Request('GET', path)), sessions)
+            else:
+                results[flow] = self._run(getattr(self, f'_{flow}_requests')(), sessions)
+        return {
+            'time': timezone.now().isoformat(),
+            'target': self.options['url'] or 'test client',
+            'concurrency': self.options['concurrency'],
+            'flows': results,
+        }
+
+    def _repeat(self, request):
+        return [request(n) for n in range(self.options['requests'])]
+
+    def _login_requests(self):
+        data = {'login': self.options['email'], 'password': self.options['password']}
+        return self._repeat(lambda n: Request('POST', reverse('account_login'), data, expected=302))
+
+    def _ci_detail_requests(self):
+        pks = list(CI.objects.filter(client=self.user.client).values_list('pk', flat=True)[:self.options['requests']])
+        if not pks:
+            raise CommandError(f'{self.user.client} has no CIs. Please load some data or --seed.')
+        return self._repeat(lambda n: Request('GET', reverse('cis:ci_detail', args=(pks[n % len(pks)],))))
+
+    def _appliance_list_requests(self):
+        return self._repeat(lambda n: Request('GET', reverse('cis:appliance_list')))
+
+    def _upload_requests(self):
+        run = uuid4().hex[:8]
+        return self._repeat(lambda n: Request('POST', reverse('cis:ci_upload'), {}, {
+            'file': ('loadtest.xlsx', generate_workbook(self.options['upload_rows'], f'LOADTEST-{run}-{n}-').read()),
+        }))
+
+    def _send_pack_requests(self):
+        size = self.options['pack_size']
+        pks = list(CI.objects.filter(client=self.user.client, status=0)
+                   .values_list('pk', flat=True)[:self.options['requests'] * size])
+        if len(pks) < size:
+            raise CommandError(f'{self.user.client} has no CIs left to send. Please run the upload flow first.')
+        return [
+            Request('POST', reverse('cis:ci_pack_send'), {'cis_selected': pks[offset:offset + size]}, expected=302)
+            for offset in range(0, len(pks) - size + 1, size)
+        ]
+
+    def _run(self, flow_requests, sessions, fresh_sessions=False) -> dict:
+        pending = iter(flow_requests)
+        lock = threading.Lock()
+        latencies = []
+        errors = []
+
+        def work(session):
+            while True:
+                with lock:
+                    request = next(pending, None)
+                if request is None:
+                    return
+                if fresh_sessions:
+                    session = self.session_class()
+                start = perf_counter()
+                try:
+                    response = session.send(request)
+                except Exception as e:
+                    errors.append(repr(e))
+                    continue
+                latency = (perf_counter() - start) * 1000
+                if response.status != request.expected:
+                    errors.append(f'{request.method} {request.path} returned {response.status}')
+                    continue
+                latencies.append(latency)
+
+        start = perf_counter()
+        if len(sessions) == 1:
+            work(sessions[0])
+        else:
+            with ThreadPoolExecutor(len(sessions)) as executor:
+                list(executor.map(self._in_thread(work), sessions))
+        elapsed = perf_counter() - start
+
+        result = {
+            'requests': len(flow_requests),
+            'failures': len(errors),
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 1),
+            **percentiles(latencies),
+        }
+        if errors:
+            result['first_error'] = errors[0]
+        return result
+
+    @staticmethod
+    def _in_thread(work):
+        def run(session):
+            try:
+                work(session)
+            finally:
+                # the connection of the thread, with the test client
+                connection.close()
+        return run
+
+    def _login(self):
+        session = self.session_class()
+        response = session.send(Request('POST', reverse('account_login'), {
+            'login': self.options['email'], 'password': self.options['password'],
+        }))
+        if response.status != 302 or response.location != resolve_url(settings.LOGIN_REDIRECT_URL):
+            raise CommandError(f'Could not log in as {self.options["email"]}. Is the password right and the email verified?')
+        return session
+
+    def _seed(self, email) -> str:
+        client, _ = Client.objects.get_or_create(name='Load test')
+        user = User.objects.filter(email=email).first() or User(username=email, email=email)
+        password = User.objects.make_random_password()
+        user.client = client
+        user.set_password(password)
+        user.save()
+        EmailAddress.objects.update_or_create(user=user, email=email, defaults={'verified': True, 'primary': True})
+        if not CI.objects.filter(client=client).exists():
+            CILoader(generate_workbook(SEED_CIS, 'LOADTEST'), client).save()
+        return password
+
+
+def percentiles(latencies) -> dict:
+    """The latency percentiles of the successful requests, in milliseconds"""
+
+    if not latencies:
+        return {}
+    cuts = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else [latencies[0]] * 99
+    return {
+        'p50_ms': round(cuts[49], 2),
+        'p90_ms': round(cuts[89], 2),
+        'p99_ms': round(cuts[98], 2),
+        'max_ms': round(max(latencies), 2),
+    }
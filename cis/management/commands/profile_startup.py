@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from statistics import median
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client as TestClient
+from django.urls import reverse
+
+from accounts.models import User
+from cis.models import CI
+
+# modules a process serving the site shouldn't import before they are needed
+HEAVY_MODULES = ('openpyxl', 'debug_toolbar', 'django_extensions')
+# "import time: self [us] | cumulative | imported package", nested imports indented
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \| \s*(\S+)$')
+
+# run in a new interpreter: load the WSGI application as gunicorn does, warm it up or not,
+# then time each request twice, through the application itself
+CHILD = '''
+import io, json, os, sys
+from time import perf_counter
+
+start = perf_counter()
+from internalize.wsgi import application
+loaded = perf_counter()
+if os.environ['PROFILE_WARMUP'] == '1':
+    from cis.warmup import warmup
+    warmup()
+warm = perf_counter()
+heavy = sorted(name for name in json.loads(os.environ['PROFILE_HEAVY_MODULES']) if name in sys.modules)
+
+
+def get(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '80', 'HTTP_HOST': '127.0.0.1',
+        'HTTP_COOKIE': os.environ['PROFILE_COOKIE'], 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0), 'wsgi.multithread': False,
+        'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    statuses = []
+    start = perf_counter()
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return int(statuses[0].split()[0]), (perf_counter() - start) * 1000
+
+
+requests = []
+for path in json.loads(os.environ['PROFILE_PATHS']):
+    (status, first), (_, second) = get(path), get(path)
+    requests.append({'path': path, 'status': status, 'first_ms': first, 'second_ms': second})
+print(json.dumps({
+    'load_ms': (loaded - start) * 1000, 'warmup_ms': (warm - loaded) * 1000,
+    'heavy_modules': heavy, 'requests': requests,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Profile the cold start of a process serving the site, in new interpreters: the time to load the '
+            'WSGI application, the packages slowest to import, the heavy modules imported at startup, '
+            'and the latency of the first request to each main view against the next one, with and without '
+            'the warmup of cis.warmup. Set DEBUG=0 to profile as in production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Processes started, timed by their median.')
+        parser.add_argument('--top', type=int, default=15, help='Slowest packages to import listed.')
+        parser.add_argument('--email', help='User the views are requested as. Defaults to a user of a client.')
+        parser.add_argument('--json', action='store_true', help='Report as JSON.')
+
+    def handle(self, *args, **options):
+        user = (User.objects.filter(email=options['email']) if options['email']
+                else User.objects.filter(client__isnull=False, client__ci__isnull=False)).order_by('pk').first()
+        if not (user and user.client):
+            raise CommandError('A user of a client with CIs is needed. Please load some data first, e.g. with seed_scale.')
+        client = TestClient()
+        client.force_login(user)
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'internalize.settings'),
+            'PROFILE_COOKIE': f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}',
+            'PROFILE_HEAVY_MODULES': json.dumps(HEAVY_MODULES),
+            'PROFILE_PATHS': json.dumps([
+                reverse('homepage'),
+                reverse('cis:ci_list', args=(0,)),
+                reverse('cis:ci_detail', args=(CI.objects.for_client(user.client).order_by('pk').first().pk,)),
+                reverse('cis:appliance_list'),
+                reverse('cis:ci_upload'),
+            ]),
+        }
+
+        report = {'user': user.email}
+        cold_runs = None
+        for warmup in (False, True):
+            runs = [self._run(env, warmup) for _ in range(options['runs'])]
+            cold_runs = cold_runs or runs
+            report['warm' if warmup else 'cold'] = {
+                'load_ms': round(median(run['load_ms'] for run in runs), 1),
+                'warmup_ms': round(median(run['warmup_ms'] for run in runs), 1),
+                'heavy_modules': runs[0]['heavy_modules'],
+                'requests': [{
+                    'path': request['path'],
+                    'status': request['status'],
+                    'first_ms': round(median(run['requests'][n]['first_ms'] for run in runs), 1),
+                    'second_ms': round(median(run['requests'][n]['second_ms'] for run in runs), 1),
+                } for n, request in enumerate(runs[0]['requests'])],
+            }
+        imports = defaultdict(list)
+        for run in cold_runs:
+            for package, us in run['imports'].items():
+                imports[package].append(us)
+        report['slowest_imports'] = [
+            {'package': package, 'ms': round(median(us) / 1000, 1)}
+            for package, us in sorted(imports.items(), key=lambda item: -median(item[1]))[:options['top']]
+        ]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for label in ('cold', 'warm'):
+            profile = report[label]
+            self.stdout.write(
+                f"{'Without' if label == 'cold' else 'With'} warmup: application loaded in {profile['load_ms']} ms, "
+                f"warmed up in {profile['warmup_ms']} ms. Heavy modules loaded: "
+                f"{', '.join(profile['heavy_modules']) or 'none'}."
+            )
+            for request in profile['requests']:
+                self.stdout.write(f"  {request['path']:<24} {request['status']}  first {request['first_ms']:>7} ms, "
+                                  f"next {request['second_ms']:>6} ms")
+        self.stdout.write('Slowest packages to import:')
+        for package in report['slowest_imports']:
+            self.stdout.write(f"  {package['ms']:>7} ms  {package['package']}")
+
+    def _run(self, env, warmup) -> dict:
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD],
+            env={**env, 'PROFILE_WARMUP': '1' if warmup else '0'},
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        if process.returncode:
+            raise CommandError(f'The profiled process failed:\n{process.stderr[-2000:]}')
+        run = json.loads(process.stdout.strip().splitlines()[-1])
+        # the time spent importing the modules of each package, their own imports aside
+        run['imports'] = defaultdict(int)
+        for line in process.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match:
+                run['imports'][match.group(2).split('.')[0]] += int(match.group(1))
+        return run
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cis.models import ClientCIStatusCount, PackCIStatusCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the CI status counters of clients and packs from the CI table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the counters with the CI table, failing on any difference.',
+        )
+
+    def handle(self, *args, **options):
+        counters = (ClientCIStatusCount, PackCIStatusCount)
+        if not options['verify']:
+            for model in counters:
+                model.objects.recount()
+            self.stdout.write(self.style.SUCCESS('The counters were rebuilt.'))
+
+        wrong = 0
+        for model in counters:
+            for (key, status), (stored, expected) in sorted(model.objects.differences().items()):
+                wrong += 1
+                self.stderr.write(
+                    f'{model.key_field} {key} status {status}: counted {stored}, expected {expected}'
+                )
+        if wrong:
+            raise CommandError(f'{wrong} counters are wrong.')
+        self.stdout.write(self.style.SUCCESS('The counters match the CI table.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from cis import approval
+
+
+class Command(BaseCommand):
+    help = ('Run the approval jobs left pending or running by a process that stopped, from where they '
+            'stopped. A job is stale once not updated for CIS_APPROVAL_STALE_AFTER seconds. Meant to be '
+            'run periodically, e.g. by cron.')
+
+    def handle(self, *args, **options):
+        jobs = list(approval.stale_jobs().order_by('pk').values_list('pk', flat=True))
+        for job_pk in jobs:
+            approval.run(job_pk)
+            self.stdout.write(f'The approval job {job_pk} was run.')
+        self.stdout.write(self.style.SUCCESS(f'{len(jobs)} stale approval jobs were run.'))
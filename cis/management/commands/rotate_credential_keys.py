@@ -0,0 +1,107 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from fernet_fields import EncryptedTextField
+
+from cis import rotation
+from cis.fields import Ciphertext
+from cis.models import Credential
+
+
+class Command(BaseCommand):
+    help = ('Re-encrypt the credentials with the first key of the setting FERNET_KEYS, '
+            'in chunks ordered by pk. Prepend the new key to FERNET_KEYS, keeping the old ones, '
+            'run this command, then drop the old keys. '
+            'The blind indexes of the usernames are computed again with the setting CIS_BLIND_INDEX_KEY.')
+
+    COLUMNS = (*Credential.FIELDS, 'record')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Credentials re-encrypted per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes re-encrypting them.')
+        parser.add_argument('--start-after', type=int, default=0, help='Resume after the credential of this pk.')
+        parser.add_argument('--sample', type=int, default=5, help='Credentials verified after each chunk.')
+
+    def handle(self, *args, **options):
+        # a new field, as the fields of the models cache the keys they were first used with
+        fernet_keys = EncryptedTextField().fernet_keys
+        self.fernet = rotation.multi_fernet(fernet_keys)
+        self.primary = Fernet(fernet_keys[0])
+        index_key = getattr(settings, 'CIS_BLIND_INDEX_KEY', '').encode() or None
+        workers = options['workers']
+
+        if workers > 1:
+            executor = ProcessPoolExecutor(workers, initializer=rotation.init_worker, initargs=(fernet_keys, index_key))
+
+            def rotate(rows):
+                return [row for part in executor.map(rotation.rotate_rows, rotation.split(rows, workers)) for row in part]
+        else:
+            executor = None
+            rotation.init_worker(fernet_keys, index_key)
+            rotate = rotation.rotate_rows
+
+        last_pk = options['start_after']
+        rotated = 0
+        start = perf_counter()
+        try:
+            while True:
+                # the rows are locked from their read to their check, so no change between is lost
+                with transaction.atomic():
+                    rows = self._read(last_pk, options['chunk_size'])
+                    if not rows:
+                        break
+                    self._write(rotate(rows))
+                    self._verify(rows, options['sample'], last_pk)
+                last_pk = rows[-1][0]
+                rotated += len(rows)
+                self.stdout.write(
+                    f'{rotated} credentials re-encrypted, up to pk {last_pk} '
+                    f'({rotated / (perf_counter() - start):.0f} rows/s)'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{rotated} credentials were re-encrypted in {perf_counter() - start:.1f}s.'
+        ))
+
+    def _read(self, last_pk, chunk_size):
+        values = (Credential.objects.select_for_update()
+                  .filter(pk__gt=last_pk).order_by('pk')
+                  .values_list('pk', *self.COLUMNS)[:chunk_size])
+        # the values are LazyPlaintexts, not decrypted by reading their ciphertext
+        return [(pk, tuple(None if value is None else value.ciphertext for value in tokens))
+                for pk, *tokens in values]
+
+    def _write(self, rows):
+        credentials = [
+            Credential(pk=pk, username_index=index, **{
+                name: None if token is None else Ciphertext(token)
+                for name, token in zip(self.COLUMNS, tokens)
+            })
+            for pk, tokens, index in rows
+        ]
+        Credential.objects.bulk_update(credentials, [*self.COLUMNS, 'username_index'])
+
+    def _verify(self, rows, sample, last_pk):
+        """Check that the saved tokens of a sample of the rows decrypt with the first key to their former plaintext"""
+
+        old_rows = dict(random.sample(rows, min(sample, len(rows))))
+        for pk, *tokens in Credential.objects.filter(pk__in=old_rows).values_list('pk', *self.COLUMNS):
+            for old, new in zip(old_rows[pk], tokens):
+                try:
+                    if old is not None and self.primary.decrypt(new.ciphertext) != self.fernet.decrypt(old):
+                        raise InvalidToken
+                except InvalidToken:
+                    raise CommandError(
+                        f'The credential of pk {pk} was not re-encrypted with the first key, '
+                        f'its chunk was rolled back. Resume with --start-after {last_pk}.'
+                    )
+
@@ -0,0 +1,235 @@
+import datetime
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from fernet_fields import EncryptedTextField
+
+from accounts.models import User
+from cis import rotation
+from cis.fields import Ciphertext
+from cis.models import CI, CIPack, Appliance, Client, Contract, Credential, Manufacturer, Place
+
+MANUFACTURERS = {
+    'Cisco': ('Catalyst 9300', 'ISR 4331', 'ASR 1001-X', 'Nexus 93180'),
+    'Juniper': ('EX4300', 'MX204', 'SRX345'),
+    'Arista': ('7050X3', '7280R3'),
+    'Fortinet': ('FortiGate 100F', 'FortiGate 600E'),
+    'Palo Alto Networks': ('PA-3220', 'PA-850'),
+    'HPE': ('Aruba 6300M', 'ProLiant DL380'),
+    'Dell': ('PowerEdge R650', 'PowerSwitch S5248F'),
+    'Ubiquiti': ('UniFi AP AC Pro', 'EdgeRouter 12'),
+    'F5': ('BIG-IP i5800',),
+    'MikroTik': ('CCR2004', 'RB5009'),
+}
+ROLES = ('sw', 'rtr', 'fw', 'ap', 'srv', 'lb')
+DESCRIPTIONS = ('Access switch', 'Core router', 'Edge firewall', 'Wireless access point', 'Hypervisor',
+                'Load balancer', 'Distribution switch', 'VPN concentrator')
+USERNAMES = ('admin', 'netops', 'root', 'support', 'svc-monitor')
+INSTRUCTIONS = (None, None, None, 'Jump host first', 'Console access only', 'Call the NOC before any change')
+ALPHABET = 'abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+
+class Command(BaseCommand):
+    help = ('Generate a large synthetic dataset for performance tests: clients with a user, places, '
+            'appliances and CIs with credentials, packs of the CIs sent or approved, manufacturers and contracts, '
+            'in realistic ratios. The same --seed generates the same data, the ciphertexts aside. '
+            'Rows are inserted by bulk_create in chunks, with their pks, and the credentials encrypted '
+            'beforehand by worker processes.')
+
+    CIS_PER_CLIENT = 5000
+    PLACES_PER_CLIENT = 20
+    CIS_PER_CONTRACT = 1000
+    CIS_PER_PACK = 50
+    # of the CIs created, sent and approved
+    STATUS_WEIGHTS = (60, 25, 15)
+    # a CI is made of 1 or 2 appliances of its client
+    APPLIANCES_PER_CI = 1.5
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cis', type=int, default=100000, help='CIs to generate.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='CIs inserted per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes encrypting the credentials.')
+
+    def handle(self, *args, **options):
+        self.seed = seed = options['seed']
+        self.prefix = f'Seed {seed}'
+        if Client.objects.filter(name__startswith=f'{self.prefix} ').exists():
+            raise CommandError(f'The data of --seed {seed} is already there. Please pick another seed.')
+        self.random = random.Random(seed)
+        self.chunk_size = options['chunk_size']
+        self.records = getattr(settings, 'CIS_CREDENTIAL_RECORDS', False)
+        # the pk of the next row of each model
+        self.pks = {model: (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1 for model in (
+            Client, User, Place, Appliance, CIPack, CI, Credential, Contract, Manufacturer, CI.appliances.through
+        )}
+
+        fernet_keys = EncryptedTextField().fernet_keys
+        index_key = getattr(settings, 'CIS_BLIND_INDEX_KEY', '').encode() or None
+        workers = options['workers']
+        if workers > 1:
+            executor = ProcessPoolExecutor(workers, initializer=rotation.init_worker, initargs=(fernet_keys, index_key))
+            encrypt_rows = partial(rotation.encrypt_rows, record=self.records)
+
+            def encrypt(rows):
+                return [row for part in executor.map(encrypt_rows, rotation.split(rows, workers)) for row in part]
+        else:
+            executor = None
+            rotation.init_worker(fernet_keys, index_key)
+            encrypt = partial(rotation.encrypt_rows, record=self.records)
+        self.encrypt = encrypt
+
+        count = options['cis']
+        start = perf_counter()
+        try:
+            with transaction.atomic():
+                self.manufacturers = self._manufacturers()
+                self.contracts = self._create(Contract, [
+                    self._contract(n) for n in range(max(1, count // self.CIS_PER_CONTRACT))
+                ])
+                self.approver = User.objects.filter(is_superuser=True).order_by('pk').first()
+
+            created = 0
+            clients = -(-count // self.CIS_PER_CLIENT)
+            for n in range(clients):
+                cis = count * (n + 1) // clients - count * n // clients
+                self._client(n, cis)
+                created += cis
+                self.stdout.write(
+                    f'{created} CIs generated, of {n + 1} clients ({created / (perf_counter() - start):.0f} CIs/s)'
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        self._reset_sequences()
+
+        self.stdout.write(self.style.SUCCESS(f'{count} CIs were generated in {perf_counter() - start:.1f}s.'))
+
+    def _manufacturers(self):
+        manufacturers = dict(Manufacturer.objects.filter(name__in=MANUFACTURERS).values_list('name', 'pk'))
+        new = [Manufacturer(name=name) for name in MANUFACTURERS if name not in manufacturers]
+        manufacturers.update((manufacturer.name, manufacturer.pk) for manufacturer in self._create(Manufacturer, new))
+        return [(manufacturers[name], models) for name, models in MANUFACTURERS.items()]
+
+    def _contract(self, n):
+        begin = datetime.date(2018, 1, 1) + datetime.timedelta(days=self.random.randrange(5 * 365))
+        return Contract(
+            name=f'{self.prefix} contract {n}',
+            begin=begin,
+            end=begin + datetime.timedelta(days=365 * self.random.choice((1, 3, 5))),
+            description=f'Support contract {n}',
+        )
+
+    def _client(self, n, count):
+        """Generate a client and its user, places, appliances and CIs, in chunks of CIs"""
+
+        with transaction.atomic():
+            client, = self._create(Client, [Client(name=f'{self.prefix} client {n}')])
+            user, = self._create(User, [User(
+                username=f'seed{self.seed}-client{n}', email=f'client{n}@seed{self.seed}.example.com',
+                password=make_password(None), client=client,
+            )])
+            places = self._create(Place, [
+                Place(client=client, name=f'Site {i}', description=f'{self.random.choice(DESCRIPTIONS)} room')
+                for i in range(self.PLACES_PER_CLIENT)
+            ])
+            appliances = self._create(Appliance, [
+                self._appliance(client, n, i) for i in range(max(1, round(count * self.APPLIANCES_PER_CI)))
+            ])
+
+        # the pack being filled for each status, and its size
+        self.packs = {}
+        for offset in range(0, count, self.chunk_size):
+            with transaction.atomic():
+                self.new_packs = []
+                cis = [self._ci(client, user, places, i) for i in range(offset, min(offset + self.chunk_size, count))]
+                self._create(CIPack, self.new_packs)
+                for ci in cis:
+                    # the packs had no pk when assigned
+                    ci.pack_id = ci.pack.pk if ci.pack is not None else None
+                self._create(CI, cis)
+                self._create(CI.appliances.through, [
+                    CI.appliances.through(ci_id=ci.pk, appliance_id=appliance.pk)
+                    for ci in cis
+                    for appliance in self.random.sample(appliances, min(len(appliances), self.random.randint(1, 2)))
+                ])
+                self._credentials(cis)
+
+    def _appliance(self, client, client_number, n):
+        manufacturer_id, models = self.random.choice(self.manufacturers)
+        return Appliance(
+            client=client,
+            serial_number=f'SEED{self.seed}-{client_number}-{n:07d}-{self.random.randrange(16 ** 6):06X}',
+            manufacturer_id=manufacturer_id,
+            model=self.random.choice(models),
+            virtual=self.random.random() < .2,
+        )
+
+    def _ci(self, client, user, places, n):
+        status = self.random.choices((0, 1, 2), self.STATUS_WEIGHTS)[0]
+        if self.random.random() < .05:
+            ip = f'2001:db8:{client.pk & 0xffff:x}::{n:x}'
+        else:
+            ip = f'10.{self.random.randrange(256)}.{self.random.randrange(256)}.{self.random.randrange(1, 255)}'
+        return CI(
+            client=client,
+            place=self.random.choice(places),
+            hostname=f'{self.random.choice(ROLES)}-{n:06d}',
+            ip=ip,
+            description=self.random.choice(DESCRIPTIONS),
+            deployed=self.random.random() < .8,
+            business_impact=self.random.choices((0, 1, 2), (50, 35, 15))[0],
+            contract_id=self.random.choice(self.contracts).pk,
+            status=status,
+            pack=self._pack(client, user, status),
+        )
+
+    def _pack(self, client, user, status):
+        """The pack of a sent or approved CI, a new one every CIS_PER_PACK CIs"""
+
+        if status == 0:
+            return None
+        pack, size = self.packs.get(status, (None, self.CIS_PER_PACK))
+        if size == self.CIS_PER_PACK:
+            pack, size = CIPack(responsible=user, client=client, approved_by=self.approver if status == 2 else None), 0
+            self.new_packs.append(pack)
+        self.packs[status] = (pack, size + 1)
+        return pack
+
+    def _credentials(self, cis):
+        rows = [(ci.pk, {
+            'username': self.random.choice(USERNAMES),
+            'password': ''.join(self.random.choices(ALPHABET, k=16)),
+            'enable_password': ''.join(self.random.choices(ALPHABET, k=16)) if self.random.random() < .5 else None,
+            'instructions': self.random.choice(INSTRUCTIONS),
+        }) for ci in cis]
+        self._create(Credential, [
+            Credential(ci_id=pk, username_index=index, **{
+                name: None if token is None else Ciphertext(token) for name, token in tokens.items()
+            })
+            for pk, tokens, index in self.encrypt(rows)
+        ])
+
+    def _create(self, model, objs):
+        """bulk_create the objects with the next pks, which SQLite wouldn't return"""
+
+        for obj in objs:
+            obj.pk = self.pks[model]
+            self.pks[model] += 1
+        return model.objects.bulk_create(objs, batch_size=self.chunk_size)
+
+    def _reset_sequences(self):
+        """Move the sequences of the pks past the rows inserted with their pks, as loaddata does"""
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), list(self.pks)):
+                cursor.execute(sql)
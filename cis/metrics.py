@@ -0,0 +1,264 @@
+"""
+In-process metrics, exposed in the Prometheus text format.
+
+Counters and fixed-bucket histograms, with labels, are kept by each process.
+With the setting CIS_METRICS_DIR, as under gunicorn, each process also saves
+its values to a file of that directory, named by its pid and start time, at
+most every CIS_METRICS_FLUSH_INTERVAL seconds and at the latest that long
+after an update, and the metrics view adds up the files of all the
+processes, every value being a sum. Clear the directory when the server is
+restarted. Without it, the view shows the values of its own process.
+"""
+
+import atexit
+import json
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from time import monotonic, perf_counter, time_ns
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from django.conf import settings
+
+from .middleware import HybridMiddleware
+
+# {metric name: {labels as a JSON list: value}}, a value being a number, or a list for histograms
+Snapshot = Dict[str, Dict[str, object]]
+
+FLUSH_INTERVAL = 5
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, 'Metric'] = {}
+        self.lock = threading.Lock()
+        # an older snapshot mustn't replace a newer one
+        self.flush_lock = threading.Lock()
+        self.last_flush = monotonic()
+        self.pending_flush: Optional[threading.Timer] = None
+        self.started = time_ns()
+        # a process forked from this one, e.g. a gunicorn worker, has a file of its own
+        os.register_at_fork(after_in_child=self.forked)
+
+    def forked(self):
+        self.started = time_ns()
+        self.pending_flush = None
+        # the values of the parent, e.g. of the master having preloaded the application, are in its own file
+        for metric in self.metrics.values():
+            metric.values.clear()
+
+    @property
+    def file_name(self) -> str:
+        # the pid of a process that exited may be reused
+        return f'metrics-{os.getpid()}-{self.started}.json'
+
+    def register(self, metric: 'Metric'):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self) -> Snapshot:
+        with self.lock:
+            return {name: dict(metric.values) for name, metric in self.metrics.items()}
+
+    def updated(self):
+        """Save the values of the process when the last save is old enough, called after each update"""
+
+        directory = getattr(settings, 'CIS_METRICS_DIR', None)
+        if not directory:
+            return
+        wait = getattr(settings, 'CIS_METRICS_FLUSH_INTERVAL', FLUSH_INTERVAL) - (monotonic() - self.last_flush)
+        if wait <= 0:
+            self.flush(directory)
+        elif self.pending_flush is None:
+            # the last updates of a process gone idle are saved too
+            self.pending_flush = threading.Timer(wait, self.flush, (directory,))
+            self.pending_flush.daemon = True
+            self.pending_flush.start()
+
+    def flush(self, directory):
+        with self.flush_lock:
+            self.last_flush = monotonic()
+            self.pending_flush = None
+            # a temporary file per save, so no two threads write the same one
+            with NamedTemporaryFile('w', dir=directory, prefix='.metrics-', suffix='.tmp', delete=False) as temporary:
+                temporary.write(json.dumps(self.snapshot()))
+            # atomic, so the view never reads a partial file
+            os.replace(temporary.name, Path(directory) / self.file_name)
+
+    def collect(self) -> Snapshot:
+        """Return the values of every process, or of this one without CIS_METRICS_DIR"""
+
+        snapshots = [self.snapshot()]
+        directory = getattr(settings, 'CIS_METRICS_DIR', None)
+        if directory:
+            for path in Path(directory).glob('metrics-*.json'):
+                if path.name != self.file_name:
+                    snapshots.append(json.loads(path.read_text()))
+        return merge(snapshots)
+
+    def expose(self) -> str:
+        """Return the values of every process in the Prometheus text format"""
+
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(values.get(name, {}).items()):
+                lines.extend(metric.sample_lines(dict(zip(metric.labels, json.loads(labels))), value))
+        return '\n'.join(lines) + '\n'
+
+
+def merge(snapshots: Iterable[Snapshot]) -> Snapshot:
+    merged = defaultdict(dict)
+    for snapshot in snapshots:
+        for name, values in snapshot.items():
+            for labels, value in values.items():
+                current = merged[name].get(labels)
+                if current is None:
+                    merged[name][labels] = value
+                elif isinstance(value, list):
+                    merged[name][labels] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[name][labels] = current + value
+    return merged
+
+
+REGISTRY = Registry()
+
+
+@atexit.register
+def flush():
+    """Save the values of the process, e.g. as it exits"""
+
+    directory = getattr(settings, 'CIS_METRICS_DIR', None) if settings.configured else None
+    if directory:
+        REGISTRY.flush(directory)
+
+
+class Metric(ABC):
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry
+        self.values = {}
+        registry.register(self)
+
+    def key(self, labels: dict) -> str:
+        return json.dumps([str(labels[label]) for label in self.labels])
+
+    @abstractmethod
+    def sample_lines(self, labels: dict, value) -> List[str]:
+        """Return the lines of the exposition of a value"""
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.updated()
+
+    def sample_lines(self, labels, value):
+        return [f'{self.name}{format_labels(labels)} {format_value(value)}']
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, *args, buckets: Sequence[float] = BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = (*buckets, math.inf)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        bucket = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self.registry.lock:
+            # the count of each bucket, then the sum of the values
+            values = self.values.setdefault(key, [0] * (len(self.buckets) + 1))
+            values[bucket] += 1
+            values[-1] += value
+        self.registry.updated()
+
+    def time(self, **labels) -> 'Timer':
+        return Timer(self, labels)
+
+    def sample_lines(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            le = '+Inf' if bound == math.inf else format_value(bound)
+            lines.append(f'{self.name}_bucket{format_labels({**labels, "le": le})} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(value[-1])}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Timer:
+    """Observe the seconds a block takes"""
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.start, **self.labels)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Observe the latency of each request, by view"""
+
+    def before(self, request):
+        return perf_counter()
+
+    def after(self, request, response, start):
+        match = request.resolver_match
+        REQUEST_DURATION.observe(perf_counter() - start, view=match.view_name if match else '')
+        return response
+
+
+REQUEST_DURATION = Histogram(
+    'cis_request_duration_seconds', 'Latency of the requests, by view.', ('view',),
+)
+IMPORTED_ROWS = Counter(
+    'cis_import_rows_total', 'Spreadsheet rows imported by CILoader, by result.', ('result',),
+)
+IMPORT_DURATION = Histogram(
+    'cis_import_duration_seconds', 'Duration of the spreadsheet imports of CILoader.',
+    buckets=(.1, .5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+APPROVAL_BATCH_SIZE = Histogram(
+    'cis_approval_batch_size', 'CIs approved per transaction, from the admin actions.',
+    buckets=(1, 10, 100, 1000, 10000),
+)
+CACHE_REQUESTS = Counter(
+    'cis_cache_requests_total', 'Lookups of the caches, by cache and result, hit or miss.', ('cache', 'result'),
+)
@@ -0,0 +1,86 @@
+"""
+Base of the middlewares of the project, running in the mode of their handler.
+
+Under ASGI, Django runs a sync-only middleware in a thread, so a request to
+an async view would go through async_to_sync and sync_to_async once per such
+middleware. A subclass of HybridMiddleware is called sync under WSGI and
+async under ASGI: its work, which mustn't block, is done by before() and
+after(), around the view, and finish(), whether the view raised or not.
+
+The queries of a request are watched through watch_queries() rather than
+connection.execute_wrapper(): the connections are per thread, and under
+ASGI, the queries run in the threads of sync_to_async. A context variable
+follows the request into them, so each connection runs the watchers of the
+request, installed on it by install_query_watchers() once it connects.
+"""
+
+import asyncio
+from contextvars import ContextVar, Token
+from functools import partial
+
+# the database execute wrappers of the request being served
+_query_watchers = ContextVar('query_watchers', default=())
+
+
+def watch_queries(watcher) -> Token:
+    """Run the queries of the current request through an execute wrapper, until unwatch_queries()"""
+
+    return _query_watchers.set((*_query_watchers.get(), watcher))
+
+
+def unwatch_queries(token: Token):
+    _query_watchers.reset(token)
+
+
+def run_watched(execute, sql, params, many, context):
+    for watcher in reversed(_query_watchers.get()):
+        execute = partial(watcher, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_watchers(sender, connection, **kwargs):
+    """Receive connection_created, the wrappers of a connection being kept over reconnections"""
+
+    if run_watched not in connection.execute_wrappers:
+        # first, as connection.execute_wrapper() pops the last one when done
+        connection.execute_wrappers.insert(0, run_watched)
+
+
+class HybridMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def before(self, request):
+        """Return the state passed to after() and finish()"""
+        return None
+
+    def after(self, request, response, state):
+        return response
+
+    def finish(self, state):
+        pass
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.before(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish(state)
+        return self.after(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.before(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish(state)
+        return self.after(request, response, state)
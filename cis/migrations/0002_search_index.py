@@ -0,0 +1,107 @@
+import sqlite3
+
+from django.db import migrations
+
+# A frozen copy of the search index of cis.search as it was when this migration
+# was written, so later changes there don't change what this migration does.
+SEARCH_FIELDS = {
+    'cis.ci': ('hostname', 'ip', 'description'),
+    'cis.appliance': ('serial_number', 'model'),
+}
+# FTS5 got the trigram tokenizer in SQLite 3.34.0
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def columns(model):
+    return [model._meta.get_field(name).column for name in SEARCH_FIELDS[model._meta.label_lower]]
+
+
+def trigger_names(model):
+    fts = fts_table(model)
+    return f'{fts}_ai', f'{fts}_ad', f'{fts}_au'
+
+
+def trigram_expressions(model, schema_editor):
+    table = model._meta.db_table
+    for name in SEARCH_FIELDS[model._meta.label_lower]:
+        field = model._meta.get_field(name)
+        column = schema_editor.quote_name(field.column)
+        if field.get_internal_type() in ('IPAddressField', 'GenericIPAddressField'):
+            expression = f'UPPER(HOST({column}))'
+        else:
+            expression = f'UPPER({column}::text)'
+        yield f'{table}_{field.column}_trgm', expression
+
+
+def create_index(model, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, expression in trigram_expressions(model, schema_editor):
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} '
+                f'ON {schema_editor.quote_name(model._meta.db_table)} '
+                f'USING gin (({expression}) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite' and SQLITE_HAS_TRIGRAM:
+        table = model._meta.db_table
+        fts = fts_table(model)
+        pk = model._meta.pk.column
+        names = ', '.join(columns(model))
+        new = ', '.join(f'new.{column}' for column in columns(model))
+        old = ', '.join(f'old.{column}' for column in columns(model))
+        insert, delete, update = trigger_names(model)
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+            f"{names}, content='{table}', content_rowid='{pk}', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {names} ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); "
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_index(model, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for name, _ in trigram_expressions(model, schema_editor):
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+    elif vendor == 'sqlite':
+        for trigger in trigger_names(model):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts_table(model)}')
+
+
+def create_search_index(apps, schema_editor):
+    for label in SEARCH_FIELDS:
+        create_index(apps.get_model(label), schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    for label in SEARCH_FIELDS:
+        drop_index(apps.get_model(label), schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+import ipaddress
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+IPV4_MAPPED_PREFIX = 0xffff << 32
+
+
+def ip_to_key(address):
+    """A frozen copy of cis.models.ip_to_key() as it was when this migration was written"""
+    ip = ipaddress.ip_address(address)
+    number = int(ip) + IPV4_MAPPED_PREFIX if ip.version == 4 else int(ip)
+    return f'{number:032x}'
+
+
+def fill_ip_key(apps, schema_editor):
+    CI = apps.get_model('cis', 'CI')
+    batch = []
+    for ci in CI.objects.only('pk', 'ip').order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        ci.ip_key = ip_to_key(ci.ip)
+        batch.append(ci)
+        if len(batch) == BATCH_SIZE:
+            CI.objects.bulk_update(batch, ['ip_key'])
+            batch = []
+    CI.objects.bulk_update(batch, ['ip_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ci',
+            name='ip_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=32),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_ip_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:20
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_cis(apps, schema_editor):
+    CI = apps.get_model('cis', 'CI')
+    for model_name, key_field in (('ClientCIStatusCount', 'client_id'), ('PackCIStatusCount', 'pack_id')):
+        model = apps.get_model('cis', model_name)
+        rows = (
+            CI.objects.exclude(**{key_field: None}).order_by()
+            .values_list(key_field, 'status').annotate(Count('pk'))
+        )
+        model.objects.bulk_create(
+            (model(**{key_field: key, 'status': status, 'count': n}) for key, status, n in rows),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0003_ci_ip_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackCIStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'created'), (1, 'sent'), (2, 'approved')])),
+                ('count', models.IntegerField(default=0)),
+                ('pack', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cis.cipack')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClientCIStatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'created'), (1, 'sent'), (2, 'approved')])),
+                ('count', models.IntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cis.client')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='packcistatuscount',
+            constraint=models.UniqueConstraint(fields=('pack', 'status'), name='unique_pack_status_count'),
+        ),
+        migrations.AddConstraint(
+            model_name='clientcistatuscount',
+            constraint=models.UniqueConstraint(fields=('client', 'status'), name='unique_client_status_count'),
+        ),
+        migrations.RunPython(count_cis, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cis', '0004_ci_status_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('ci_pks', models.JSONField(default=list)),
+                ('pack_pks', models.JSONField(default=list)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('done', models.PositiveIntegerField(default=0)),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done'), (3, 'failed')], default=0)),
+                ('error', models.TextField(blank=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
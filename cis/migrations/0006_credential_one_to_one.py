@@ -0,0 +1,184 @@
+import sqlite3
+
+from django.db import migrations, models
+from django.db.models import F, Max
+import django.db.models.deletion
+
+BATCH_SIZE = 10000
+
+# A frozen copy of the search index of cis.search as it was when this migration
+# was written, so later changes there don't change what this migration does.
+SEARCH_FIELDS = {
+    'cis.ci': ('hostname', 'ip', 'description'),
+    'cis.appliance': ('serial_number', 'model'),
+}
+# FTS5 got the trigram tokenizer in SQLite 3.34.0
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def columns(model):
+    return [model._meta.get_field(name).column for name in SEARCH_FIELDS[model._meta.label_lower]]
+
+
+def trigger_names(model):
+    fts = fts_table(model)
+    return f'{fts}_ai', f'{fts}_ad', f'{fts}_au'
+
+
+def trigram_expressions(model, schema_editor):
+    table = model._meta.db_table
+    for name in SEARCH_FIELDS[model._meta.label_lower]:
+        field = model._meta.get_field(name)
+        column = schema_editor.quote_name(field.column)
+        if field.get_internal_type() in ('IPAddressField', 'GenericIPAddressField'):
+            expression = f'UPPER(HOST({column}))'
+        else:
+            expression = f'UPPER({column}::text)'
+        yield f'{table}_{field.column}_trgm', expression
+
+
+def create_index(model, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, expression in trigram_expressions(model, schema_editor):
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} '
+                f'ON {schema_editor.quote_name(model._meta.db_table)} '
+                f'USING gin (({expression}) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite' and SQLITE_HAS_TRIGRAM:
+        table = model._meta.db_table
+        fts = fts_table(model)
+        pk = model._meta.pk.column
+        names = ', '.join(columns(model))
+        new = ', '.join(f'new.{column}' for column in columns(model))
+        old = ', '.join(f'old.{column}' for column in columns(model))
+        insert, delete, update = trigger_names(model)
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+            f"{names}, content='{table}', content_rowid='{pk}', tokenize='trigram')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {names} ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); "
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_index(model, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for name, _ in trigram_expressions(model, schema_editor):
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+    elif vendor == 'sqlite':
+        for trigger in trigger_names(model):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts_table(model)}')
+
+
+class AlterModelBases(migrations.operations.base.Operation):
+    """Change the bases of a model in the migration state. There is no operation for it in Django."""
+
+    reversible = True
+
+    def __init__(self, name, bases):
+        self.name = name
+        self.bases = bases
+
+    def deconstruct(self):
+        return self.__class__.__name__, [], {'name': self.name, 'bases': self.bases}
+
+    def state_forwards(self, app_label, state):
+        state.models[app_label, self.name.lower()].bases = self.bases
+        state.reload_model(app_label, self.name.lower(), delay=True)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        pass
+
+    def describe(self):
+        return f'Change the bases of {self.name} to {self.bases}'
+
+
+def drop_ci_search_index(apps, schema_editor):
+    drop_index(apps.get_model('cis', 'CI'), schema_editor)
+
+
+def create_ci_search_index(apps, schema_editor):
+    create_index(apps.get_model('cis', 'CI'), schema_editor)
+
+
+def link_credentials(apps, schema_editor):
+    """The CIs kept the ids of their credentials, which only have to point back to them"""
+
+    CI = apps.get_model('cis', 'CI')
+    Credential = apps.get_model('cis', 'Credential')
+    Credential.objects.exclude(pk__in=CI.objects.values('pk')).delete()
+    last = Credential.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        Credential.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(ci_id=F('pk'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0005_approvaljob'),
+    ]
+
+    operations = [
+        # the index is keyed by the primary key column, renamed below
+        migrations.RunPython(drop_ci_search_index, create_ci_search_index),
+        AlterModelBases('CI', (models.Model,)),
+        migrations.AlterField(
+            model_name='ci',
+            name='credential_ptr',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+        migrations.RenameField(
+            model_name='ci',
+            old_name='credential_ptr',
+            new_name='id',
+        ),
+        migrations.AlterField(
+            model_name='ci',
+            name='id',
+            field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+        ),
+        migrations.AddField(
+            model_name='credential',
+            name='ci',
+            field=models.OneToOneField(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='credential',
+                to='cis.ci',
+            ),
+        ),
+        migrations.RunPython(link_credentials, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='credential',
+            name='ci',
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='credential',
+                to='cis.ci',
+            ),
+        ),
+        migrations.RunPython(create_ci_search_index, drop_ci_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:36
+
+import cis.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0006_credential_one_to_one'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='credential',
+            name='enable_password',
+            field=cis.fields.LazyEncryptedCharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='instructions',
+            field=cis.fields.LazyEncryptedCharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='password',
+            field=cis.fields.LazyEncryptedCharField(max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='username',
+            field=cis.fields.LazyEncryptedCharField(max_length=50),
+        ),
+    ]
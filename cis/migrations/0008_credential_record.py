@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:39
+
+import cis.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0007_credential_lazy_decryption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='credential',
+            name='record',
+            field=cis.fields.EncryptedRecordField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='enable_password',
+            field=cis.fields.LazyEncryptedCharField(max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='password',
+            field=cis.fields.LazyEncryptedCharField(max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='credential',
+            name='username',
+            field=cis.fields.LazyEncryptedCharField(max_length=50, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0008_credential_record'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='credential',
+            name='username_index',
+            field=models.CharField(db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0009_credential_username_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appliance',
+            index=models.Index(fields=['client', 'manufacturer'], name='cis_appl_client_manuf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appliance',
+            index=models.Index(fields=['client', 'serial_number'], name='cis_appl_client_serial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ci',
+            index=models.Index(fields=['status', 'hostname'], name='cis_ci_status_hostname_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ci',
+            index=models.Index(fields=['pack', 'status'], name='cis_ci_pack_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ci',
+            index=models.Index(fields=['hostname'], name='cis_ci_hostname_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:07
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+import django.db.models.deletion
+
+BATCH_SIZE = 10000
+
+
+def fill_pack_client(apps, schema_editor):
+    """The client of a pack is the one of its CIs"""
+    CI = apps.get_model('cis', 'CI')
+    CIPack = apps.get_model('cis', 'CIPack')
+    client = Subquery(CI.objects.filter(pack=OuterRef('pk')).values('client')[:1])
+    last = CIPack.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        CIPack.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(client=client)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0010_view_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cipack',
+            name='client',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='cis.client'),
+        ),
+        migrations.RunPython(fill_pack_client, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appliance',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cis.client'),
+        ),
+        migrations.AlterField(
+            model_name='ci',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cis.client'),
+        ),
+        migrations.AlterField(
+            model_name='place',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cis.client'),
+        ),
+        migrations.AddIndex(
+            model_name='ci',
+            index=models.Index(fields=['client', 'status', 'hostname'], name='cis_ci_client_status_host_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-19 15:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0011_client_scoped_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='approvaljob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cis', '0012_approvaljob_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cipack',
+            name='client',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='cis.client'),
+        ),
+    ]
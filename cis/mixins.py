@@ -1,6 +1,18 @@
+from django.conf import settings
 from django.contrib.auth.mixins import UserPassesTestMixin
 
 
+def credential_username(request) -> str:
+    """
+    Return the `username` GET parameter, which CI lists are filtered by through
+    CIQuerySet.with_credential_username(), or '' without CIS_BLIND_INDEX_KEY.
+    """
+
+    if not getattr(settings, 'CIS_BLIND_INDEX_KEY', ''):
+        return ''
+    return request.GET.get('username', '').strip()
+
+
 class UserApprovedMixin(UserPassesTestMixin):
     """
     Deny access to unapproved users.
@@ -19,3 +31,30 @@ class AddClientMixin:
     def form_valid(self, form):
         form.instance.client = self.request.user.client
         return super().form_valid(form)
+
+
+class SearchMixin:
+    """
+    Filter list views by the term in the `q` GET parameter.
+
+    Views call self.search() on their queryset. The GET parameters,
+    minus the page, are added to the context to be kept by the pagination.
+    """
+    search_function = None
+
+    def get_search_term(self):
+        return self.request.GET.get('q', '').strip()
+
+    def search(self, queryset):
+        term = self.get_search_term()
+        if not term:
+            return queryset
+        return self.search_function(queryset, term)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        context['search_term'] = self.get_search_term()
+        context['querystring'] = params.urlencode()
+        return context
@@ -1,17 +1,59 @@
-from typing import Tuple, NewType
+import ipaddress
+from collections import Counter
+from typing import List, Tuple, NewType, Union, Iterable, Dict, Optional
 
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import ImproperlyConfigured
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
 from django.urls import reverse
 from django.utils import timezone
-from fernet_fields import EncryptedCharField
+from django.utils.functional import SimpleLazyObject
 
 from accounts.models import User
+from .fields import LazyEncryptedCharField, LazyPlaintext, EncryptedRecordField
+from .rotation import blind_index
 
 
 CIId = NewType('CIId', int)
 
+# IPv4 addresses are keyed as IPv4-mapped IPv6 addresses (::ffff:0:0/96)
+IPV4_MAPPED_PREFIX = 0xffff << 32
+
+
+def ip_to_key(address: str) -> str:
+    """
+    Encode an IP address as its 128-bit integer, in zero-padded hex.
+
+    The text order of the keys is the numeric order of the addresses,
+    so they can be indexed, sorted and scanned by range on every backend.
+    """
+
+    ip = ipaddress.ip_address(address)
+    number = int(ip) + IPV4_MAPPED_PREFIX if ip.version == 4 else int(ip)
+    return f'{number:032x}'
+
+
+def network_to_key_range(network: Union[str, ipaddress.IPv4Network, ipaddress.IPv6Network]) -> Tuple[str, str]:
+    """Return the first and last keys of a network such as '10.20.0.0/16'"""
+
+    network = ipaddress.ip_network(network, strict=False)
+    return ip_to_key(network.network_address), ip_to_key(network.broadcast_address)
+
+
+def username_index(username) -> Optional[str]:
+    """
+    Return the blind index of a credential username, its HMAC keyed by the
+    setting CIS_BLIND_INDEX_KEY, or None without a username or a key.
+    """
+
+    key = getattr(settings, 'CIS_BLIND_INDEX_KEY', '')
+    if not key or username is None:
+        return None
+    return blind_index(key.encode(), str(username))
+
 
 class Company(models.Model):
     """Model representing an abstract Company.
@@ -41,10 +83,39 @@ class Client(Company):
         return self.name
 
 
+class ClientScopedQuerySet(models.QuerySet):
+    """
+    Scope the rows of a model with a client to a client or to a user.
+
+    The filter is on the client_id column of the model itself, never through
+    a join, and the indexes of the model lead with it.
+    """
+
+    def for_client(self, client: Union[Client, int, None]):
+        return self.filter(client_id=getattr(client, 'pk', client))
+
+    def for_user(self, user):
+        """Every row for a superuser, the rows of their client for other users, none without a client"""
+        if user.is_superuser:
+            return self
+        if user.client_id is None:
+            return self.none()
+        return self.for_client(user.client_id)
+
+
+class PlaceManager(models.Manager.from_queryset(ClientScopedQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().select_related('client')
+
+
 class Place(models.Model):
     """Model representing a location of a Client"""
 
-    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # modify the initial queryset to join the Client, which is part of __str__()
+    objects = PlaceManager()
+
+    # indexed by unique_client_place_name
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False)
     name = models.CharField(max_length=50)
     description = models.CharField(max_length=255, blank=True, null=True)
 
@@ -97,7 +168,7 @@ class Contract(models.Model):
         return self.name
 
 
-class ApplianceManager(models.Manager):
+class ApplianceManager(models.Manager.from_queryset(ClientScopedQuerySet)):
     def get_queryset(self):
         return super().get_queryset().select_related('manufacturer')
 
@@ -108,7 +179,8 @@ class Appliance(models.Model):
     # modify the initial queryset to join the Manufacturer
     objects = ApplianceManager()
 
-    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # indexed by the indexes of Meta
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False)
     serial_number = models.CharField(max_length=255, unique=True)
     manufacturer = models.ForeignKey(Manufacturer, on_delete=models.SET_NULL, null=True)
     model = models.CharField(max_length=100)
@@ -122,16 +194,101 @@ class Appliance(models.Model):
 
     class Meta:
         ordering = ['serial_number']
+        # the appliances of a client, by manufacturer or in order, see the command advise_indexes
+        indexes = [
+            models.Index(fields=['client', 'manufacturer'], name='cis_appl_client_manuf_idx'),
+            models.Index(fields=['client', 'serial_number'], name='cis_appl_client_serial_idx'),
+        ]
 
 
 class Credential(models.Model):
-    """Model representing access credentials of a Configuration Item"""
+    """
+    Model representing access credentials of a Configuration Item.
+
+    They live in their own table, joined only when asked for,
+    e.g. `ci.credential` or `select_related('credential')`,
+    so listing CIs reads and decrypts nothing of them.
+
+    With the setting CIS_CREDENTIAL_RECORDS, the values are saved together
+    in `record`, as a single token, and their own columns are left empty.
+    Either way, they are read and written through the same attributes.
+
+    With the setting CIS_BLIND_INDEX_KEY, `username_index` keeps the blind
+    index of the username, to look up CIs by username with an indexed query,
+    see CIQuerySet.with_credential_username(). The command
+    rotate_credential_keys computes it again for every credential.
+    """
+
+    FIELDS = ('username', 'password', 'enable_password', 'instructions')
 
     credential_id = models.AutoField(primary_key=True)
-    username = EncryptedCharField(max_length=50)
-    password = EncryptedCharField(max_length=50)
-    enable_password = EncryptedCharField(max_length=50)
-    instructions = EncryptedCharField(max_length=255, blank=True, null=True)
+    ci = models.OneToOneField('CI', on_delete=models.CASCADE, related_name='credential')
+    username = LazyEncryptedCharField(max_length=50, null=True)
+    password = LazyEncryptedCharField(max_length=50, null=True)
+    enable_password = LazyEncryptedCharField(max_length=50, null=True)
+    instructions = LazyEncryptedCharField(max_length=255, blank=True, null=True)
+    record = EncryptedRecordField(null=True, editable=False)
+    username_index = models.CharField(max_length=64, null=True, editable=False, db_index=True)
+
+    # the attributes set from the record by from_db()
+    record_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        record = instance.__dict__.get('record')
+        if record is not None:
+            instance.record_values = {name: cls._record_value(record, name) for name in cls.FIELDS}
+            instance.__dict__.update(instance.record_values)
+        return instance
+
+    @staticmethod
+    def _record_value(record, name):
+        return SimpleLazyObject(lambda: record[name])
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & {'record', *self.FIELDS}:
+            kwargs['update_fields'] = {*update_fields, 'record', 'username_index', *self.FIELDS}
+        if not getattr(settings, 'CIS_CREDENTIAL_RECORDS', False):
+            self.record = None
+            # an untouched username keeps its index, saving the decryption
+            if not (isinstance(self.username, LazyPlaintext) and not self.username.is_decrypted):
+                self.username_index = username_index(self.username)
+            return super().save(*args, **kwargs)
+
+        values = {name: getattr(self, name) for name in self.FIELDS}
+        if not self.has_untouched_record(values):
+            self.record = values
+            self.username_index = username_index(values['username'])
+        self.__dict__.update(dict.fromkeys(self.FIELDS))
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self.__dict__.update(values)
+
+    def has_untouched_record(self, values) -> bool:
+        """Whether the record was loaded and neither decrypted nor replaced since"""
+
+        return (
+            isinstance(self.record, LazyPlaintext) and not self.record.is_decrypted
+            and self.record_values is not None
+            and all(values[name] is self.record_values[name] for name in self.FIELDS)
+        )
+
+
+class CIPackQuerySet(ClientScopedQuerySet):
+    def with_approval_counts(self):
+        """Annotate the number of CIs, and of approved CIs, of each pack"""
+        return self.annotate(
+            num_cis=Count('ci'),
+            num_cis_approved=Count('ci', filter=Q(ci__status=2)),
+        )
+
+
+class CIPackManager(models.Manager.from_queryset(CIPackQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().select_related('responsible')
 
 
 class CIPack(models.Model):
@@ -141,7 +298,12 @@ class CIPack(models.Model):
     It is used to send CIs to production.
     """
 
+    # modify the initial queryset to join the responsible, which is part of __str__()
+    objects = CIPackManager()
+
     responsible = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True)
+    # the client of the CIs of the pack
+    client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True)
     sent_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     approved_by = models.ForeignKey(
         'accounts.User',
@@ -154,15 +316,23 @@ class CIPack(models.Model):
     @property
     @admin.display(description='Approved (%)')
     def percentage_of_cis_approved(self) -> int:
-        num_cis_approved = self.ci_set.filter(status=2).count()
+        # use the annotations of with_approval_counts() when present
+        if hasattr(self, 'num_cis_approved'):
+            num_cis, num_cis_approved = self.num_cis, self.num_cis_approved
+        else:
+            counts = self.ci_set.aggregate(
+                num_cis=Count('pk'),
+                num_cis_approved=Count('pk', filter=Q(status=2)),
+            )
+            num_cis, num_cis_approved = counts['num_cis'], counts['num_cis_approved']
         if not num_cis_approved:
             return 0
-        return round((num_cis_approved / len(self)) * 100)
+        return round((num_cis_approved / num_cis) * 100)
 
-    def send_to_production(self, ci_pks: Tuple[CIId, ...]):
-        cis = CI.objects.filter(pk__in=ci_pks)
-        self.ci_set.set(cis)
-        self.ci_set.update(status=1)
+    def send_to_production(self, ci_pks: Union[Iterable[CIId], models.QuerySet]) -> int:
+        """Return the number of CIs sent, `ci_pks` being pks or a queryset of them"""
+        # a single update, so the counters see the CIs move to the pack
+        return CI.objects.filter(pk__in=ci_pks).update(pack=self, status=1)
 
     def approve_all_cis(self):
         self.ci_set.update(status=2)
@@ -175,14 +345,108 @@ class CIPack(models.Model):
         return f"{self.responsible} {local_date.strftime('%Y-%m-%d %H:%M:%S')}"
 
 
-class CI(Credential):
+# the CI fields the status counters are keyed by
+COUNTED_FIELDS = {'client', 'pack', 'status'}
+
+
+class CIQuerySet(ClientScopedQuerySet):
+    """
+    The CIs of a client, kept consistent on the paths that bypass save().
+
+    bulk_create(), bulk_update(), update() and delete() keep CI.ip_key in step
+    with CI.ip, and the status counters, ClientCIStatusCount and
+    PackCIStatusCount, in step with the CIs. Writing the CIs in any other way,
+    e.g. with raw SQL or through _base_manager, leaves them behind, until the
+    command rebuild_ci_counters.
+    """
+
+    def in_network(self, network):
+        """Filter the CIs whose IP is in the network, by a range scan on ip_key"""
+        return self.filter(ip_key__range=network_to_key_range(network))
+
+    def with_credential_username(self, username: str):
+        """Filter the CIs whose credential has the username, by its blind index"""
+        index = username_index(username)
+        if index is None:
+            raise ImproperlyConfigured('Looking up credential usernames requires the setting CIS_BLIND_INDEX_KEY.')
+        return self.filter(credential__username_index=index)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.ip_key = ip_to_key(obj.ip)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            groups = Counter(obj.counter_key for obj in created)
+            count_cis((*key, n) for key, n in groups.items())
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'ip' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.ip_key = ip_to_key(obj.ip)
+            fields = [*fields, 'ip_key']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        # bulk_update() passes the keys along with the addresses
+        if 'ip' in kwargs and 'ip_key' not in kwargs:
+            if hasattr(kwargs['ip'], 'resolve_expression'):
+                raise ValueError('CI.ip can only be updated to an address, not an expression, '
+                                 'as CI.ip_key is computed from it.')
+            kwargs['ip_key'] = ip_to_key(str(kwargs['ip']))
+        if not COUNTED_FIELDS & kwargs.keys():
+            return super().update(**kwargs)
+
+        # no savepoint within a transaction, the counters being rolled back with it anyway
+        with transaction.atomic(using=self.db, savepoint=False):
+            groups = self.counter_groups()
+            rows = super().update(**kwargs)
+            new = {name: getattr(value, 'pk', value) for name, value in kwargs.items() if name in COUNTED_FIELDS}
+            if any(hasattr(value, 'resolve_expression') for value in new.values()):
+                # the new values are only known by the database
+                ClientCIStatusCount.objects.recount({group[0] for group in groups})
+                PackCIStatusCount.objects.recount({group[1] for group in groups})
+            else:
+                count_cis([
+                    *((client_id, pack_id, status, -n) for client_id, pack_id, status, n in groups),
+                    *((new.get('client', client_id), new.get('pack', pack_id), new.get('status', status), n)
+                      for client_id, pack_id, status, n in groups),
+                ])
+        return rows
+
+    def delete(self):
+        # counted here rather than by a delete signal, which would load every CI deleted
+        with transaction.atomic(using=self.db, savepoint=False):
+            groups = self.counter_groups()
+            deleted = super().delete()
+            count_cis(groups, -1)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def counter_groups(self) -> List[Tuple[int, Optional[int], int, int]]:
+        """Return the (client, pack, status, number of CIs) groups of the CIs"""
+
+        # annotations (e.g. from the admin) would change the grouping
+        counted = self.model._base_manager.filter(pk__in=self.values('pk')) if self.query.annotations else self
+        return list(counted.order_by().values_list('client_id', 'pack_id', 'status').annotate(Count('pk')))
+
+
+class CI(models.Model):
     """
     Model representing a Configuration Item.
 
-    It is composed of a Setup and a Credential.
-    https://docs.djangoproject.com/en/stable/topics/db/models/#multiple-inheritance
+    Its access credentials are a Credential, see `ci.credential`.
     """
 
+    objects = CIQuerySet.as_manager()
+
+    # (client, pack, status) as last counted. See from_db() and cis.signals
+    counted_key = None
+
     IMPACT_OPTIONS = (
         (0, 'low'),
         (1, 'medium'),
@@ -193,11 +457,14 @@ class CI(Credential):
         (1, 'sent'),
         (2, 'approved'),
     )
-    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # indexed by the indexes of Meta
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False)
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
     appliances = models.ManyToManyField(Appliance)
     hostname = models.CharField(max_length=50)
     ip = models.GenericIPAddressField()
+    # the IP as a sortable key, see ip_to_key()
+    ip_key = models.CharField(max_length=32, db_index=True, editable=False)
     description = models.CharField(max_length=255)
     deployed = models.BooleanField(default=False)
     business_impact = models.PositiveSmallIntegerField(
@@ -219,6 +486,30 @@ class CI(Credential):
     def get_absolute_url(self):
         return reverse('cis:ci_detail', args=(self.pk,))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'client_id', 'pack_id', 'status'}.issubset(field_names):
+            instance.counted_key = instance.counter_key
+        return instance
+
+    @property
+    def counter_key(self) -> Tuple[int, Optional[int], int]:
+        return self.client_id, self.pack_id, self.status
+
+    def save(self, *args, **kwargs):
+        self.ip_key = ip_to_key(self.ip)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'ip' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'ip_key'}
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            deleted = super().delete(*args, **kwargs)
+            count_cis([(*self.counter_key, 1)], -1)
+        return deleted
+
     class Meta:
         ordering = ['hostname']
         constraints = [
@@ -227,3 +518,173 @@ class CI(Credential):
                 name='unique_client_hostname_ip_description'
             )
         ]
+        # the CIs of a status, of a client or not, or of a pack, and the CIs in order,
+        # see the command advise_indexes
+        indexes = [
+            models.Index(fields=['client', 'status', 'hostname'], name='cis_ci_client_status_host_idx'),
+            models.Index(fields=['status', 'hostname'], name='cis_ci_status_hostname_idx'),
+            models.Index(fields=['pack', 'status'], name='cis_ci_pack_status_idx'),
+            models.Index(fields=['hostname'], name='cis_ci_hostname_idx'),
+        ]
+
+
+class ApprovalJob(models.Model):
+    """
+    Model representing a bulk approval of CIs run in background.
+
+    The CIs are approved in chunks of the sorted `ci_pks`, and `done` is saved
+    along with each chunk, so a job can be resumed where it stopped. Without
+    `ci_pks`, every CI of the `pack_pks` is approved, by chunks of their pks.
+    """
+
+    STATUS_OPTIONS = (
+        (0, 'pending'),
+        (1, 'running'),
+        (2, 'done'),
+        (3, 'failed'),
+    )
+    requested_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # saved with each chunk, so a job no longer updated is known to have stopped
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    ci_pks = models.JSONField(default=list)
+    # packs approved as a whole, besides the packs of the CIs
+    pack_pks = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    status = models.PositiveSmallIntegerField(choices=STATUS_OPTIONS, default=0)
+    error = models.TextField(blank=True)
+
+    @property
+    @admin.display(description='Progress (%)')
+    def progress(self) -> int:
+        if not self.total:
+            return 100
+        return round((self.done / self.total) * 100)
+
+    def __str__(self):
+        return f"Approval of {self.total} CIs ({self.get_status_display()})"
+
+
+class CIStatusCountManager(models.Manager):
+    """Maintain the counters of a CIStatusCount model"""
+
+    def add(self, deltas: Dict[Tuple[Optional[int], int], int]):
+        """Add {(key, status): delta} to the counters, in a statement or two, creating the ones incremented"""
+
+        deltas = {(key, status): delta for (key, status), delta in deltas.items() if key is not None and delta}
+        if not deltas:
+            return
+        key_field = f'{self.model.key_field}_id'
+        # the missing ones created at 0, the existing ones (or those of a concurrent transaction) skipped
+        self.bulk_create(
+            [self.model(**{key_field: key, 'status': status}) for (key, status), delta in deltas.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        self.filter(
+            Q(*(Q(**{key_field: key, 'status': status}) for key, status in deltas), _connector=Q.OR)
+        ).update(count=F('count') + Case(
+            *(When(**{key_field: key, 'status': status}, then=Value(delta)) for (key, status), delta in deltas.items()),
+            default=Value(0),
+        ))
+
+    def totals(self, key: Optional[int] = None) -> Dict[int, int]:
+        """Return {status: count} of a key, or of all keys"""
+
+        qs = self.all()
+        if key is not None:
+            qs = qs.filter(**{f'{self.model.key_field}_id': key})
+        return dict(qs.order_by().values_list('status').annotate(Sum('count')))
+
+    def expected(self, keys: Optional[Iterable[int]] = None) -> Dict[Tuple[int, int], int]:
+        """Count {(key, status): count} from the CI table"""
+
+        key_field = f'{self.model.key_field}_id'
+        qs = CI.objects.exclude(**{key_field: None})
+        if keys is not None:
+            qs = qs.filter(**{f'{key_field}__in': keys})
+        rows = qs.order_by().values_list(key_field, 'status').annotate(Count('pk'))
+        return {(key, status): n for key, status, n in rows}
+
+    def recount(self, keys: Optional[Iterable[int]] = None):
+        """Rebuild the counters of the keys, or of all keys, from the CI table"""
+
+        key_field = f'{self.model.key_field}_id'
+        if keys is not None:
+            keys = [key for key in keys if key is not None]
+        with transaction.atomic(using=self.db):
+            stale = self.all() if keys is None else self.filter(**{f'{key_field}__in': keys})
+            stale.delete()
+            self.bulk_create(
+                self.model(**{key_field: key, 'status': status, 'count': n})
+                for (key, status), n in self.expected(keys).items()
+            )
+
+    def differences(self) -> Dict[Tuple[int, int], Tuple[int, int]]:
+        """Return {(key, status): (stored, expected)} of the counters that are wrong"""
+
+        key_field = f'{self.model.key_field}_id'
+        stored = {
+            (key, status): n
+            for key, status, n in self.exclude(count=0).values_list(key_field, 'status', 'count')
+        }
+        expected = self.expected()
+        return {
+            key: (stored.get(key, 0), expected.get(key, 0))
+            for key in stored.keys() | expected.keys()
+            if stored.get(key, 0) != expected.get(key, 0)
+        }
+
+
+class CIStatusCount(models.Model):
+    """
+    Model representing the number of CIs in a status, by key.
+
+    It is maintained incrementally, so reading it is not a COUNT(*) on the CI table.
+    """
+
+    key_field = None
+
+    status = models.PositiveSmallIntegerField(choices=CI.STATUS_OPTIONS)
+    count = models.IntegerField(default=0)
+
+    objects = CIStatusCountManager()
+
+    class Meta:
+        abstract = True
+
+
+class ClientCIStatusCount(CIStatusCount):
+    """Model representing the number of CIs of a Client in a status"""
+
+    key_field = 'client'
+    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'status'], name='unique_client_status_count')
+        ]
+
+
+class PackCIStatusCount(CIStatusCount):
+    """Model representing the number of CIs of a CIPack in a status"""
+
+    key_field = 'pack'
+    pack = models.ForeignKey(CIPack, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['pack', 'status'], name='unique_pack_status_count')
+        ]
+
+
+def count_cis(groups: Iterable[Tuple[int, Optional[int], int, int]], sign: int = 1):
+    """Add (client, pack, status, number of CIs) groups to the client and pack counters"""
+
+    client_deltas, pack_deltas = Counter(), Counter()
+    for client_id, pack_id, status, n in groups:
+        client_deltas[client_id, status] += sign * n
+        pack_deltas[pack_id, status] += sign * n
+    ClientCIStatusCount.objects.add(client_deltas)
+    PackCIStatusCount.objects.add(pack_deltas)
@@ -0,0 +1,125 @@
+"""
+Paginators for lists of tables too large to be counted on each page.
+"""
+
+import json
+from typing import Optional, Tuple
+
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+# Up to this number of rows, querysets are counted exactly
+EXACT_COUNT_LIMIT = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginate with the planner's estimate of the number of rows.
+
+    An unfiltered queryset is estimated from the table statistics
+    (PostgreSQL's reltuples, SQLite's sqlite_stat1, filled by ANALYZE).
+    A filtered one is counted up to EXACT_COUNT_LIMIT rows, and beyond that
+    estimated by EXPLAIN on PostgreSQL. SQLite has no such estimate,
+    so the pages stop at the limit there.
+    """
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class CounterPaginator(Paginator):
+    """
+    Paginate with a number of objects kept by counters, checked against the page.
+
+    Counters may drift from the table, until they are recounted. So each page
+    is fetched with one more object: a page short of objects, one followed by
+    objects past the last page, or a page past the last one, falls back to a
+    COUNT(*) of the queryset.
+    """
+
+    def __init__(self, object_list, per_page, count: int, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        # shadows the cached property, computed by a COUNT(*) once deleted
+        self.count = max(count, 0)
+
+    def page(self, number):
+        try:
+            number = self.validate_number(number)
+        except EmptyPage:
+            self.recount()
+            return super().page(number)
+        bottom, top = self.bounds(number)
+        objects = list(self.object_list[bottom:top + 1])
+        if len(objects) != min(top + 1, self.count) - bottom:
+            self.recount()
+            number = self.validate_number(number)
+            bottom, top = self.bounds(number)
+            if len(objects) < top - bottom:
+                return super().page(number)
+        return self._get_page(objects[:top - bottom], number, self)
+
+    def bounds(self, number: int) -> Tuple[int, int]:
+        """Return the slice of the objects of a page, as Paginator.page() does"""
+
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return bottom, top
+
+    def recount(self):
+        del self.count
+        self.__dict__.pop('num_pages', None)
+
+
+def estimate_count(queryset: QuerySet, limit: int = EXACT_COUNT_LIMIT) -> int:
+    if not queryset.query.has_filters():
+        estimate = table_estimate(queryset)
+        if estimate is not None and estimate > limit:
+            return estimate
+
+    bounded = queryset.order_by()[:limit + 1].count()
+    if bounded <= limit:
+        return bounded
+    estimate = explain_estimate(queryset) if queryset.query.has_filters() else table_estimate(queryset)
+    return max(estimate or 0, bounded)
+
+
+def table_estimate(queryset: QuerySet) -> Optional[int]:
+    """Return the number of rows of the table from its statistics, if any"""
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', (table,))
+            row = cursor.fetchone()
+            # -1 or 0 until the table is analyzed
+            return row[0] if row and row[0] > 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if not cursor.fetchone():
+                return None
+            # the first number of a stat is the number of rows of the table
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', (table,))
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+def explain_estimate(queryset: QuerySet) -> Optional[int]:
+    """Return the number of rows PostgreSQL's planner expects the queryset to return"""
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,89 @@
+"""
+Encryption and re-encryption of Fernet tokens with the first of the keys, and blind indexes.
+
+Run by the worker processes of the commands rotate_credential_keys and
+seed_scale, so it depends on cryptography alone, not on Django being set up.
+"""
+
+import hashlib
+import hmac
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from cryptography.fernet import Fernet, MultiFernet
+
+Row = Tuple[int, Sequence[Optional[bytes]]]
+
+# the MultiFernet and the blind index key of the worker process, set by init_worker()
+_fernet = None
+_index_key = None
+
+
+def blind_index(key: bytes, value: str) -> str:
+    """The HMAC-SHA256 of a value, in hex, to look it up by equality without decrypting it"""
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()
+
+
+def multi_fernet(fernet_keys: Sequence[bytes]) -> MultiFernet:
+    return MultiFernet([Fernet(key) for key in fernet_keys])
+
+
+def init_worker(fernet_keys: Sequence[bytes], index_key: Optional[bytes] = None):
+    global _fernet, _index_key
+    _fernet = multi_fernet(fernet_keys)
+    _index_key = index_key
+
+
+def rotate_rows(rows: Sequence[Row]) -> List[Tuple[int, Sequence[Optional[bytes]], Optional[str]]]:
+    """
+    Return the rows, a pk and its tokens, with each token re-encrypted with
+    the first key, and the blind index of the username, if there is a key.
+
+    The username is the first token, or the 'username' of the record, the last one.
+    """
+
+    return [
+        (pk, tuple(None if token is None else _fernet.rotate(token) for token in tokens), _username_index(tokens))
+        for pk, tokens in rows
+    ]
+
+
+def _username_index(tokens) -> Optional[str]:
+    if _index_key is None:
+        return None
+    if tokens[0] is not None:
+        username = _fernet.decrypt(tokens[0]).decode()
+    elif tokens[-1] is not None:
+        username = json.loads(_fernet.decrypt(tokens[-1]))['username']
+    else:
+        username = None
+    return None if username is None else blind_index(_index_key, username)
+
+
+def encrypt_rows(rows: Sequence[Tuple[int, Dict[str, Optional[str]]]], record: bool = False) \
+        -> List[Tuple[int, Dict[str, Optional[bytes]], Optional[str]]]:
+    """
+    Return the rows, a pk and its plaintext values, with the values encrypted
+    with the first key, or with a 'record' token of them all, and the blind
+    index of the username, if there is a key. The tokens are those the
+    Credential fields would save.
+    """
+
+    return [(pk, _encrypt(values, record), _plaintext_index(values['username'])) for pk, values in rows]
+
+
+def _encrypt(values, record):
+    if record:
+        return {'record': _fernet.encrypt(json.dumps(values, separators=(',', ':')).encode())}
+    return {name: None if value is None else _fernet.encrypt(value.encode()) for name, value in values.items()}
+
+
+def _plaintext_index(username) -> Optional[str]:
+    if _index_key is None or username is None:
+        return None
+    return blind_index(_index_key, username)
+
+
+def split(rows, parts):
+    size = -(-len(rows) // parts)
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
@@ -0,0 +1,211 @@
+"""
+Indexed substring search over CIs and appliances.
+
+PostgreSQL gets trigram GIN indexes built on the very expressions that
+``icontains`` produces, so the lookups stay plain Django lookups.
+SQLite gets an FTS5 shadow table (trigram tokenizer) per model, kept in sync
+by triggers, which covers save(), bulk_create() and update() alike.
+Any other backend, or a term shorter than a trigram, falls back to ``icontains``.
+
+A CI term written as a network, e.g. 10.20.0.0/16, is a range scan on CI.ip_key.
+"""
+
+import ipaddress
+import logging
+import sqlite3
+
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+
+logger = logging.getLogger(__name__)
+
+# Trigrams can't match anything shorter than this
+MIN_TERM_LENGTH = 3
+
+SEARCH_FIELDS = {
+    'cis.ci': ('hostname', 'ip', 'description'),
+    'cis.appliance': ('serial_number', 'model'),
+}
+
+# FTS5 got the trigram tokenizer in SQLite 3.34.0
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+_fts_tables_found = set()
+
+
+def search(queryset: QuerySet, term: str) -> QuerySet:
+    """Filter the queryset by a substring of any of its model's search fields"""
+
+    term = term.strip()
+    if hasattr(queryset, 'in_network') and (network := _parse_network(term)):
+        return queryset.in_network(network)
+
+    model = queryset.model
+    connection = connections[queryset.db]
+    if len(term) >= MIN_TERM_LENGTH and _has_fts_table(connection, model):
+        table = connection.ops.quote_name(fts_table(model))
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+            (_fts_phrase(term),),
+        ))
+
+    return icontains_search(queryset, term)
+
+
+def icontains_search(queryset: QuerySet, term: str) -> QuerySet:
+    """The unindexed path of search(), also the baseline of the benchmark"""
+
+    query = Q()
+    for field in SEARCH_FIELDS[queryset.model._meta.label_lower]:
+        query |= Q(**{f'{field}__icontains': term.strip()})
+    return queryset.filter(query)
+
+
+def fts_table(model) -> str:
+    return f'{model._meta.db_table}_fts'
+
+
+def create_index(model, schema_editor):
+    """Create the search index of the model. Used by migrations."""
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, expression in _trigram_expressions(model, schema_editor):
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} '
+                f'ON {schema_editor.quote_name(model._meta.db_table)} '
+                f'USING gin (({expression}) gin_trgm_ops)'
+            )
+    elif vendor == 'sqlite':
+        if not SQLITE_HAS_TRIGRAM:
+            logger.warning('SQLite %s has no FTS5 trigram tokenizer. '
+                           'The search will fall back to icontains.', sqlite3.sqlite_version)
+            return
+        columns = ', '.join(_columns(model))
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table(model)} USING fts5('
+            f"{columns}, content='{model._meta.db_table}', "
+            f"content_rowid='{model._meta.pk.column}', tokenize='trigram')"
+        )
+        ensure_triggers(model, schema_editor.connection)
+
+
+def drop_index(model, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for name, _ in _trigram_expressions(model, schema_editor):
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+    elif vendor == 'sqlite':
+        for trigger in _trigger_names(model):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {fts_table(model)}')
+    _fts_tables_found.discard((schema_editor.connection.alias, fts_table(model)))
+
+
+def ensure_triggers(model, connection):
+    """
+    (Re)create the triggers that keep the FTS5 table in sync.
+
+    SQLite migrations rebuild a table to alter it, which drops its triggers,
+    so this also runs on post_migrate. The index is rebuilt whenever
+    a trigger was missing, as rows may have changed in the meantime.
+    """
+
+    table = model._meta.db_table
+    fts = fts_table(model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", (fts,))
+        if not cursor.fetchone():
+            return
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", (table,))
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing.issuperset(_trigger_names(model)):
+            return
+
+        pk = model._meta.pk.column
+        columns = _columns(model)
+        names = ', '.join(columns)
+        new = ', '.join(f'new.{column}' for column in columns)
+        old = ', '.join(f'old.{column}' for column in columns)
+        insert, delete, update = _trigger_names(model)
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {insert} AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {delete} AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); END"
+        )
+        cursor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {update} AFTER UPDATE OF {names} ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{pk}, {old}); "
+            f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new}); END'
+        )
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def ensure_search_triggers(sender, using, apps=None, **kwargs):
+    """post_migrate receiver. See ensure_triggers()."""
+
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or apps is None:
+        return
+    for label in SEARCH_FIELDS:
+        try:
+            model = apps.get_model(label)
+        except LookupError:
+            continue
+        ensure_triggers(model, connection)
+
+
+def _has_fts_table(connection, model) -> bool:
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, fts_table(model))
+    if key not in _fts_tables_found:
+        if fts_table(model) not in connection.introspection.table_names():
+            return False
+        _fts_tables_found.add(key)
+    return True
+
+
+def _parse_network(term: str):
+    if '/' not in term:
+        return None
+    try:
+        return ipaddress.ip_network(term, strict=False)
+    except ValueError:
+        return None
+
+
+def _fts_phrase(term: str) -> str:
+    """Quote the term as a FTS5 phrase, so it's taken literally"""
+
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def _columns(model):
+    return [model._meta.get_field(name).column for name in SEARCH_FIELDS[model._meta.label_lower]]
+
+
+def _trigger_names(model):
+    fts = fts_table(model)
+    return f'{fts}_ai', f'{fts}_ad', f'{fts}_au'
+
+
+def _trigram_expressions(model, schema_editor):
+    """Yield (index name, expression) matching the SQL of `icontains` on PostgreSQL"""
+
+    table = model._meta.db_table
+    for name in SEARCH_FIELDS[model._meta.label_lower]:
+        field = model._meta.get_field(name)
+        column = schema_editor.quote_name(field.column)
+        if field.get_internal_type() in ('IPAddressField', 'GenericIPAddressField'):
+            expression = f'UPPER(HOST({column}))'
+        else:
+            expression = f'UPPER({column}::text)'
+        yield f'{table}_{field.column}_trgm', expression
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import CI, Client, Place, count_cis
+
+
+@receiver(post_save, sender=CI)
+def count_saved_ci(sender, instance, created, **kwargs):
+    """Keep the status counters on create, and on saves that change their key"""
+
+    key = instance.counter_key
+    if created:
+        count_cis([(*key, 1)])
+    elif instance.counted_key is not None and instance.counted_key != key:
+        count_cis([(*instance.counted_key, -1), (*key, 1)])
+    instance.counted_key = key
+
+
+# CI.delete() and CIQuerySet.delete() uncount the CIs they delete, not the cascades
+@receiver(pre_delete, sender=Place)
+@receiver(pre_delete, sender=Client)
+def uncount_cascaded_cis(sender, instance, **kwargs):
+    field = 'place' if sender is Place else 'client'
+    count_cis(CI.objects.filter(**{field: instance}).counter_groups(), -1)
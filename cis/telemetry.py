@@ -0,0 +1,123 @@
+"""
+Sampled per-request telemetry, as JSON lines.
+
+For a share of the requests, the setting CIS_TELEMETRY_SAMPLE_RATE,
+TelemetryMiddleware writes a line to the file CIS_TELEMETRY_FILE, rotated
+at CIS_TELEMETRY_MAX_BYTES: the view, the latency, the number and time of
+the queries, the template rendering time and the size of the response.
+The templates are timed by the TimedDjangoTemplates backend, their time
+including the queries they run.
+
+An unsampled request costs a random number. Without a rate, the middleware
+isn't loaded at all.
+"""
+
+import json
+import logging
+import random
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.utils import timezone
+
+from .middleware import HybridMiddleware, unwatch_queries, watch_queries
+
+# the telemetry of the sampled request being served
+_current = ContextVar('telemetry', default=None)
+
+
+class RequestTelemetry:
+    """A database execute wrapper counting and timing the queries, also timing the templates"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - start
+
+
+class TelemetryMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        self.sample_rate = getattr(settings, 'CIS_TELEMETRY_SAMPLE_RATE', 0)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.handler = RotatingFileHandler(
+            settings.CIS_TELEMETRY_FILE,
+            maxBytes=settings.CIS_TELEMETRY_MAX_BYTES,
+            backupCount=settings.CIS_TELEMETRY_BACKUP_COUNT,
+            delay=True,
+        )
+
+    def before(self, request):
+        if random.random() >= self.sample_rate:
+            return None
+        telemetry = RequestTelemetry()
+        return telemetry, _current.set(telemetry), watch_queries(telemetry), perf_counter()
+
+    def finish(self, state):
+        if state is not None:
+            unwatch_queries(state[2])
+            _current.reset(state[1])
+
+    def after(self, request, response, state):
+        if state is None:
+            return response
+        telemetry, _, _, start = state
+        duration = perf_counter() - start
+
+        match = request.resolver_match
+        self.write({
+            'time': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': telemetry.queries,
+            'db_ms': round(telemetry.db_time * 1000, 2),
+            'render_ms': round(telemetry.render_time * 1000, 2),
+            # unknown until a streamed response is consumed
+            'size': None if response.streaming else len(response.content),
+        })
+        return response
+
+    def write(self, entry: dict):
+        self.handler.handle(logging.makeLogRecord({'msg': json.dumps(entry)}))
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        telemetry = _current.get()
+        if telemetry is None:
+            return super().render(context, request)
+        start = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            telemetry.render_time += perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing the rendering of the sampled requests"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
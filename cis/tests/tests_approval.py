@@ -0,0 +1,108 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from .. import approval
+from ..models import CI, CIPack, ApprovalJob
+
+
+@override_settings(CIS_APPROVAL_CHUNK_SIZE=2, CIS_APPROVAL_BACKGROUND_THRESHOLD=3)
+class ApprovalTest(TestCase):
+    fixtures = ['all.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.get(username='admin')
+        cls.pack = CIPack.objects.get(pk=1)
+
+    def add_cis(self, n):
+        ci = CI.objects.get(pk=1)
+        for i in range(n):
+            ci.pk = None
+            ci.hostname = f'NEW{i}'
+            ci.save()
+
+    def test_approve_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(approval.approve([1, 2, 3], self.admin))
+        ci_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "cis_ci"')]
+        self.assertEqual(len(ci_updates), 2)
+        self.assertEqual(CI.objects.filter(status=2).count(), 3)
+        self.pack.refresh_from_db()
+        self.assertEqual(self.pack.approved_by, self.admin)
+
+    def test_large_approval_runs_in_background(self):
+        self.add_cis(2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = approval.approve(CI.objects.values_list('pk', flat=True), self.admin)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual((job.status, job.total, job.done), (0, 5, 0))
+        self.assertFalse(CI.objects.filter(status=2).exists())
+
+        approval.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.progress), (2, 5, 100))
+        self.assertEqual(CI.objects.filter(status=2).count(), 5)
+        self.pack.refresh_from_db()
+        self.assertEqual(self.pack.approved_by, self.admin)
+
+    def test_job_resumes_after_the_chunks_done(self):
+        job = ApprovalJob.objects.create(requested_by=self.admin, ci_pks=[1, 2, 3], total=3, done=2, status=3)
+        approval.run(job.pk)
+        self.assertEqual(list(CI.objects.filter(status=2).values_list('pk', flat=True)), [3])
+
+    def test_large_pack_approval_reads_the_cis_by_chunks(self):
+        self.add_cis(2)
+        with self.captureOnCommitCallbacks():
+            job = approval.approve_packs([self.pack.pk], self.admin)
+        self.assertEqual((job.ci_pks, job.total), ([], 5))
+
+        with CaptureQueriesContext(connection) as queries:
+            approval.run(job.pk)
+        pk_reads = [q for q in queries.captured_queries if q['sql'].startswith('SELECT "cis_ci"."id" FROM')]
+        self.assertEqual(len(pk_reads), 4)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done), (2, 5))
+        self.assertFalse(CI.objects.filter(pack=self.pack).exclude(status=2).exists())
+
+    def test_job_is_not_run_twice(self):
+        job = ApprovalJob.objects.create(requested_by=self.admin, ci_pks=[1, 2, 3], total=3, status=1)
+        approval.run(job.pk)
+        self.assertFalse(CI.objects.filter(status=2).exists())
+
+    def test_stale_jobs_are_resumed(self):
+        running = ApprovalJob.objects.create(requested_by=self.admin, ci_pks=[1, 2], total=2, status=1)
+        ApprovalJob.objects.create(requested_by=self.admin, ci_pks=[3], total=1, status=0)
+        self.assertFalse(approval.stale_jobs().exists())
+
+        ApprovalJob.objects.filter(pk=running.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        call_command('resume_approval_jobs', stdout=StringIO())
+        running.refresh_from_db()
+        self.assertEqual((running.status, running.done), (2, 2))
+        self.assertEqual(list(CI.objects.filter(status=2).values_list('pk', flat=True)), [1, 2])
+
+    def test_cipack_admin_action_records_approver(self):
+        self.client.force_login(self.admin)
+        data = {'action': 'approve_all_cis', '_selected_action': [self.pack.pk]}
+        response = self.client.post(reverse('admin:cis_cipack_changelist'), data, follow=True)
+        self.assertContains(response, 'The selected CI pack was approved successfully.')
+        self.pack.refresh_from_db()
+        self.assertEqual(self.pack.approved_by, self.admin)
+        self.assertEqual(self.pack.percentage_of_cis_approved, 100)
+
+    def test_ci_admin_action_shows_background_job(self):
+        self.add_cis(1)
+        self.client.force_login(self.admin)
+        data = {'action': 'approve_selected_cis', '_selected_action': CI.objects.values_list('pk', flat=True)}
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(reverse('admin:cis_ci_changelist'), data, follow=True)
+        job = ApprovalJob.objects.get()
+        self.assertContains(response, 'The approval of 4 CIs is running in background.')
+        self.assertContains(response, reverse('admin:cis_approvaljob_change', args=(job.pk,)))
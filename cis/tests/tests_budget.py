@@ -0,0 +1,55 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+
+from accounts.models import User
+from .. import async_views, urls
+from ..budget import QueryBudgetExceeded
+from ..views import CIListView
+
+
+class QueryBudgetTest(TestCase):
+    fixtures = ['all.json']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(pk=1))
+        self.async_client.force_login(User.objects.get(pk=1))
+
+    def test_every_view_declares_a_budget(self):
+        for pattern in urls.urlpatterns:
+            view = pattern.callback
+            with self.subTest(pattern.name):
+                self.assertTrue(hasattr(view, 'query_budget') or hasattr(view.view_class, 'query_budget'))
+
+    def test_every_changelist_declares_a_budget(self):
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label in ('cis', 'accounts'):
+                with self.subTest(model.__name__):
+                    self.assertIsInstance(model_admin.changelist_query_budget, int)
+
+    def test_request_over_budget_raises(self):
+        url = reverse('cis:ci_list', args=(0,))
+        with mock.patch.object(CIListView, 'query_budget', 2):
+            with self.assertRaisesRegex(QueryBudgetExceeded, 'ran 5 queries, over its budget of 2'):
+                self.client.get(url)
+
+            with override_settings(CIS_QUERY_BUDGET='log'), self.assertLogs('cis.budget', 'ERROR'):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+            with override_settings(CIS_QUERY_BUDGET=''):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    async def test_async_request_over_budget_raises(self):
+        # the queries run in the threads of sync_to_async, on their own connections
+        url = reverse('cis:ci_list_async', args=(0,))
+        with mock.patch.object(async_views.ci_list, 'query_budget', 2):
+            with self.assertRaisesRegex(QueryBudgetExceeded, 'over its budget of 2'):
+                await self.async_client.get(url)
+
+    def test_update_views_are_limited_to_the_client(self):
+        self.client.force_login(User.objects.get(pk=2))
+        for name in ('cis:place_update', 'cis:appliance_update'):
+            with self.subTest(name):
+                self.assertEqual(self.client.get(reverse(name, args=(1,))).status_code, 404)
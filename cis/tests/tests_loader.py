@@ -6,6 +6,7 @@ from django.test import TestCase
 from accounts.models import User
 from ..models import Client, Place, Contract, Manufacturer
 from ..loader import CILoader
+from ..metrics import IMPORTED_ROWS
 from ..cis_mapping import CIS_SHEET, \
     APPLIANCES_SHEET
 
@@ -56,12 +57,14 @@ class CILoaderTest(TestCase):
 
     def test_errors_contain_duplicated_items(self):
         create_workbook()
+        failed = IMPORTED_ROWS.values.get(IMPORTED_ROWS.key({'result': 'failed'}), 0)
         loader = CILoader(SPREADSHEET_FILE, self.company_client).save()
         self.assertEqual(len(loader.errors), 5)
         self.assertEqual(len(loader.cis), 0)
         self.assertTrue(
             'unique constraint' in str(loader.errors[0].exc).lower()
         )
+        self.assertEqual(IMPORTED_ROWS.values[IMPORTED_ROWS.key({'result': 'failed'})], failed + 5)
 
 
 def create_workbook():
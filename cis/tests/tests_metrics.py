@@ -0,0 +1,108 @@
+import json
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+
+from accounts.models import User
+from .. import approval
+from ..metrics import Registry, Counter, Histogram, REQUEST_DURATION, APPROVAL_BATCH_SIZE
+
+
+def count(histogram, **labels):
+    """The observations of a histogram, in this process"""
+    return sum(histogram.values.get(histogram.key(labels), [0])[:-1])
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = Counter('test_rows_total', 'Rows.', ('result',), registry=self.registry)
+        self.histogram = Histogram('test_seconds', 'Seconds.', buckets=(1, 5), registry=self.registry)
+
+    def test_exposition(self):
+        self.counter.inc(3, result='imported')
+        self.counter.inc(result='failed "twice"')
+        self.histogram.observe(.5)
+        self.histogram.observe(2)
+        self.histogram.observe(7)
+
+        self.assertEqual(self.registry.expose(), '\n'.join([
+            '# HELP test_rows_total Rows.',
+            '# TYPE test_rows_total counter',
+            'test_rows_total{result="failed \\"twice\\""} 1',
+            'test_rows_total{result="imported"} 3',
+            '# HELP test_seconds Seconds.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="1"} 1',
+            'test_seconds_bucket{le="5"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 9.5',
+            'test_seconds_count 3',
+        ]) + '\n')
+
+    def test_processes_are_added_up(self):
+        with TemporaryDirectory() as directory, override_settings(CIS_METRICS_DIR=directory):
+            # another worker
+            Path(directory, 'metrics-1-1.json').write_text(json.dumps({
+                'test_rows_total': {'["imported"]': 2},
+                'test_seconds': {'[]': [0, 1, 0, 3.0]},
+            }))
+            self.counter.inc(3, result='imported')
+            self.histogram.observe(.5)
+            self.registry.flush(directory)
+            self.assertTrue(Path(directory, f'metrics-{os.getpid()}-{self.registry.started}.json').exists())
+
+            exposition = self.registry.expose()
+        self.assertIn('test_rows_total{result="imported"} 5', exposition)
+        self.assertIn('test_seconds_bucket{le="5"} 2', exposition)
+        self.assertIn('test_seconds_sum 3.5', exposition)
+
+    def test_forked_process_starts_from_zero(self):
+        self.counter.inc(3, result='imported')
+        self.histogram.observe(.5)
+        started = self.registry.started
+        self.registry.forked()
+        self.assertNotEqual(self.registry.started, started)
+        self.assertEqual(self.registry.snapshot(), {'test_rows_total': {}, 'test_seconds': {}})
+
+    def test_last_updates_are_saved_once_idle(self):
+        with TemporaryDirectory() as directory, override_settings(
+            CIS_METRICS_DIR=directory, CIS_METRICS_FLUSH_INTERVAL=.05,
+        ):
+            self.registry.flush(directory)
+            self.counter.inc(result='imported')
+            pending_flush = self.registry.pending_flush
+            pending_flush.join()
+            path = Path(directory, self.registry.file_name)
+            self.assertEqual(json.loads(path.read_text())['test_rows_total'], {'["imported"]': 1})
+            self.assertEqual(list(Path(directory).glob('*.tmp')), [])
+
+
+class MetricsViewTest(TestCase):
+    fixtures = ['all.json']
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.get(pk=1))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+        self.client.force_login(User.objects.get(pk=3))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# TYPE cis_import_rows_total counter', response.content.decode())
+
+    def test_requests_are_observed_by_view(self):
+        self.client.force_login(User.objects.get(pk=1))
+        before = count(REQUEST_DURATION, view='cis:ci_list')
+        self.client.get(reverse('cis:ci_list', args=(0,)))
+        self.assertEqual(count(REQUEST_DURATION, view='cis:ci_list'), before + 1)
+
+    @override_settings(CIS_APPROVAL_CHUNK_SIZE=2)
+    def test_approval_batches_are_observed(self):
+        before = count(APPROVAL_BATCH_SIZE)
+        approval.approve([1, 2, 3], User.objects.get(pk=3))
+        self.assertEqual(count(APPROVAL_BATCH_SIZE), before + 2)
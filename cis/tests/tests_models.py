@@ -1,9 +1,24 @@
+from io import StringIO
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.db.models import F
 from django.shortcuts import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.db.utils import IntegrityError
+from fernet_fields.hkdf import derive_fernet_key
 
 from accounts.models import User
-from ..models import Client, Place, Manufacturer, Contract, Appliance, CI, CIPack
+from ..fields import LazyPlaintext
+from ..forms import CIForm
+from ..models import (
+    Client, Place, Manufacturer, Contract, Appliance, CI, CIPack, Credential, ip_to_key, username_index,
+    ClientCIStatusCount, PackCIStatusCount,
+)
 
 CLIENT_NAME = 'Client A'
 PLACE_NAME = 'Main'
@@ -101,10 +116,60 @@ class CITest(FixtureMixin, TestCase):
             f'{CLIENT_NAME} | {PLACE_NAME} | {ci.hostname} | {ci.ip}'
         )
 
+    def test_listing_cis_reads_only_the_ci_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(CI.objects.all())
+            CI.objects.count()
+        self.assertFalse(any('cis_credential' in q['sql'] for q in queries.captured_queries))
+
+    def test_credential_is_loaded_on_demand(self):
+        ci = CI.objects.get(pk=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(ci.credential.password, 'admin1')
+        ci.delete()
+        self.assertFalse(Credential.objects.filter(ci=1).exists())
+
+    def test_form_saves_the_credential(self):
+        ci = CI.objects.get(pk=1)
+        data = {
+            'place': ci.place_id, 'appliances': [1], 'hostname': 'NEW', 'ip': '10.0.0.1',
+            'description': 'New', 'business_impact': 0, 'contract': ci.contract_id,
+            'username': 'user', 'password': 'secret', 'enable_password': 'enable',
+        }
+        form = CIForm(data, client=ci.client)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.instance.client = ci.client
+        new = form.save()
+        self.assertEqual(Credential.objects.get(ci=new).password, 'secret')
+
+    def test_credential_is_decrypted_on_first_use(self):
+        credential = Credential.objects.get(ci=1)
+        password = credential.password
+        self.assertIsInstance(password, LazyPlaintext)
+        self.assertFalse(password.is_decrypted)
+        self.assertEqual(password, 'admin1')
+        self.assertTrue(password.is_decrypted)
+        self.assertFalse(credential.username.is_decrypted)
+
+    def test_untouched_credential_is_saved_as_its_ciphertext(self):
+        def ciphertexts():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT username, password FROM cis_credential WHERE ci_id = 1')
+                return [bytes(value) for value in cursor.fetchone()]
+
+        before = ciphertexts()
+        credential = Credential.objects.get(ci=1)
+        str(credential.username)
+        credential.save()
+        after = ciphertexts()
+        # a decrypted value is encrypted again, with a new token
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[1], before[1])
+        self.assertEqual(Credential.objects.get(ci=1).username, 'admin1')
+
     def test_unique_constraint_raises_exception(self):
         ci = CI.objects.get(pk=1)
         ci.pk = None
-        ci.credential_id = None
         with self.assertRaises(IntegrityError):
             ci.save()
 
@@ -112,11 +177,39 @@ class CITest(FixtureMixin, TestCase):
         new_client = Client.objects.create(name='Different Client')
         ci = CI.objects.get(pk=1)
         ci.pk = None
-        ci.credential_id = None
         ci.client = new_client
         ci.save()
         self.assertIsNotNone(ci.pk)
 
+    def test_ip_key_follows_the_numeric_order_of_addresses(self):
+        addresses = ['9.255.255.255', '10.0.0.2', '10.0.0.10', '::ffff:10.0.0.11', '2001:db8::1']
+        self.assertEqual(sorted(addresses, key=ip_to_key), addresses)
+        self.assertEqual(ip_to_key('10.0.0.11'), ip_to_key('::ffff:10.0.0.11'))
+
+    def test_ip_key_is_kept_on_save_update_and_bulk_update(self):
+        ci = CI.objects.get(pk=1)
+        ci.ip = '192.168.0.1'
+        ci.save(update_fields=['ip'])
+        self.assertEqual(CI.objects.get(pk=1).ip_key, ip_to_key('192.168.0.1'))
+
+        CI.objects.filter(pk=1).update(ip='192.168.0.2')
+        self.assertEqual(CI.objects.get(pk=1).ip_key, ip_to_key('192.168.0.2'))
+
+        ci.ip = '2001:db8::1'
+        CI.objects.bulk_update([ci], ['ip'])
+        self.assertEqual(CI.objects.get(pk=1).ip_key, ip_to_key('2001:db8::1'))
+
+        # ip_key can't follow an address computed by the database
+        with self.assertRaises(ValueError):
+            CI.objects.filter(pk=1).update(ip=F('description'))
+
+    def test_in_network(self):
+        # 10.10.20.20, 10.10.100.2 and 10.10.100.3
+        self.assertEqual(CI.objects.in_network('10.10.0.0/16').count(), 3)
+        self.assertEqual(CI.objects.in_network('10.10.100.0/24').count(), 2)
+        self.assertEqual(CI.objects.in_network('10.10.100.3/32').get().pk, 3)
+        self.assertFalse(CI.objects.in_network('2001:db8::/32').exists())
+
     def test_absolute_url_returns_correct_url(self):
         ci = CI.objects.get(pk=1)
         self.assertEqual(
@@ -125,6 +218,124 @@ class CITest(FixtureMixin, TestCase):
         )
 
 
+@override_settings(CIS_CREDENTIAL_RECORDS=True)
+class CredentialRecordTest(FixtureMixin, TestCase):
+
+    def stored(self, ci):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT password, record FROM cis_credential WHERE ci_id = %s', (ci,))
+            return [None if value is None else bytes(value) for value in cursor.fetchone()]
+
+    def test_values_are_saved_as_a_record(self):
+        credential = Credential.objects.get(ci=1)
+        credential.password = 'new'
+        credential.save()
+        self.assertEqual(credential.password, 'new')
+        password, record = self.stored(1)
+        self.assertIsNone(password)
+        self.assertIsNotNone(record)
+
+        credential = Credential.objects.get(ci=1)
+        self.assertEqual(
+            [getattr(credential, name) for name in Credential.FIELDS],
+            ['admin1', 'new', 'enable1', None],
+        )
+
+    def test_untouched_record_is_saved_as_its_ciphertext(self):
+        Credential.objects.get(ci=1).save()
+        record = self.stored(1)[1]
+        Credential.objects.get(ci=1).save(update_fields=['password'])
+        self.assertEqual(self.stored(1)[1], record)
+
+    def test_convert_credentials(self):
+        call_command('convert_credentials', batch_size=2, stdout=StringIO())
+        self.assertFalse(Credential.objects.filter(record__isnull=True).exists())
+        self.assertEqual(Credential.objects.get(ci=3).enable_password, 'enable3')
+
+        with self.settings(CIS_CREDENTIAL_RECORDS=False):
+            out = StringIO()
+            call_command('convert_credentials', stdout=out)
+            self.assertIn('3 credentials were converted to separate values.', out.getvalue())
+        self.assertFalse(Credential.objects.filter(record__isnull=False).exists())
+        self.assertEqual(self.stored(2)[1], None)
+        self.assertEqual(Credential.objects.get(ci=2).password, 'admin2')
+
+
+@override_settings(CIS_BLIND_INDEX_KEY='index key')
+class CredentialUsernameIndexTest(FixtureMixin, TestCase):
+
+    def test_index_is_kept_on_save(self):
+        credential = Credential.objects.get(ci=1)
+        credential.username = 'netops'
+        credential.save()
+        self.assertEqual(Credential.objects.get(ci=1).username_index, username_index('netops'))
+
+        with self.settings(CIS_CREDENTIAL_RECORDS=True):
+            credential.username = 'netops2'
+            credential.save(update_fields=['username'])
+        self.assertEqual(Credential.objects.get(ci=1).username_index, username_index('netops2'))
+
+    def test_cis_are_looked_up_by_username_through_the_index(self):
+        for ci in (1, 3):
+            Credential.objects.filter(ci=ci).update(username_index=username_index('netops'))
+        with CaptureQueriesContext(connection) as queries:
+            cis = list(CI.objects.with_credential_username('netops').values_list('pk', flat=True))
+        self.assertEqual(sorted(cis), [1, 3])
+        self.assertIn('"username_index" =', queries.captured_queries[0]['sql'])
+
+        with self.settings(CIS_BLIND_INDEX_KEY=''), self.assertRaises(ImproperlyConfigured):
+            CI.objects.with_credential_username('netops')
+
+    def test_index_is_computed_by_key_rotation_and_conversion(self):
+        with self.settings(CIS_CREDENTIAL_RECORDS=True):
+            Credential.objects.get(ci=3).save()
+        Credential.objects.update(username_index=None)
+        call_command('rotate_credential_keys', workers=1, stdout=StringIO())
+        self.assertEqual(
+            list(Credential.objects.order_by('ci').values_list('username_index', flat=True)),
+            [username_index(f'admin{n}') for n in (1, 2, 3)],
+        )
+
+        Credential.objects.update(username_index=None)
+        call_command('convert_credentials', stdout=StringIO())
+        self.assertEqual(Credential.objects.get(ci=3).username_index, username_index('admin3'))
+
+
+class RotateCredentialKeysTest(FixtureMixin, TestCase):
+
+    def stored(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT password, record FROM cis_credential ORDER BY ci_id')
+            return [[None if value is None else bytes(value) for value in row] for row in cursor.fetchall()]
+
+    def rotate(self, **options):
+        with self.settings(FERNET_KEYS=['new key', settings.SECRET_KEY]):
+            out = StringIO()
+            call_command('rotate_credential_keys', chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_credentials_are_re_encrypted_with_the_first_key(self):
+        with self.settings(CIS_CREDENTIAL_RECORDS=True):
+            Credential.objects.get(ci=3).save()
+        out = self.rotate(workers=2)
+        self.assertIn('2 credentials re-encrypted, up to pk 2', out)
+        self.assertIn('3 credentials were re-encrypted', out)
+
+        new_key = Fernet(derive_fernet_key('new key'))
+        (password1, _), (password2, _), (password3, record3) = self.stored()
+        self.assertEqual(new_key.decrypt(password1), b'admin1')
+        self.assertEqual(new_key.decrypt(password2), b'admin2')
+        self.assertIsNone(password3)
+        self.assertIn(b'"enable_password":"enable3"', new_key.decrypt(record3))
+
+    def test_resume_after_a_pk(self):
+        before = self.stored()
+        self.assertIn('1 credentials were re-encrypted', self.rotate(workers=1, start_after=2))
+        after = self.stored()
+        self.assertEqual(after[:2], before[:2])
+        self.assertNotEqual(after[2], before[2])
+
+
 class CIPackTest(FixtureMixin, TestCase):
 
     @classmethod
@@ -156,6 +367,14 @@ class CIPackTest(FixtureMixin, TestCase):
         self.pack.ci_set.filter(pk__in=(1, 2, 3)).update(status=2)
         self.assertEqual(self.pack.percentage_of_cis_approved, 100)
 
+    def test_percentage_of_cis_approved_uses_annotations(self):
+        self.pack.ci_set.filter(pk__in=(1,)).update(status=2)
+        empty_pack = CIPack.objects.create(responsible=self.user)
+        packs = CIPack.objects.with_approval_counts().order_by('pk')
+        with self.assertNumQueries(1):
+            percentages = [(pack, pack.percentage_of_cis_approved) for pack in packs]
+        self.assertEqual(percentages, [(self.pack, 33), (empty_pack, 0)])
+
     def test_approved_by_returns_the_right_superuser(self):
         self.pack.approved_by = self.admin
         self.pack.save()
@@ -168,5 +387,136 @@ class CIPackTest(FixtureMixin, TestCase):
         for ci in self.pack.ci_set.all():
             self.assertEqual(ci.status, 1)
 
+    def test_pack_outlives_its_client(self):
+        client = Client.objects.create(name='Gone')
+        pack = CIPack.objects.create(responsible=self.user, client=client)
+        client.delete()
+        pack.refresh_from_db()
+        self.assertIsNone(pack.client)
+
     def test_len_returns_count_of_ci_set(self):
         self.assertEqual(len(self.pack), 3)
+
+
+class ClientScopedQuerySetTest(FixtureMixin, TestCase):
+
+    def test_for_client_filters_on_the_client_id_column(self):
+        client = Client.objects.get(pk=1)
+        for model in (CI, Appliance, Place, CIPack):
+            qs = model.objects.for_client(client)
+            self.assertEqual(list(qs), list(model.objects.for_client(1)))
+            self.assertEqual(list(qs), list(model.objects.filter(client=client)))
+            self.assertIn(f'WHERE "{model._meta.db_table}"."client_id" = 1', str(qs.query))
+        self.assertFalse(CI.objects.for_client(2).exists())
+
+    def test_for_user(self):
+        self.assertEqual(CI.objects.for_user(User.objects.get(pk=1)).count(), 3)
+        self.assertEqual(CI.objects.for_user(User.objects.get(pk=2)).count(), 0)
+        self.assertEqual(CI.objects.for_user(User.objects.get(pk=3)).count(), 3)
+
+        # no client is not the rows without a client
+        CIPack.objects.create(responsible=User.objects.get(pk=3))
+        user = User.objects.get(pk=1)
+        user.client = None
+        self.assertEqual(CIPack.objects.for_user(user).count(), 0)
+
+
+class CIStatusCountTest(FixtureMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_a = Client.objects.get(pk=1)
+        cls.user = User.objects.get(pk=1)
+
+    def assertCounts(self, client_totals, pack_totals=None, pack=None):
+        self.assertEqual(ClientCIStatusCount.objects.totals(self.client_a.pk), client_totals)
+        if pack is not None:
+            self.assertEqual(PackCIStatusCount.objects.totals(pack.pk), pack_totals)
+        self.assertFalse(ClientCIStatusCount.objects.differences())
+        self.assertFalse(PackCIStatusCount.objects.differences())
+
+    def test_fixture_cis_are_counted(self):
+        self.assertCounts({0: 3}, {0: 3}, CIPack.objects.get(pk=1))
+
+    def test_send_to_production_and_approve_all_cis(self):
+        pack = CIPack.objects.create(responsible=self.user)
+        self.assertEqual(pack.send_to_production((1, 2)), 2)
+        self.assertCounts({0: 1, 1: 2}, {1: 2}, pack)
+
+        pack.approve_all_cis()
+        self.assertCounts({0: 1, 1: 0, 2: 2}, {1: 0, 2: 2}, pack)
+
+    def test_create_change_and_delete(self):
+        ci = CI.objects.get(pk=1)
+        ci.pk = None
+        ci.hostname = 'NEW'
+        ci.save()
+        self.assertCounts({0: 4})
+
+        ci = CI.objects.get(pk=ci.pk)
+        ci.status = 2
+        ci.save()
+        self.assertCounts({0: 3, 2: 1})
+
+        ci.delete()
+        self.assertCounts({0: 3, 2: 0})
+
+    def test_queryset_and_cascaded_deletes(self):
+        CI.objects.filter(pk=1).delete()
+        self.assertCounts({0: 2}, {0: 2}, CIPack.objects.get(pk=1))
+
+        Place.objects.get(pk=1).delete()
+        self.assertCounts({0: 0}, {0: 0}, CIPack.objects.get(pk=1))
+
+    def test_update_with_expression_recounts(self):
+        CI.objects.filter(pk=1).update(status=F('status') + 1)
+        self.assertCounts({0: 2, 1: 1})
+
+    def test_recount_fixes_wrong_counters(self):
+        ClientCIStatusCount.objects.update(count=10)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ci_counters', verify=True, stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_ci_counters', stdout=StringIO())
+        self.assertCounts({0: 3})
+
+
+class SeedScaleTest(TestCase):
+    fixtures = ['all.json']
+
+    def seed(self, **options):
+        call_command('seed_scale', cis=120, chunk_size=50, workers=1, stdout=StringIO(), **options)
+        return list(CI.objects.filter(client__name__startswith='Seed ').order_by('pk').values_list(
+            'client__name', 'hostname', 'ip', 'status', 'pack_id', 'place__name', 'contract__name',
+        ))
+
+    def test_cis_are_generated_with_their_credentials_and_packs(self):
+        with self.settings(CIS_BLIND_INDEX_KEY='index key'):
+            cis = self.seed()
+        self.assertEqual(len(cis), 120)
+        self.assertEqual(Credential.objects.filter(ci__client__name='Seed 0 client 0').count(), 120)
+        self.assertFalse(CI.objects.filter(client__name='Seed 0 client 0', status__gt=0, pack=None).exists())
+        self.assertFalse(CI.objects.filter(client__name='Seed 0 client 0', appliances=None).exists())
+        self.assertEqual(ClientCIStatusCount.objects.differences(), {})
+        self.assertEqual(PackCIStatusCount.objects.differences(), {})
+
+        credential = Credential.objects.filter(ci__client__name='Seed 0 client 0').first()
+        self.assertEqual(len(credential.password), 16)
+        with self.settings(CIS_BLIND_INDEX_KEY='index key'):
+            self.assertEqual(credential.username_index, username_index(str(credential.username)))
+
+        with self.assertRaisesRegex(CommandError, 'already there'):
+            self.seed()
+
+    def test_same_seed_same_data(self):
+        with self.settings(CIS_CREDENTIAL_RECORDS=True):
+            first = self.seed(seed=1)
+        self.assertEqual(Credential.objects.filter(record__isnull=False).count(), 120)
+        self.assertEqual(len(Credential.objects.filter(record__isnull=False).first().password), 16)
+        CI.objects.filter(client__name__startswith='Seed ').delete()
+        Client.objects.filter(name__startswith='Seed ').delete()
+        Contract.objects.filter(name__startswith='Seed ').delete()
+        User.objects.filter(username__startswith='seed').delete()
+        second = self.seed(seed=1)
+
+        # the pks aside
+        self.assertEqual([ci[:4] + ci[5:] for ci in first], [ci[:4] + ci[5:] for ci in second])
@@ -0,0 +1,54 @@
+from django.shortcuts import reverse
+from django.test import TestCase
+
+from accounts.models import User
+from ..models import CI, Appliance, Client
+from ..search import search
+
+
+class SearchTest(TestCase):
+    fixtures = ['all.json']
+
+    def test_substring_of_hostname_ip_and_description(self):
+        self.assertEqual(set(search(CI.objects.all(), 'LW').values_list('hostname', flat=True)), {'FLW2', 'FLW3'})
+        self.assertEqual(search(CI.objects.all(), '10.20.').get().hostname, 'CORE')
+        self.assertEqual(search(CI.objects.all(), 'switch core').get().hostname, 'CORE')
+
+    def test_search_is_case_insensitive(self):
+        self.assertEqual(search(CI.objects.all(), 'core').get().hostname, 'CORE')
+
+    def test_index_follows_save_update_and_delete(self):
+        ci = CI.objects.get(hostname='CORE')
+        ci.hostname = 'BACKBONE'
+        ci.description = 'Switch'
+        ci.save()
+        self.assertFalse(search(CI.objects.all(), 'CORE').exists())
+        self.assertEqual(search(CI.objects.all(), 'ackbo').get(), ci)
+
+        CI.objects.filter(pk=ci.pk).update(description='Edge Router')
+        self.assertEqual(search(CI.objects.all(), 'edge rou').get(), ci)
+
+        ci.delete()
+        self.assertFalse(search(CI.objects.all(), 'ackbo').exists())
+
+    def test_search_keeps_queryset_filters(self):
+        client = Client.objects.get(pk=2)
+        self.assertFalse(search(CI.objects.filter(client=client), 'FLW').exists())
+
+    def test_appliances_by_serial_number(self):
+        appliance = Appliance.objects.first()
+        term = appliance.serial_number[1:]
+        self.assertIn(appliance, search(Appliance.objects.all(), term))
+
+    def test_quotes_are_taken_literally(self):
+        self.assertFalse(search(CI.objects.all(), '"CORE" OR "FLW"').exists())
+
+    def test_network_term_is_a_range_of_addresses(self):
+        self.assertEqual(search(CI.objects.all(), '10.10.100.0/24').count(), 2)
+        self.assertEqual(search(Appliance.objects.all(), '10.10.100.0/24').count(), 0)
+
+    def test_ci_list_view_filters_by_query(self):
+        self.client.force_login(User.objects.get(pk=1))
+        response = self.client.get(reverse('cis:ci_list', args=(0,)), {'q': 'flw'})
+        self.assertEqual(len(response.context['ci_list']), 2)
+        self.assertNotContains(response, 'CORE')
@@ -0,0 +1,42 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+
+from django.shortcuts import reverse
+from django.test import TestCase
+
+from accounts.models import User
+
+
+class TelemetryTest(TestCase):
+    fixtures = ['all.json']
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file = os.path.join(directory.name, 'telemetry.jsonl')
+
+    def get(self, url, sample_rate):
+        with self.settings(CIS_TELEMETRY_SAMPLE_RATE=sample_rate, CIS_TELEMETRY_FILE=self.file):
+            # the middleware is loaded by the first request of a client
+            self.client = self.client_class()
+            self.client.force_login(User.objects.get(pk=1))
+            return self.client.get(url)
+
+    def test_sampled_request_is_written_as_a_json_line(self):
+        response = self.get(reverse('cis:ci_list', args=(0,)), 1)
+        with open(self.file) as file:
+            lines = file.readlines()
+        self.assertEqual(len(lines), 1)
+
+        entry = json.loads(lines[0])
+        self.assertEqual(entry['view'], 'cis:ci_list')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['queries'], 5)
+        self.assertEqual(entry['size'], len(response.content))
+        self.assertGreater(entry['render_ms'], 0)
+        self.assertGreaterEqual(entry['duration_ms'], entry['db_ms'])
+
+    def test_nothing_is_written_without_a_sample_rate(self):
+        self.get(reverse('cis:ci_list', args=(0,)), 0)
+        self.assertFalse(os.path.exists(self.file))
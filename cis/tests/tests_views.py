@@ -1,11 +1,20 @@
+import csv
+import json
 from datetime import timedelta
+from io import StringIO
 from collections import namedtuple
 from dataclasses import dataclass
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.shortcuts import reverse
 
-from ..models import Client, Place, Appliance, Manufacturer, CI, Contract
+from ..admin import CIAdmin
+from ..management.commands.advise_indexes import Command as AdviseIndexes
+from ..paginators import estimate_count
+from ..models import Client, Place, Appliance, Manufacturer, CI, Contract, CIPack, ClientCIStatusCount
 from accounts.models import User
 
 
@@ -174,6 +183,90 @@ class PlaceApplianceAndCIViewTest(TestCase):
                 self.assertContains(response, text, count=1)
 
 
+    def test_objects_of_another_client_are_not_found(self):
+        self.client.force_login(self.users['B'])
+        ci = CI.objects.get(client=self.places['A'].client)
+        for url in (
+            reverse('cis:ci_detail', args=(ci.pk,)),
+            reverse('cis:place_update', args=(self.places['A'].pk,)),
+            reverse('cis:appliance_update', args=(self.appliances['A'].pk,)),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_ci_list_falls_back_to_a_count_when_the_counters_drift(self):
+        self.client.force_login(self.users['A'])
+        counters = ClientCIStatusCount.objects.filter(client=self.users['A'].client)
+        for count in (0, 25, -5):
+            with self.subTest(count=count):
+                counters.update(count=count)
+                response = self.client.get(reverse('cis:ci_list', args=(0,)))
+                self.assertEqual(len(response.context['ci_list']), 1)
+                self.assertEqual(response.context['paginator'].count, 1)
+
+    def test_send_pack_leaves_out_the_cis_of_other_clients(self):
+        self.client.force_login(self.users['B'])
+        cis = CI.objects.order_by('hostname')
+        response = self.client.post(reverse('cis:ci_pack_send'), {'cis_selected': [ci.pk for ci in cis]}, follow=True)
+        self.assertContains(response, '1 CI was sent to production successfully.')
+        pack = CIPack.objects.get()
+        self.assertEqual(pack.client, self.users['B'].client)
+        self.assertEqual([(ci.hostname, ci.pack_id) for ci in cis.all()], [('HOST_A', None), ('HOST_B', pack.pk)])
+
+
+class AsyncViewTest(TestCase):
+    fixtures = ['all.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.get(pk=1)
+        # (sync url, async url, context variable to compare)
+        cls.urls = (
+            (reverse('cis:ci_list', args=(0,)), reverse('cis:ci_list_async', args=(0,)), 'ci_list'),
+            (reverse('cis:ci_detail', args=(1,)), reverse('cis:ci_detail_async', args=(1,)), 'ci'),
+            (reverse('cis:appliance_list'), reverse('cis:appliance_list_async'), 'appliance_list'),
+            (reverse('cis:manufacturer_detail', args=(1,)),
+             reverse('cis:manufacturer_detail_async', args=(1,)), 'num_appliances'),
+        )
+
+    def test_async_views_render_the_same_as_sync_views(self):
+        self.client.force_login(self.user)
+        for sync_url, async_url, name in self.urls:
+            sync_response = self.client.get(sync_url)
+            async_response = self.client.get(async_url)
+            self.assertEqual(async_response.status_code, 200)
+            self.assertTemplateUsed(async_response, sync_response.templates[0].name)
+            expected, actual = sync_response.context[name], async_response.context[name]
+            if name.endswith('_list'):
+                expected, actual = list(expected), list(actual)
+            self.assertEqual(actual, expected)
+
+    @override_settings(CIS_BLIND_INDEX_KEY='index key')
+    def test_ci_lists_filter_by_credential_username(self):
+        call_command('rotate_credential_keys', workers=1, stdout=StringIO())
+        self.client.force_login(self.user)
+        for url in (reverse('cis:ci_list', args=(0,)), reverse('cis:ci_list_async', args=(0,))):
+            response = self.client.get(url, {'username': 'admin1'})
+            self.assertEqual([ci.pk for ci in response.context['ci_list']], [1])
+            self.assertEqual(response.context['paginator'].count, 1)
+
+    def test_anonymous_user_is_redirected_to_login(self):
+        for _, async_url, _ in self.urls:
+            response = self.client.get(async_url)
+            self.assertEqual(response.status_code, 302)
+
+    def test_unapproved_user_is_denied(self):
+        self.user.client = None
+        self.user.save()
+        self.client.force_login(self.user)
+        for _, async_url, _ in self.urls:
+            self.assertEqual(self.client.get(async_url).status_code, 403)
+
+    def test_ci_of_another_client_is_not_found(self):
+        self.client.force_login(User.objects.get(pk=2))
+        response = self.client.get(reverse('cis:ci_detail_async', args=(1,)))
+        self.assertEqual(response.status_code, 404)
+
+
 class AdminViewTest(TestCase):
     fixtures = ['all.json']
 
@@ -193,6 +286,164 @@ class AdminViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'The selected CIs were approved successfully.')
         self.assertTemplateUsed(response, 'admin/change_list.html')
+        self.assertEqual(ClientCIStatusCount.objects.totals(1), {0: 1, 2: 2})
+
+    def test_cis_are_sorted_by_the_numeric_order_of_their_addresses(self):
+        # the IP column
+        response = self.client.get(reverse('admin:cis_ci_changelist'), {'o': 4})
+        self.assertEqual([ci.ip for ci in response.context['cl'].result_list],
+                         ['10.10.20.20', '10.10.100.2', '10.10.100.3'])
+
+    def assertQueriesDoNotGrow(self, url, add_rows):
+        """Pin the number of queries of a page, whatever the number of rows shown"""
+
+        self.client.get(url)  # warm the content types cache
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        add_rows()
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(after), len(before), [q['sql'] for q in after.captured_queries])
+        return response
+
+    def add_cis(self):
+        """Add a client with 5 places, appliances and CIs, spread in 5 packs"""
+
+        client = Client.objects.create(name='Client C')
+        manufacturer = Manufacturer.objects.create(name='Juniper')
+        contract = Contract.objects.get(pk=1)
+        for n in range(5):
+            place = Place.objects.create(client=client, name=f'Place {n}')
+            appliance = create_appliance(client, manufacturer, f'C{n}')
+            ci = create_ci(client, place, f'C{n}', contract)
+            ci.appliances.add(appliance)
+            ci.pack = CIPack.objects.create(responsible=self.user, approved_by=self.user)
+            ci.save()
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for model in ('client', 'place', 'manufacturer', 'appliance', 'ci', 'cipack'):
+            with self.subTest(model=model), transaction.atomic():
+                self.assertQueriesDoNotGrow(reverse(f'admin:cis_{model}_changelist'), self.add_cis)
+                transaction.set_rollback(True)
+
+    @override_settings(CIS_ADMIN_INLINE_PER_PAGE=2)
+    def test_ci_inline_is_paginated(self):
+        url = reverse('admin:cis_place_change', args=(1,))
+        response = self.client.get(url)
+        self.assertContains(response, 'CORE')
+        self.assertNotContains(response, 'FLW3')
+        self.assertContains(response, '<a href="?ci_set-page=2">2</a>', html=True)
+
+        response = self.client.get(url, {'ci_set-page': 2})
+        self.assertContains(response, 'FLW3')
+        self.assertNotContains(response, 'CORE')
+
+        # the page posted back binds the same CIs
+        data = {
+            'name': 'Main', 'client': 1, 'description': '',
+            'ci_set-TOTAL_FORMS': 1, 'ci_set-INITIAL_FORMS': 1,
+            'ci_set-MIN_NUM_FORMS': 0, 'ci_set-MAX_NUM_FORMS': 0,
+            'ci_set-0-id': 3, 'ci_set-0-place': 1,
+        }
+        response = self.client.post(f'{url}?ci_set-page=2', data)
+        self.assertRedirects(response, reverse('admin:cis_place_changelist'))
+
+    @override_settings(CIS_ADMIN_INLINE_PER_PAGE=2)
+    def test_ci_inline_queries_do_not_grow_with_cis(self):
+        pack = CIPack.objects.get(pk=1)
+
+        def add_cis():
+            for ci in CI.objects.all():
+                ci.pk = None
+                ci.hostname += '_COPY'
+                ci.save()
+            CI.objects.update(pack=pack)
+
+        self.assertQueriesDoNotGrow(reverse('admin:cis_cipack_change', args=(pack.pk,)), add_cis)
+
+    def test_list_editable_saves_in_bulk(self):
+        data = {
+            '_save': 'Save',
+            'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 3, 'form-MIN_NUM_FORMS': 0, 'form-MAX_NUM_FORMS': 1000,
+        }
+        for i, ci in enumerate(CI.objects.order_by('pk')):
+            data.update({
+                f'form-{i}-id': ci.pk,
+                f'form-{i}-ip': f'10.0.0.{i}' if i else ci.ip,
+                f'form-{i}-description': f'Edited {i}',
+                f'form-{i}-deployed': 'on' if ci.deployed else '',
+                f'form-{i}-business_impact': ci.business_impact,
+            })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('admin:cis_ci_changelist'), data)
+        self.assertEqual(response.status_code, 302)
+
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        # one per set of edited columns, none of the credentials
+        self.assertEqual(len(updates), 2, updates)
+        self.assertTrue(all(sql.startswith('UPDATE "cis_ci"') for sql in updates))
+        self.assertEqual(
+            list(CI.objects.order_by('pk').values_list('description', flat=True)),
+            ['Edited 0', 'Edited 1', 'Edited 2'],
+        )
+        self.assertEqual(CI.objects.in_network('10.0.0.0/30').count(), 2)
+
+    def export(self, url, data=None):
+        response = self.client.post(url, data) if data else self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+
+    def test_export_selected_cis(self):
+        rows = self.export(reverse('admin:cis_ci_changelist'), {
+            'action': 'export_csv', '_selected_action': [1, 2],
+        })
+        self.assertEqual(rows[0], list(CIAdmin.export_fields))
+        self.assertEqual([row[0] for row in rows[1:]], ['CORE', 'FLW2'])
+
+    def test_export_filtered_cis_with_credentials(self):
+        url = reverse('admin:cis_ci_export')
+        rows = self.export(f'{url}?q=FLW')
+        self.assertEqual(len(rows), 3)
+        self.assertNotIn('credential__password', rows[0])
+
+        url = f'{reverse("admin:cis_ci_export_credentials")}?q=FLW'
+        rows = self.export(url)
+        password = CI.objects.get(hostname=rows[1][0]).credential.password
+        self.assertEqual(rows[1][rows[0].index('credential__password')], password)
+
+        with self.settings(CIS_CREDENTIAL_RECORDS=True):
+            call_command('convert_credentials', stdout=StringIO())
+        self.assertEqual(self.export(url), rows)
+
+    def test_export_runs_no_count_or_page_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export(f'{reverse("admin:cis_ci_export")}?q=FLW')
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([sql for sql in sqls if 'COUNT(' in sql or 'LIMIT 100' in sql])
+
+    def test_export_packs(self):
+        rows = self.export(reverse('admin:cis_cipack_export'))
+        self.assertEqual(rows[1][-2:], ['3', '0'])
+
+    def test_changelist_links_to_export(self):
+        response = self.client.get(reverse('admin:cis_appliance_changelist'), {'virtual__exact': 1})
+        self.assertContains(response, f'{reverse("admin:cis_appliance_export")}?virtual__exact=1')
+        self.assertNotContains(response, 'Export with credentials')
+
+    @override_settings(CIS_BLIND_INDEX_KEY='index key')
+    def test_changelist_filters_by_credential_username(self):
+        call_command('rotate_credential_keys', workers=1, stdout=StringIO())
+        url = reverse('admin:cis_ci_changelist')
+        response = self.client.get(url, {'username': 'admin2'})
+        self.assertContains(response, 'credential username')
+        self.assertEqual([ci.hostname for ci in response.context['cl'].result_list], ['FLW2'])
+
+        with self.settings(CIS_BLIND_INDEX_KEY=''):
+            response = self.client.get(url, {'username': 'admin2'})
+        self.assertNotContains(response, 'credential username')
+        self.assertEqual(len(response.context['cl'].result_list), 3)
 
     def test_user_display_approved(self):
         response = self.client.get(reverse('admin:accounts_user_changelist'), follow=True)
@@ -212,6 +463,59 @@ class AdminViewTest(TestCase):
             self.assertContains(response, manufacturer.name)
 
 
+@override_settings(CIS_ADMIN_LARGE_CHANGELISTS=True)
+class LargeChangelistTest(TestCase):
+    fixtures = ['all.json']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username='admin'))
+
+    def test_count_is_exact_below_the_limit(self):
+        self.assertEqual(estimate_count(CI.objects.all(), limit=10), 3)
+        self.assertEqual(estimate_count(CI.objects.filter(client=1), limit=10), 3)
+
+    def test_count_stops_at_the_limit_when_filtered(self):
+        self.assertEqual(estimate_count(CI.objects.filter(client=1), limit=1), 2)
+
+    def test_unfiltered_count_comes_from_the_table_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        CI.objects.filter(pk=3).delete()
+        # statistics are as of the last ANALYZE
+        self.assertEqual(estimate_count(CI.objects.all(), limit=1), 3)
+
+    def test_changelist_uses_autocomplete_filters(self):
+        client = Client.objects.get(pk=1)
+        url = reverse('admin:cis_ci_changelist')
+        response = self.client.get(url, {'client__id__exact': client.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'admin/cis/autocomplete_filter.html')
+        self.assertContains(response, 'data-ajax--url="{}"'.format(reverse('admin:autocomplete')))
+        self.assertContains(response, f'<option value="{client.pk}" selected>{client.name}</option>', html=True)
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+        self.assertFalse(response.context['cl'].show_full_result_count)
+
+        # cleared select
+        response = self.client.get(url, {'client__id__exact': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
+    def test_autocomplete_of_the_filters(self):
+        for field in CIAdmin.autocomplete_list_filter:
+            with self.subTest(field=field):
+                response = self.client.get(reverse('admin:autocomplete'), {
+                    'app_label': 'cis', 'model_name': 'ci', 'field_name': field, 'term': '',
+                })
+                self.assertEqual(response.status_code, 200)
+
+    def test_changelists_render(self):
+        for model in ('place', 'appliance', 'ci'):
+            with self.subTest(model=model):
+                response = self.client.get(reverse(f'admin:cis_{model}_changelist'))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'admin/js/autocomplete')
+
+
 def create_appliance(client, manufacturer, letter):
     return Appliance.objects.create(
         client=client,
@@ -232,7 +536,7 @@ def create_contract():
 
 
 def create_ci(client, place, letter, contract):
-    CI.objects.create(
+    return CI.objects.create(
         client=client,
         place=place,
         hostname=f'HOST_{letter}',
@@ -241,3 +545,48 @@ def create_ci(client, place, letter, contract):
         deployed=True,
         contract=contract,
     )
+
+
+class LoadTestCommandTest(TestCase):
+
+    def test_flows_are_reported_as_json(self):
+        out = StringIO()
+        call_command('loadtest', seed=True, requests=2, concurrency=1, stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(list(report['flows']), [
+            'login', 'ci_list_created', 'ci_list_sent', 'ci_list_approved',
+            'ci_detail', 'appliance_list', 'upload', 'send_pack',
+        ])
+        for name, flow in report['flows'].items():
+            with self.subTest(name):
+                self.assertEqual(flow['failures'], 0, flow.get('first_error'))
+                self.assertLessEqual(flow['p50_ms'], flow['p99_ms'])
+        client = Client.objects.get(name='Load test')
+        # 200 seeded, 2 spreadsheets of 10 uploaded, 2 packs of 5 sent
+        self.assertEqual(CI.objects.filter(client=client).count(), 220)
+        self.assertEqual(CI.objects.filter(client=client, status=1).count(), 10)
+
+    def test_wrong_password(self):
+        options = {'flows': ['login'], 'requests': 1, 'concurrency': 1, 'stdout': StringIO()}
+        call_command('loadtest', seed=True, **options)
+        with self.assertRaisesRegex(CommandError, 'Could not log in'):
+            call_command('loadtest', password='wrong', **options)
+
+
+class AdviseIndexesCommandTest(TestCase):
+    fixtures = ['all.json']
+
+    def test_the_views_miss_no_index(self):
+        out = StringIO()
+        call_command('advise_indexes', repeat=1, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertIn('cis:ci_list', {view for query in report['queries'] for view in query['views']})
+        self.assertEqual(report['recommended_indexes'], [])
+
+    def test_missing_composite_index(self):
+        sql = ('SELECT "cis_ci"."id" FROM "cis_ci" INNER JOIN "cis_client" T4 ON ("cis_ci"."client_id" = T4."id") '
+               'WHERE ("cis_ci"."deployed" = 1 AND "cis_ci"."business_impact" IN (1, 2)) '
+               'ORDER BY "cis_ci"."ip_key" ASC LIMIT 10')
+        self.assertEqual(AdviseIndexes._missing_indexes(sql), [('cis_ci', ('deployed', 'business_impact', 'ip_key'))])
+        self.assertEqual(AdviseIndexes._missing_indexes('SELECT "cis_ci"."id" FROM "cis_ci" WHERE "cis_ci"."status" = 1'), [])
@@ -0,0 +1,88 @@
+import json
+import subprocess
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.template import engines
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..management.commands.profile_startup import Command as ProfileStartup
+from ..models import CI, Credential
+from ..warmup import compile_templates, derive_keys, resolve_urls, warmup
+
+
+class WarmupTest(SimpleTestCase):
+
+    def test_templates_are_kept_compiled_without_debug(self):
+        loaders = [('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader',
+        ])]
+        templates = [{**engines.templates['django'], 'APP_DIRS': False,
+                      'OPTIONS': {**engines.templates['django']['OPTIONS'], 'loaders': loaders}}]
+        with override_settings(TEMPLATES=templates):
+            self.assertGreater(compile_templates(), 0)
+            cached = engines['django'].engine.template_loaders[0]
+            self.assertIn('homepage.html', cached.get_template_cache)
+            self.assertIn('cis/ci_list.html', cached.get_template_cache)
+
+    def test_urls_and_keys(self):
+        self.assertGreater(resolve_urls(), 0)
+        self.assertGreater(derive_keys(), 0)
+        self.assertIn('fernet', Credential._meta.get_field('password').__dict__)
+
+    def test_warmup(self):
+        with self.assertLogs('cis.warmup') as logs:
+            warmup()
+        self.assertIn('templates compiled', logs.output[0])
+
+
+class ProfileStartupCommandTest(TestCase):
+    fixtures = ['all.json']
+
+    def child(self, args, env, **kwargs):
+        """A profiled process, as run by the command, without starting it"""
+
+        paths = json.loads(env['PROFILE_PATHS'])
+        warm = env['PROFILE_WARMUP'] == '1'
+        stdout = json.dumps({
+            'load_ms': 300.0, 'warmup_ms': 50.0 if warm else 0.0, 'heavy_modules': [] if warm else ['openpyxl'],
+            'requests': [
+                {'path': path, 'status': 200, 'first_ms': 20.0 if warm else 80.0, 'second_ms': 10.0}
+                for path in paths
+            ],
+        })
+        stderr = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:      1500 |       2500 | django',
+            'import time:      1000 |       1000 |   django.db',
+            'import time:       400 |        400 | openpyxl',
+        ])
+        return subprocess.CompletedProcess(args, 0, stdout=f'{stdout}\n', stderr=stderr)
+
+    def test_report(self):
+        with mock.patch('subprocess.run', side_effect=self.child) as run:
+            call_command('profile_startup', runs=2, json=True, stdout=(out := StringIO()))
+        self.assertEqual(run.call_count, 4)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['cold']['heavy_modules'], ['openpyxl'])
+        self.assertEqual(report['warm']['warmup_ms'], 50.0)
+        self.assertEqual([request['first_ms'] for request in report['warm']['requests']], [20.0] * 5)
+        self.assertIn(f'/cis/ci/{CI.objects.order_by("pk").first().pk}', report['cold']['requests'][2]['path'])
+        # the modules of a package add up, their own imports aside
+        self.assertEqual(report['slowest_imports'][:2], [
+            {'package': 'django', 'ms': 2.5}, {'package': 'openpyxl', 'ms': 0.4},
+        ])
+
+        with mock.patch('subprocess.run', side_effect=self.child):
+            call_command('profile_startup', runs=1, stdout=(out := StringIO()))
+        self.assertIn('Heavy modules loaded: openpyxl.', out.getvalue())
+
+    def test_failed_process(self):
+        failed = subprocess.CompletedProcess([], 1, stdout='', stderr='ImportError: no module')
+        with mock.patch('subprocess.run', return_value=failed), self.assertRaisesRegex(CommandError, 'ImportError'):
+            ProfileStartup()._run({}, warmup=False)
+
+    def test_user_with_cis_is_needed(self):
+        with self.assertRaises(CommandError):
+            call_command('profile_startup', email='nobody@example.com', stdout=StringIO())
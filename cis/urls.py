@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 app_name = 'cis'
 
@@ -16,4 +16,10 @@ urlpatterns = [
     path('appliances/', views.ApplianceListView.as_view(), name='appliance_list'),
     path('appliance/create/', views.ApplianceCreateView.as_view(), name='appliance_create'),
     path('appliance/<int:pk>', views.ApplianceUpdateView.as_view(), name='appliance_update'),
+
+    # async versions of the read-heavy views
+    path('async/cis/<int:status>/', async_views.ci_list, name='ci_list_async'),
+    path('async/ci/<int:pk>', async_views.ci_detail, name='ci_detail_async'),
+    path('async/manufacturer/<int:pk>', async_views.manufacturer_detail, name='manufacturer_detail_async'),
+    path('async/appliances/', async_views.appliance_list, name='appliance_list_async'),
 ]
@@ -2,46 +2,57 @@ from django.db import DatabaseError
 from django.shortcuts import render, redirect
 from django.utils.translation import ngettext
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
-from django.http import Http404
+from django.http import HttpResponse
 from django.forms import inlineformset_factory
 from django.core.exceptions import PermissionDenied
 
-from .models import CI, Client, Place, Manufacturer, Appliance, CIPack
+from .models import CI, Client, Place, Manufacturer, Appliance, CIPack, ClientCIStatusCount
 from .forms import UploadCIsForm, CIForm, ApplianceForm, PlaceForm
+from .budget import query_budget
 from .loader import CILoader
-from .mixins import UserApprovedMixin, AddClientMixin
+from .metrics import REGISTRY
+from .paginators import CounterPaginator
+from .mixins import UserApprovedMixin, AddClientMixin, SearchMixin, credential_username
+from .search import search
 
 
+@query_budget(4)
 def homepage(request):
     user = request.user
+    ci_counts = None
     if not user.is_anonymous and not user.is_approved:
         messages.warning(request, 'Your account needs to be approved. '
                                   'Please contact you Account Manager.')
-    return render(request, 'homepage.html')
+    elif not user.is_anonymous and (user.is_superuser or user.client_id):
+        totals = ClientCIStatusCount.objects.totals(None if user.is_superuser else user.client_id)
+        ci_counts = [(status, label, totals.get(status, 0)) for status, label in CI.STATUS_OPTIONS]
+    return render(request, 'homepage.html', {'ci_counts': ci_counts})
 
 
 class PlaceCreateView(UserApprovedMixin, SuccessMessageMixin, AddClientMixin, CreateView):
     model = Place
+    query_budget = 6
     fields = ('name', 'description')
     success_message = "The place %(name)s was created successfully."
 
 
 class PlaceUpdateView(UserApprovedMixin, SuccessMessageMixin, UpdateView):
     model = Place
+    query_budget = 6
     fields = ('name', 'description')
     success_message = "The place %(name)s was updated successfully."
 
     def get_queryset(self):
-        qs = Place.objects.select_related('client')
-        if not self.request.user.is_superuser:
-            qs.filter(client=self.request.user.client)
-        return qs
+        return Place.objects.for_user(self.request.user)
 
 
+# validates every place of the client when saved
+@query_budget(None)
 @login_required
 def manage_client_places(request):
     if not request.user.is_approved: raise PermissionDenied()
@@ -78,6 +89,7 @@ def manage_client_places(request):
 
 class CICreateView(UserApprovedMixin, SuccessMessageMixin, AddClientMixin, CreateView):
     model = CI
+    query_budget = 16
     form_class = CIForm
     success_message = "The CI was created successfully."
 
@@ -88,79 +100,87 @@ class CICreateView(UserApprovedMixin, SuccessMessageMixin, AddClientMixin, Creat
         return kwargs
 
 
-class CIListView(UserApprovedMixin, ListView):
+class CIListView(UserApprovedMixin, SearchMixin, ListView):
     model = CI
+    query_budget = 6
     paginate_by = 10
+    search_function = staticmethod(search)
 
     def get_queryset(self):
-        qs = CI.objects.filter(
-            status=self.kwargs['status'],
-            place__client=self.request.user.client
-        )
-        if self.request.user.is_superuser:
-            qs = CI.objects.filter(status=self.kwargs['status'])
+        qs = CI.objects.for_user(self.request.user).filter(status=self.kwargs['status'])
+        if username := credential_username(self.request):
+            qs = qs.with_credential_username(username)
+        qs = qs.select_related('client').prefetch_related('appliances')
 
-        return qs
+        return self.search(qs)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        # evaluated once, as the template reads the first CI before listing them all
+        return paginator, page, list(object_list), is_paginated
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        user = self.request.user
+        # the queryset of a user without a client is empty
+        if (self.get_search_term() or credential_username(self.request)
+                or not (user.is_superuser or user.client_id)):
+            return super().get_paginator(queryset, per_page, **kwargs)
+        # read the total from the status counters instead of a COUNT(*)
+        totals = ClientCIStatusCount.objects.totals(None if user.is_superuser else user.client_id)
+        return CounterPaginator(queryset, per_page, totals.get(int(self.kwargs['status']), 0), **kwargs)
 
 
 class CIDetailView(UserApprovedMixin, DetailView):
     model = CI
-    queryset = CI.objects.select_related('place', 'contract')
+    query_budget = 6
 
-    def get_object(self, **kwargs):
-        object = super().get_object(**kwargs)
-        if not self.request.user.is_superuser:
-            if object.place.client != self.request.user.client:
-                # user authenticated but unauthorized
-                raise Http404
-        # user authenticated and authorized
-        return object
+    def get_queryset(self):
+        # the CIs of other clients are not found
+        return CI.objects.for_user(self.request.user).select_related('place', 'contract', 'credential')
 
 
 class ManufacturerDetailView(UserApprovedMixin, DetailView):
     model = Manufacturer
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        qs = Appliance.objects.filter(
-            manufacturer=context['manufacturer'],
-            client=self.request.user.client,
-        )
-        if self.request.user.is_superuser:
-            qs = Appliance.objects.filter(manufacturer=context['manufacturer'])
+        qs = Appliance.objects.for_user(self.request.user).filter(manufacturer=context['manufacturer'])
         context['num_appliances'] = qs.count()
 
         return context
 
 
-class ApplianceListView(UserApprovedMixin, ListView):
+class ApplianceListView(UserApprovedMixin, SearchMixin, ListView):
     model = Appliance
+    query_budget = 6
     paginate_by = 10
+    search_function = staticmethod(search)
 
     def get_queryset(self):
-        qs = Appliance.objects.filter(client=self.request.user.client)
-        if self.request.user.is_superuser:
-            qs = super().get_queryset()
-        return qs
+        qs = Appliance.objects.for_user(self.request.user)
+        return self.search(qs.select_related('client'))
 
 
 class ApplianceCreateView(UserApprovedMixin, SuccessMessageMixin, AddClientMixin, CreateView):
     model = Appliance
+    query_budget = 8
     form_class = ApplianceForm
     success_message = "The appliance %(serial_number)s was created successfully."
 
 
 class ApplianceUpdateView(UserApprovedMixin, SuccessMessageMixin, UpdateView):
     model = Appliance
+    query_budget = 8
     form_class = ApplianceForm
     success_message = "The appliance was updated successfully."
 
     def get_queryset(self):
-        qs = Appliance.objects.select_related('client', 'manufacturer')
-        if not self.request.user.is_superuser:
-            qs.filter(client=self.request.user.client)
-        return qs
+        return Appliance.objects.for_user(self.request.user).select_related('client')
 
+
+# one CI of the spreadsheet at a time
+@query_budget(None)
 @login_required
 def ci_upload(request):
     if not request.user.is_approved: raise PermissionDenied()
@@ -180,24 +200,34 @@ def ci_upload(request):
     })
 
 
+# the counters of the pack, and of the first pack sent by a client, are created by the update
+@query_budget(10)
 @login_required
 def send_ci_pack(request):
     if not request.user.is_approved: raise PermissionDenied()
 
     if request.method == 'POST':
         try:
-            pack = CIPack.objects.create(responsible=request.user)
+            pack = CIPack.objects.create(responsible=request.user, client_id=request.user.client_id)
             ci_pks = request.POST.getlist('cis_selected')
             if ci_pks:
-                pack.send_to_production(ci_pks)
+                # the CIs of other clients are left out
+                sent = pack.send_to_production(CI.objects.for_user(request.user).filter(pk__in=ci_pks).values('pk'))
                 messages.success(request, ngettext(
-                    'The selected CI was sent to production successfully.',
-                    'The selected CIs were sent to production successfully.',
-                    len(ci_pks)
-                ))
+                    '%(count)d CI was sent to production successfully.',
+                    '%(count)d CIs were sent to production successfully.',
+                    sent
+                ) % {'count': sent})
             else:
                 messages.error(request, 'Please select at least one item to be sent to production.')
         except DatabaseError:
             raise DatabaseError('There was an error during the sending of the CIs to production.')
 
     return redirect('cis:ci_list', status=0)
+
+
+@query_budget(2)
+@staff_member_required
+def metrics(request):
+    """The metrics of every process, in the Prometheus text format"""
+    return HttpResponse(REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
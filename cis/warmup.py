@@ -0,0 +1,82 @@
+"""
+Warmup of a process before it serves requests.
+
+Otherwise the first request of each process compiles the templates it
+renders, imports the URLconf, with the views, and populates its resolvers,
+and derives the Fernet keys of the encrypted fields. warmup() does it all
+beforehand. Called by gunicorn in its master process, which preloads the
+application, see gunicorn.conf.py, so the workers it forks share the work
+and its memory.
+"""
+
+import logging
+from pathlib import Path
+from time import perf_counter
+
+from django.apps import apps
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.urls import URLResolver, get_resolver
+from fernet_fields import EncryptedField
+
+logger = logging.getLogger(__name__)
+
+
+def compile_templates() -> int:
+    """Compile every template, kept by the cached template loader, as without DEBUG"""
+
+    compiled = 0
+    for engine in engines.all():
+        directories = [
+            directory for loader in engine.engine.template_loaders if hasattr(loader, 'get_dirs')
+            for directory in loader.get_dirs()
+        ]
+        names = {path.relative_to(directory).as_posix() for directory in directories
+                 for path in Path(directory).rglob('*.html')}
+        for name in sorted(names):
+            try:
+                engine.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError):
+                # e.g. the templates of an app left out of INSTALLED_APPS
+                continue
+            compiled += 1
+    return compiled
+
+
+def resolve_urls(resolver: URLResolver = None) -> int:
+    """Import the URLconf and populate its resolvers, compiling the patterns of the URLs"""
+
+    resolver = resolver or get_resolver()
+    # populated on first use, by the first reverse() or resolve()
+    resolver.reverse_dict
+    resolved = 0
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            resolved += resolve_urls(pattern)
+        else:
+            pattern.pattern.regex
+            resolved += 1
+    return resolved
+
+
+def derive_keys() -> int:
+    """Derive the Fernet keys of the encrypted fields, cached by each field"""
+
+    fields = [
+        field for model in apps.get_models() for field in model._meta.get_fields()
+        if isinstance(field, EncryptedField)
+    ]
+    for field in fields:
+        field.fernet
+    return len(fields)
+
+
+def warmup():
+    start = perf_counter()
+    templates = compile_templates()
+    urls = resolve_urls()
+    fields = derive_keys()
+    # no connection is to be shared by the processes forked
+    connections.close_all()
+    logger.info(f'Warmed up in {(perf_counter() - start) * 1000:.0f} ms: {templates} templates compiled, '
+                f'{urls} URLs resolved, the keys of {fields} encrypted fields derived.')
@@ -0,0 +1,40 @@
+"""
+Generated spreadsheets of CIs, in the layout of cis_mapping, for the benchmarks and load tests.
+"""
+
+from io import BytesIO
+
+from openpyxl import Workbook
+
+from . import cis_mapping
+
+
+def generate_workbook(count: int, prefix: str = 'BENCHMARK') -> BytesIO:
+    """Return a spreadsheet of count CIs with credentials, their hostnames starting with prefix"""
+
+    workbook = Workbook()
+    cis_sheet = workbook.create_sheet(cis_mapping.CIS_SHEET)
+    cis_sheet.append(['header'] * 15)
+    for n in range(count):
+        row = [None] * 15
+        row[cis_mapping.HOSTNAME] = f'{prefix}{n}'
+        row[cis_mapping.IP] = f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}'
+        row[cis_mapping.DESCRIPTION] = 'Benchmark'
+        row[cis_mapping.DEPLOYED] = 'x'
+        row[cis_mapping.BUSINESS_IMPACT] = 'low'
+        row[cis_mapping.PLACE] = 'Benchmark'
+        row[cis_mapping.PLACE_DESCRIPTION] = 'Benchmark'
+        row[cis_mapping.CONTRACT] = 'Benchmark'
+        row[cis_mapping.CONTRACT_BEGIN] = '2021-01-01'
+        row[cis_mapping.CONTRACT_DESCRIPTION] = 'Benchmark'
+        row[cis_mapping.CREDENTIAL_USERNAME] = f'user{n}'
+        row[cis_mapping.CREDENTIAL_PASSWORD] = f'password{n}'
+        row[cis_mapping.CREDENTIAL_ENABLE_PASSWORD] = f'enable{n}'
+        row[cis_mapping.CREDENTIAL_INSTRUCTIONS] = 'Instructions'
+        cis_sheet.append(row)
+    workbook.create_sheet(cis_mapping.APPLIANCES_SHEET).append(['header'] * 5)
+
+    file = BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
@@ -0,0 +1,17 @@
+# Read by gunicorn from the working directory. See https://docs.gunicorn.org/en/stable/settings.html
+
+# Load the application in the master process, before forking the workers, which share its memory
+preload_app = True
+
+
+def when_ready(server):
+    """Warm the application up once, in the master process, rather than on the first request of each worker"""
+    if server.cfg.preload_app:
+        from cis.warmup import warmup
+        warmup()
+
+
+def worker_exit(server, worker):
+    """Save the last metrics of the worker as it exits, before its interpreter shuts down"""
+    from cis import metrics
+    metrics.flush()
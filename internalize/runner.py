@@ -0,0 +1,24 @@
+"""
+The test runner of the project.
+
+The tests run with the query budgets enforced, and without a cache, as it
+would outlive the rollback of each test. A test of the cache overrides both.
+"""
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    test_settings = override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        CIS_QUERY_BUDGET='raise',
+    )
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
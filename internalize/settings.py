@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 import django_heroku
 import os
+import tempfile
 from pathlib import Path
 from django.contrib.messages import constants as messages
 
@@ -25,6 +26,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('SECRET_KEY', '_zkf47_u&6yyr+b5wq_q0^_@+)%1nrl^vf=)+m4ut@%(^w_jco')
 
+# Keys of the encrypted fields: the first one encrypts, any of them decrypts.
+# 'FERNET_KEYS' should be a single string of keys separated by spaces, SECRET_KEY alone by default.
+# After prepending a new key, re-encrypt the credentials with the command rotate_credential_keys.
+FERNET_KEYS = os.environ['FERNET_KEYS'].split() if 'FERNET_KEYS' in os.environ else [SECRET_KEY]
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = int(os.environ.get('DEBUG', 1))
 
@@ -49,8 +55,6 @@ INSTALLED_APPS = [
     'allauth.account',
     'allauth.socialaccount',
     'crispy_forms',
-    'debug_toolbar',
-    'django_extensions',
 
     # Local
     'accounts',
@@ -61,21 +65,34 @@ MIDDLEWARE = [
     # Simplified static file serving.
     # https://warehouse.python.org/project/whitenoise/
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # latency of the requests, for the metrics. See cis/metrics.py
+    'cis.metrics.MetricsMiddleware',
+    # sampled request telemetry. See CIS_TELEMETRY_SAMPLE_RATE
+    'cis.telemetry.TelemetryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # counts the queries of the views with a budget. See CIS_QUERY_BUDGET
+    'cis.budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # the user of the session, from the cache. See CIS_USER_CACHE_TIMEOUT
+    'accounts.cache.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# development tools, left out of production processes, which would import them for nothing
+if DEBUG:
+    INSTALLED_APPS += ['debug_toolbar', 'django_extensions']
+    MIDDLEWARE += ['debug_toolbar.middleware.DebugToolbarMiddleware']
+
 ROOT_URLCONF = 'internalize.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing the requests sampled by cis.telemetry.TelemetryMiddleware
+        'BACKEND': 'cis.telemetry.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -91,6 +108,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'internalize.wsgi.application'
 
+# query budgets enforced, and no cache. See internalize/runner.py
+TEST_RUNNER = 'internalize.runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -107,6 +127,34 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# LocMemCache is per process: with several, use a cache they share, e.g. memcached, for a user
+# saved or a session logged out in one to be dropped from the cache of the others.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+# the sessions and users are only read from a cache shared by the processes
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Sessions read from the cache, and saved to the database too, with a shared cache, else from the database.
+# 'django.contrib.sessions.backends.signed_cookies' keeps them in the cookie instead, which can't be logged
+# out server side.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', (
+    'django.contrib.sessions.backends.cached_db' if SHARED_CACHE else 'django.contrib.sessions.backends.db'
+))
+
+# Seconds the user of a session, and its client, are kept in the cache, 0 to load them on each request,
+# as without a shared cache. See accounts/cache.py
+CIS_USER_CACHE_TIMEOUT = int(os.environ.get('CIS_USER_CACHE_TIMEOUT', 300 if SHARED_CACHE else 0))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -209,6 +257,48 @@ INTERNAL_IPS = ['127.0.0.1']
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 
+# Bulk approval of CIs in the admin. See cis/approval.py
+# CIs approved per transaction
+CIS_APPROVAL_CHUNK_SIZE = int(os.environ.get('CIS_APPROVAL_CHUNK_SIZE', 1000))
+# above this number of CIs, the approval runs in background
+CIS_APPROVAL_BACKGROUND_THRESHOLD = int(os.environ.get('CIS_APPROVAL_BACKGROUND_THRESHOLD', 10000))
+# seconds after which a job no longer updated is resumed by the command resume_approval_jobs
+CIS_APPROVAL_STALE_AFTER = int(os.environ.get('CIS_APPROVAL_STALE_AFTER', 600))
+
+# Admin changelists of tables too large to count or to list every related object.
+# Estimated row counts, and autocomplete filters. See cis/paginators.py
+CIS_ADMIN_LARGE_CHANGELISTS = os.environ.get('CIS_ADMIN_LARGE_CHANGELISTS', 'False') == 'True'
+# CIs per page of the CI inlines of the place, pack and contract change pages
+CIS_ADMIN_INLINE_PER_PAGE = int(os.environ.get('CIS_ADMIN_INLINE_PER_PAGE', 20))
+
+# Save the values of each credential as a single encrypted record. See cis.models.Credential
+# Existing credentials are converted by the command convert_credentials.
+CIS_CREDENTIAL_RECORDS = os.environ.get('CIS_CREDENTIAL_RECORDS', 'False') == 'True'
+# Key of the blind index of the credential usernames, to look CIs up by username. See cis.models.Credential
+# Unset, no index is kept. After setting or changing it, index the credentials with the command rotate_credential_keys.
+CIS_BLIND_INDEX_KEY = os.environ.get('CIS_BLIND_INDEX_KEY', '')
+
+# Query budgets of the views, counted by cis.budget.QueryBudgetMiddleware. Requests over budget
+# raise QueryBudgetExceeded with 'raise', as in the tests, see internalize/runner.py, are logged
+# with 'log', as with DEBUG, and aren't counted with ''.
+CIS_QUERY_BUDGET = os.environ.get('CIS_QUERY_BUDGET', 'log' if DEBUG else '')
+
+# Sampled request telemetry, a JSON line per request. See cis/telemetry.py
+# share of the requests sampled, from 0, leaving the middleware out, to 1
+CIS_TELEMETRY_SAMPLE_RATE = float(os.environ.get('CIS_TELEMETRY_SAMPLE_RATE', 0))
+# with several processes, give each one its own file, as they'd rotate it at once
+CIS_TELEMETRY_FILE = os.environ.get('CIS_TELEMETRY_FILE', Path(tempfile.gettempdir()) / 'internalize-telemetry.jsonl')
+# size of the file before it's rotated, and number of rotated files kept
+CIS_TELEMETRY_MAX_BYTES = int(os.environ.get('CIS_TELEMETRY_MAX_BYTES', 10 * 1024 * 1024))
+CIS_TELEMETRY_BACKUP_COUNT = int(os.environ.get('CIS_TELEMETRY_BACKUP_COUNT', 5))
+
+# Metrics at /metrics/, in the Prometheus text format. See cis/metrics.py
+# With several processes, e.g. gunicorn workers, a directory where each one saves its values
+# at most every CIS_METRICS_FLUSH_INTERVAL seconds, to be added up. Clear it on restart.
+CIS_METRICS_DIR = os.environ.get('CIS_METRICS_DIR')
+CIS_METRICS_FLUSH_INTERVAL = float(os.environ.get('CIS_METRICS_FLUSH_INTERVAL', 5))
+
+
 # Sets a strict policy to disable many potentially privacy-invading and annoying features for all scripts.
 # https://pypi.org/project/django-permissions-policy/
 
@@ -13,16 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-import debug_toolbar
+from django.apps import apps
 from django.contrib import admin
 from django.urls import path, include
 
-from cis.views import homepage
+from cis.views import homepage, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
     path('', homepage, name='homepage'),
+    path('metrics/', metrics, name='metrics'),
     path('cis/', include('cis.urls')),
-    path('__debug__/', include(debug_toolbar.urls)),
 ]
+
+if apps.is_installed('debug_toolbar'):
+    import debug_toolbar
+    urlpatterns.append(path('__debug__/', include(debug_toolbar.urls)))